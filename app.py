@@ -1,89 +1,196 @@
+import time
+_INICIO_SCRIPT = time.perf_counter()
 import streamlit as st
-import geopandas as gpd
 import pandas as pd
 import numpy as np
 import tempfile
 import os
 import zipfile
+import importlib
+import importlib.util
 from datetime import datetime, timedelta
-import matplotlib.pyplot as plt
-from matplotlib.tri import Triangulation
-import matplotlib.patches as mpatches
-from matplotlib.colors import LinearSegmentedColormap
-from mpl_toolkits.mplot3d import Axes3D
 import io
-from shapely.geometry import Polygon, LineString, Point
+import hashlib
+import threading
+from collections import OrderedDict
+import shapely
+from shapely.geometry import Polygon, LineString
 import math
+import sys
+import sqlite3
 import warnings
 import xml.etree.ElementTree as ET
 import json
+import re
 from io import BytesIO
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
-import geojson
 import requests
-import contextily as ctx
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from nucleo_analisis import (
+    TIEMPOS_IMPORTACION_MS, ModuloPerezoso, huella_geometria, derivar_semilla, preprocesar_geometria,
+    Parcela, como_parcela, mascara_geometria, calcular_pendiente, VARIEDADES_CULTIVOS, PARAMETROS_CULTIVOS,
+    COLUMNAS_COSTOS, COLUMNAS_PROYECCIONES, analizar_zonas, analizar_lote
+)
+_DURACION_IMPORTS_INICIALES = time.perf_counter() - _INICIO_SCRIPT
+
+# ===== IMPORTACIÓN PEREZOSA DE DEPENDENCIAS PESADAS =====
+@st.cache_resource
+def registro_arranque():
+    """Tiempos de importación y de primera ejecución, compartidos por todo el proceso"""
+    return {'modulos_ms': TIEMPOS_IMPORTACION_MS, 'imports_iniciales_ms': None, 'primera_ejecucion_ms': None}
+
+if registro_arranque()['imports_iniciales_ms'] is None:
+    registro_arranque()['imports_iniciales_ms'] = round(_DURACION_IMPORTS_INICIALES * 1000, 1)
+
+gpd = ModuloPerezoso('geopandas')
+plt = ModuloPerezoso('matplotlib.pyplot')
+mcolors = ModuloPerezoso('matplotlib.colors')
+docx = ModuloPerezoso('docx')
+docx_text = ModuloPerezoso('docx.enum.text')
+rasterio = ModuloPerezoso('rasterio')
+rasterio_windows = ModuloPerezoso('rasterio.windows')
+rasterio_merge = ModuloPerezoso('rasterio.merge')
+rasterio_features = ModuloPerezoso('rasterio.features')
+scipy_ndimage = ModuloPerezoso('scipy.ndimage')
+scipy_interpolate = ModuloPerezoso('scipy.interpolate')
+folium = ModuloPerezoso('folium')
+geemap_folium = ModuloPerezoso('geemap.foliumap')
+pyogrio = ModuloPerezoso('pyogrio')
+pyproj = ModuloPerezoso('pyproj')
 
 # ===== IMPORTACIONES GOOGLE EARTH ENGINE (NO MODIFICAR) =====
-try:
-    import ee
-    GEE_AVAILABLE = True
-except ImportError:
-    GEE_AVAILABLE = False
+GEE_AVAILABLE = importlib.util.find_spec('ee') is not None
+if GEE_AVAILABLE:
+    ee = ModuloPerezoso('ee')
+else:
     st.warning("⚠️ Google Earth Engine no está instalado. Para usar datos satelitales reales, instala con: pip install earthengine-api")
 
 warnings.filterwarnings('ignore')
 
 # === INICIALIZACIÓN SEGURA DE GOOGLE EARTH ENGINE (NO MODIFICAR) ===
-def inicializar_gee():
-    """Inicializa GEE con Service Account desde secrets de Streamlit Cloud"""
-    if not GEE_AVAILABLE:
-        return False
-    
-    try:
-        # Intentar con Service Account desde secrets (Streamlit Cloud)
-        gee_secret = os.environ.get('GEE_SERVICE_ACCOUNT')
-        if gee_secret:
-            try:
-                credentials_info = json.loads(gee_secret.strip())
-                credentials = ee.ServiceAccountCredentials(
-                    credentials_info['client_email'],
-                    key_data=json.dumps(credentials_info)
-                )
-                ee.Initialize(credentials, project='ee-mawucano25')
-                st.session_state.gee_authenticated = True
-                st.session_state.gee_project = 'ee-mawucano25'
-                print("✅ GEE inicializado con Service Account")
-                return True
-            except Exception as e:
-                print(f"⚠️ Error con Service Account: {str(e)}")
-        
-        # Fallback: autenticación local (desarrollo en tu Linux)
+GEE_PROYECTO = 'ee-mawucano25'
+GEE_INTERVALO_VERIFICACION_S = 600
+
+class ClienteGEE:
+    """Cliente GEE único por proceso: se inicializa una vez y se verifica periódicamente"""
+
+    def __init__(self, intervalo_verificacion=GEE_INTERVALO_VERIFICACION_S):
+        self.intervalo_verificacion = intervalo_verificacion
+        self.autenticado = False
+        self.proyecto = ''
+        self.metodo = ''
+        self.ultima_verificacion = 0.0
+        self.inicializaciones = 0
+        self.verificaciones = 0
+        self.ultimo_error = ''
+        self._verificando = False
+        self._lock = threading.Lock()
+
+    def _inicializar(self):
+        """Inicializa GEE con Service Account desde secrets de Streamlit Cloud"""
+        self.inicializaciones += 1
+        self.autenticado = False
         try:
-            ee.Initialize(project='ee-mawucano25')
-            st.session_state.gee_authenticated = True
-            st.session_state.gee_project = 'ee-mawucano25'
-            print("✅ GEE inicializado localmente")
-            return True
-        except Exception as e:
-            print(f"⚠️ Error inicialización local: {str(e)}")
+            # Intentar con Service Account desde secrets (Streamlit Cloud)
+            gee_secret = os.environ.get('GEE_SERVICE_ACCOUNT')
+            if gee_secret:
+                try:
+                    credentials_info = json.loads(gee_secret.strip())
+                    credentials = ee.ServiceAccountCredentials(
+                        credentials_info['client_email'],
+                        key_data=json.dumps(credentials_info)
+                    )
+                    ee.Initialize(credentials, project=GEE_PROYECTO)
+                    self.autenticado, self.proyecto, self.metodo = True, GEE_PROYECTO, 'service_account'
+                    print("✅ GEE inicializado con Service Account")
+                except Exception as e:
+                    self.ultimo_error = str(e)
+                    print(f"⚠️ Error con Service Account: {str(e)}")
             
-        st.session_state.gee_authenticated = False
-        return False
+            # Fallback: autenticación local (desarrollo en tu Linux)
+            if not self.autenticado:
+                try:
+                    ee.Initialize(project=GEE_PROYECTO)
+                    self.autenticado, self.proyecto, self.metodo = True, GEE_PROYECTO, 'local'
+                    print("✅ GEE inicializado localmente")
+                except Exception as e:
+                    self.ultimo_error = str(e)
+                    print(f"⚠️ Error inicialización local: {str(e)}")
+        except Exception as e:
+            self.ultimo_error = str(e)
+            print(f"❌ Error crítico GEE: {str(e)}")
         
-    except Exception as e:
-        st.session_state.gee_authenticated = False
-        print(f"❌ Error crítico GEE: {str(e)}")
-        return False
+        self.ultima_verificacion = time.time()
+        return self.autenticado
 
-# Ejecutar inicialización al inicio (ANTES de cualquier uso de ee.*)
-if 'gee_authenticated' not in st.session_state:
-    st.session_state.gee_authenticated = False
-    st.session_state.gee_project = ''
-    if GEE_AVAILABLE:
-        inicializar_gee()
+    def _verificar(self):
+        """Consulta mínima al servidor para comprobar que el token sigue siendo válido; devuelve el error o None"""
+        try:
+            ee.Number(1).getInfo()
+            return None
+        except Exception as e:
+            print(f"⚠️ Verificación GEE fallida, reinicializando: {str(e)}")
+            return str(e)
+
+    def asegurar(self):
+        """Devuelve True si GEE está listo; reinicializa si nunca se hizo o si la verificación falla"""
+        if not GEE_AVAILABLE:
+            return False
+        with self._lock:
+            if not self.autenticado:
+                # Sin credenciales válidas no se reintenta en cada rerun, solo al vencer el intervalo
+                if self.inicializaciones == 0 or time.time() - self.ultima_verificacion >= self.intervalo_verificacion:
+                    self._inicializar()
+                return self.autenticado
+            if self._verificando or time.time() - self.ultima_verificacion < self.intervalo_verificacion:
+                return True
+            self._verificando = True
+            self.verificaciones += 1
+        # La consulta va fuera del lock: una verificación colgada no frena a las demás sesiones,
+        # que siguen usando el cliente actual hasta que termine
+        error = None
+        try:
+            error = self._verificar()
+        finally:
+            with self._lock:
+                self._verificando = False
+                if error is None:
+                    self.ultima_verificacion = time.time()
+                else:
+                    self.ultimo_error = error
+                    self._inicializar()
+        return self.autenticado
+
+    def estadisticas(self):
+        return {
+            'autenticado': self.autenticado,
+            'metodo': self.metodo,
+            'inicializaciones': self.inicializaciones,
+            'verificaciones': self.verificaciones,
+            'ultimo_error': self.ultimo_error
+        }
+
+@st.cache_resource
+def obtener_cliente_gee():
+    """Cliente GEE compartido por todas las sesiones del proceso"""
+    return ClienteGEE()
+
+def inicializar_gee(conectar=True):
+    """Refleja en la sesión el estado del cliente GEE del proceso; con conectar=True lo inicializa si hace falta"""
+    cliente = obtener_cliente_gee()
+    autenticado = cliente.asegurar() if conectar else cliente.autenticado
+    st.session_state.gee_authenticated = autenticado
+    st.session_state.gee_project = cliente.proyecto if autenticado else ''
+    return autenticado
+
+def credenciales_gee_configuradas():
+    """True si hay Service Account en el entorno o credenciales locales de earthengine (sin importar ee)"""
+    return bool(os.environ.get('GEE_SERVICE_ACCOUNT')) or os.path.exists(
+        os.path.expanduser(os.path.join('~', '.config', 'earthengine', 'credentials'))
+    )
+
+# Solo se refleja el estado: GEE (y la importación de ee) se inicializa en la barra lateral si hay credenciales
+inicializar_gee(conectar=False)
 
 # === INICIALIZACIÓN DE VARIABLES DE SESIÓN ===
 if 'reporte_completo' not in st.session_state:
@@ -102,6 +209,8 @@ if 'mapas_generados' not in st.session_state:
     st.session_state.mapas_generados = {}
 if 'dem_data' not in st.session_state:
     st.session_state.dem_data = {}
+if 'resultados_lotes' not in st.session_state:
+    st.session_state.resultados_lotes = {}
 if 'gee_authenticated' not in st.session_state:
     st.session_state.gee_authenticated = False
 if 'gee_project' not in st.session_state:
@@ -469,372 +578,6 @@ SATELITES_DISPONIBLES = {
     }
 }
 
-# ===== CONFIGURACIÓN VARIEDADES CULTIVOS (ACTUALIZADO CON NUEVOS CULTIVOS) =====
-VARIEDADES_CULTIVOS = {
-    'TRIGO': [
-        'ACA 303', 'ACA 315', 'Baguette Premium 11', 'Baguette Premium 13',
-        'Biointa 1005', 'Biointa 2004', 'Klein Don Enrique', 'Klein Guerrero',
-        'Buck Meteoro', 'Buck Poncho', 'SY 110', 'SY 200'
-    ],
-    'MAIZ': [
-        'DK 72-10', 'DK 73-20', 'Pioneer 30F53', 'Pioneer 30F35',
-        'Syngenta AG 6800', 'Syngenta AG 8088', 'Dow 2A610', 'Dow 2B710',
-        'Nidera 8710', 'Nidera 8800', 'Morgan 360', 'Morgan 390'
-    ],
-    'SORGO': [
-        'Advanta AS 5405', 'Advanta AS 5505', 'Pioneer 84G62', 'Pioneer 85G96',
-        'DEKALB 53-67', 'DEKALB 55-00', 'MACER S-10', 'MACER S-15',
-        'Sorgocer 105', 'Sorgocer 110', 'Río IV 100', 'Río IV 110'
-    ],
-    'SOJA': [
-        'DM 53i52', 'DM 58i62', 'Nidera 49X', 'Nidera 52X',
-        'Don Mario 49X', 'Don Mario 52X', 'SYNGENTA 4.9i', 'SYNGENTA 5.2i',
-        'Biosoys 4.9', 'Biosoys 5.2', 'ACA 49', 'ACA 52'
-    ],
-    'GIRASOL': [
-        'ACA 884', 'ACA 887', 'Nidera 7120', 'Nidera 7150',
-        'Syngenta 390', 'Syngenta 410', 'Pioneer 64A15', 'Pioneer 65A25',
-        'Advanta G 100', 'Advanta G 110', 'Biosun 400', 'Biosun 420'
-    ],
-    'MANI': [
-        'ASEM 400', 'ASEM 500', 'Granoleico', 'Guasu',
-        'Florman INTA', 'Elena', 'Colorado Irradiado', 'Overo Colorado',
-        'Runner 886', 'Runner 890', 'Tegua', 'Virginia 98R'
-    ],
-    # NUEVOS CULTIVOS AGREGADOS
-    'VID': [
-        'Malbec', 'Cabernet Sauvignon', 'Merlot', 'Syrah', 'Chardonnay',
-        'Torrontés', 'Bonarda', 'Tempranillo', 'Sangiovese', 'Pinot Noir',
-        'Chenin', 'Sauvignon Blanc', 'Viognier', 'Carménère', 'Petit Verdot'
-    ],
-    'OLIVO': [
-        'Arbequina', 'Picual', 'Manzanilla', 'Hojiblanca', 'Cornicabra',
-        'Empeltre', 'Frantoio', 'Leccino', 'Coratina', 'Picholine',
-        'Kalamata', 'Mission', 'Ascolano', 'Barnea', 'Arbosana'
-    ],
-    'ALMENDRO': [
-        'Non Pareil', 'Carmel', 'Butte', 'Padre', 'Mission',
-        'Fritz', 'Monterey', 'Price', 'Aldrich', 'Wood Colony',
-        'Peerless', 'Thompson', 'Livingston', 'Sonora', 'Winters'
-    ],
-    'BANANO': [
-        'Cavendish', 'Gros Michel', 'Plátano', 'Manzano', 'Rojo',
-        'Morado', 'Baby Banana', 'Blue Java', 'Goldfinger', 'Pisang Awak',
-        'Mysore', 'Saba', 'Lakatan', 'Señorita', 'Dwarf Cavendish'
-    ],
-    'CAFE': [
-        'Arabica', 'Robusta', 'Liberica', 'Excelsa', 'Typica',
-        'Bourbon', 'Caturra', 'Catuai', 'Mundo Novo', 'Maragogipe',
-        'Geisha', 'Pacamara', 'SL-28', 'SL-34', 'Kona'
-    ],
-    'CACAO': [
-        'Forastero', 'Criollo', 'Trinitario', 'Nacional', 'Amelonado',
-        'Contamana', 'Marañón', 'Porcelana', 'Chuao', 'Carenero',
-        'Ocumare', 'Cundeamor', 'ICS-95', 'UF-613', 'TSH-565'
-    ],
-    'PALMA_ACEITERA': [
-        'Tenera', 'Dura', 'Pisifera', 'DxP', 'Yangambi',
-        'AVROS', 'La Mé', 'Ekona', 'Calabar', 'NIFOR',
-        'MARDI', 'CIRAD', 'ASD Costa Rica', 'Dami', 'Socfindo'
-    ]
-}
-
-# ===== CONFIGURACIÓN PARÁMETROS CULTIVOS (ACTUALIZADO) =====
-PARAMETROS_CULTIVOS = {
-    'TRIGO': {
-        'NITROGENO': {'min': 100, 'max': 180},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 90, 'max': 150},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.28,
-        'NDVI_OPTIMO': 0.75,
-        'NDRE_OPTIMO': 0.40,
-        'RENDIMIENTO_OPTIMO': 4500,
-        'COSTO_FERTILIZACION': 350,
-        'PRECIO_VENTA': 0.25,
-        'VARIEDADES': VARIEDADES_CULTIVOS['TRIGO'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'MAIZ': {
-        'NITROGENO': {'min': 150, 'max': 250},
-        'FOSFORO': {'min': 50, 'max': 90},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 3.8,
-        'HUMEDAD_OPTIMA': 0.32,
-        'NDVI_OPTIMO': 0.80,
-        'NDRE_OPTIMO': 0.45,
-        'RENDIMIENTO_OPTIMO': 8500,
-        'COSTO_FERTILIZACION': 550,
-        'PRECIO_VENTA': 0.20,
-        'VARIEDADES': VARIEDADES_CULTIVOS['MAIZ'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste', 'Cuyo']
-    },
-    'SORGO': {
-        'NITROGENO': {'min': 80, 'max': 140},
-        'FOSFORO': {'min': 35, 'max': 65},
-        'POTASIO': {'min': 100, 'max': 180},
-        'MATERIA_ORGANICA_OPTIMA': 3.0,
-        'HUMEDAD_OPTIMA': 0.25,
-        'NDVI_OPTIMO': 0.70,
-        'NDRE_OPTIMO': 0.35,
-        'RENDIMIENTO_OPTIMO': 5000,
-        'COSTO_FERTILIZACION': 300,
-        'PRECIO_VENTA': 0.18,
-        'VARIEDADES': VARIEDADES_CULTIVOS['SORGO'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'SOJA': {
-        'NITROGENO': {'min': 20, 'max': 40},
-        'FOSFORO': {'min': 45, 'max': 85},
-        'POTASIO': {'min': 140, 'max': 220},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.30,
-        'NDVI_OPTIMO': 0.78,
-        'NDRE_OPTIMO': 0.42,
-        'RENDIMIENTO_OPTIMO': 3200,
-        'COSTO_FERTILIZACION': 400,
-        'PRECIO_VENTA': 0.45,
-        'VARIEDADES': VARIEDADES_CULTIVOS['SOJA'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'GIRASOL': {
-        'NITROGENO': {'min': 70, 'max': 120},
-        'FOSFORO': {'min': 40, 'max': 75},
-        'POTASIO': {'min': 110, 'max': 190},
-        'MATERIA_ORGANICA_OPTIMA': 3.2,
-        'HUMEDAD_OPTIMA': 0.26,
-        'NDVI_OPTIMO': 0.72,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 2800,
-        'COSTO_FERTILIZACION': 320,
-        'PRECIO_VENTA': 0.35,
-        'VARIEDADES': VARIEDADES_CULTIVOS['GIRASOL'],
-        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
-    },
-    'MANI': {
-        'NITROGENO': {'min': 15, 'max': 30},
-        'FOSFORO': {'min': 50, 'max': 90},
-        'POTASIO': {'min': 80, 'max': 140},
-        'MATERIA_ORGANICA_OPTIMA': 2.8,
-        'HUMEDAD_OPTIMA': 0.22,
-        'NDVI_OPTIMO': 0.68,
-        'NDRE_OPTIMO': 0.32,
-        'RENDIMIENTO_OPTIMO': 3800,
-        'COSTO_FERTILIZACION': 380,
-        'PRECIO_VENTA': 0.60,
-        'VARIEDADES': VARIEDADES_CULTIVOS['MANI'],
-        'ZONAS_ARGENTINA': ['Córdoba', 'San Luis', 'La Pampa']
-    },
-    # NUEVOS CULTIVOS AGREGADOS
-    'VID': {
-        'NITROGENO': {'min': 60, 'max': 120},
-        'FOSFORO': {'min': 30, 'max': 70},
-        'POTASIO': {'min': 150, 'max': 250},
-        'MATERIA_ORGANICA_OPTIMA': 2.5,
-        'HUMEDAD_OPTIMA': 0.35,
-        'NDVI_OPTIMO': 0.65,
-        'NDRE_OPTIMO': 0.35,
-        'RENDIMIENTO_OPTIMO': 15000,  # kg/ha de uva
-        'COSTO_FERTILIZACION': 800,
-        'PRECIO_VENTA': 0.80,  # USD/kg uva
-        'VARIEDADES': VARIEDADES_CULTIVOS['VID'],
-        'ZONAS_ARGENTINA': ['Mendoza', 'San Juan', 'La Rioja', 'Salta']
-    },
-    'OLIVO': {
-        'NITROGENO': {'min': 40, 'max': 100},
-        'FOSFORO': {'min': 20, 'max': 50},
-        'POTASIO': {'min': 100, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 2.0,
-        'HUMEDAD_OPTIMA': 0.25,
-        'NDVI_OPTIMO': 0.60,
-        'NDRE_OPTIMO': 0.30,
-        'RENDIMIENTO_OPTIMO': 8000,  # kg/ha de aceituna
-        'COSTO_FERTILIZACION': 600,
-        'PRECIO_VENTA': 1.20,  # USD/kg aceituna
-        'VARIEDADES': VARIEDADES_CULTIVOS['OLIVO'],
-        'ZONAS_ARGENTINA': ['La Rioja', 'Catamarca', 'San Juan', 'Mendoza']
-    },
-    'ALMENDRO': {
-        'NITROGENO': {'min': 80, 'max': 160},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 2.2,
-        'HUMEDAD_OPTIMA': 0.30,
-        'NDVI_OPTIMO': 0.62,
-        'NDRE_OPTIMO': 0.32,
-        'RENDIMIENTO_OPTIMO': 3000,  # kg/ha de almendra
-        'COSTO_FERTILIZACION': 700,
-        'PRECIO_VENTA': 4.50,  # USD/kg almendra
-        'VARIEDADES': VARIEDADES_CULTIVOS['ALMENDRO'],
-        'ZONAS_ARGENTINA': ['Río Negro', 'Neuquén', 'Mendoza', 'San Juan']
-    },
-    'BANANO': {
-        'NITROGENO': {'min': 200, 'max': 350},
-        'FOSFORO': {'min': 60, 'max': 120},
-        'POTASIO': {'min': 300, 'max': 500},
-        'MATERIA_ORGANICA_OPTIMA': 4.0,
-        'HUMEDAD_OPTIMA': 0.45,
-        'NDVI_OPTIMO': 0.78,
-        'NDRE_OPTIMO': 0.40,
-        'RENDIMIENTO_OPTIMO': 40000,  # kg/ha de banano
-        'COSTO_FERTILIZACION': 1200,
-        'PRECIO_VENTA': 0.30,  # USD/kg banano
-        'VARIEDADES': VARIEDADES_CULTIVOS['BANANO'],
-        'ZONAS_ARGENTINA': ['Formosa', 'Misiones', 'Corrientes']
-    },
-    'CAFE': {
-        'NITROGENO': {'min': 100, 'max': 200},
-        'FOSFORO': {'min': 40, 'max': 80},
-        'POTASIO': {'min': 150, 'max': 250},
-        'MATERIA_ORGANICA_OPTIMA': 3.5,
-        'HUMEDAD_OPTIMA': 0.40,
-        'NDVI_OPTIMO': 0.70,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 2000,  # kg/ha de café verde
-        'COSTO_FERTILIZACION': 900,
-        'PRECIO_VENTA': 3.50,  # USD/kg café
-        'VARIEDADES': VARIEDADES_CULTIVOS['CAFE'],
-        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Jujuy']
-    },
-    'CACAO': {
-        'NITROGENO': {'min': 80, 'max': 150},
-        'FOSFORO': {'min': 30, 'max': 60},
-        'POTASIO': {'min': 120, 'max': 200},
-        'MATERIA_ORGANICA_OPTIMA': 4.0,
-        'HUMEDAD_OPTIMA': 0.50,
-        'NDVI_OPTIMO': 0.72,
-        'NDRE_OPTIMO': 0.38,
-        'RENDIMIENTO_OPTIMO': 1500,  # kg/ha de cacao seco
-        'COSTO_FERTILIZACION': 850,
-        'PRECIO_VENTA': 5.00,  # USD/kg cacao
-        'VARIEDADES': VARIEDADES_CULTIVOS['CACAO'],
-        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Formosa']
-    },
-    'PALMA_ACEITERA': {
-        'NITROGENO': {'min': 150, 'max': 250},
-        'FOSFORO': {'min': 50, 'max': 100},
-        'POTASIO': {'min': 200, 'max': 350},
-        'MATERIA_ORGANICA_OPTIMA': 3.8,
-        'HUMEDAD_OPTIMA': 0.55,
-        'NDVI_OPTIMO': 0.75,
-        'NDRE_OPTIMO': 0.42,
-        'RENDIMIENTO_OPTIMO': 20000,  # kg/ha de racimos
-        'COSTO_FERTILIZACION': 1100,
-        'PRECIO_VENTA': 0.40,  # USD/kg aceite
-        'VARIEDADES': VARIEDADES_CULTIVOS['PALMA_ACEITERA'],
-        'ZONAS_ARGENTINA': ['Formosa', 'Chaco', 'Misiones']
-    }
-}
-
-# ===== CONFIGURACIÓN TEXTURA SUELO ÓPTIMA (ACTUALIZADO) =====
-TEXTURA_SUELO_OPTIMA = {
-    'TRIGO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 35,
-        'limo_optima': 40,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.35,
-        'porosidad_optima': 0.48
-    },
-    'MAIZ': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.30,
-        'porosidad_optima': 0.50
-    },
-    'SORGO': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 55,
-        'limo_optima': 30,
-        'arcilla_optima': 15,
-        'densidad_aparente_optima': 1.40,
-        'porosidad_optima': 0.45
-    },
-    'SOJA': {
-        'textura_optima': 'Franco',
-        'arena_optima': 40,
-        'limo_optima': 40,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.25,
-        'porosidad_optima': 0.52
-    },
-    'GIRASOL': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 30,
-        'limo_optima': 45,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.32,
-        'porosidad_optima': 0.49
-    },
-    'MANI': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 60,
-        'limo_optima': 25,
-        'arcilla_optima': 15,
-        'densidad_aparente_optima': 1.38,
-        'porosidad_optima': 0.46
-    },
-    # NUEVOS CULTIVOS AGREGADOS
-    'VID': {
-        'textura_optima': 'Franco-arenoso',
-        'arena_optima': 50,
-        'limo_optima': 30,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.40,
-        'porosidad_optima': 0.50
-    },
-    'OLIVO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 40,
-        'limo_optima': 35,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.35,
-        'porosidad_optima': 0.48
-    },
-    'ALMENDRO': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.38,
-        'porosidad_optima': 0.47
-    },
-    'BANANO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 35,
-        'limo_optima': 40,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.20,
-        'porosidad_optima': 0.55
-    },
-    'CAFE': {
-        'textura_optima': 'Franco',
-        'arena_optima': 40,
-        'limo_optima': 40,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.25,
-        'porosidad_optima': 0.52
-    },
-    'CACAO': {
-        'textura_optima': 'Franco-arcilloso',
-        'arena_optima': 30,
-        'limo_optima': 45,
-        'arcilla_optima': 25,
-        'densidad_aparente_optima': 1.15,
-        'porosidad_optima': 0.56
-    },
-    'PALMA_ACEITERA': {
-        'textura_optima': 'Franco',
-        'arena_optima': 45,
-        'limo_optima': 35,
-        'arcilla_optima': 20,
-        'densidad_aparente_optima': 1.30,
-        'porosidad_optima': 0.51
-    }
-}
-
 # ===== ICONOS Y COLORES PARA CULTIVOS (ACTUALIZADO) =====
 ICONOS_CULTIVOS = {
     'TRIGO': '🌾',
@@ -947,7 +690,9 @@ with st.sidebar:
         variedad = "No especificada"
         st.caption(f"ℹ️ Sin variedades predefinidas para {cultivo}")
     
-    # Estado de GEE
+    # Estado de GEE (solo se conecta, e importa ee, si hay credenciales configuradas)
+    if GEE_AVAILABLE and credenciales_gee_configuradas():
+        inicializar_gee()
     st.subheader("🌍 Google Earth Engine")
     if st.session_state.gee_authenticated:
         st.success(f"✅ Autenticado\nProyecto: {st.session_state.gee_project}")
@@ -987,7 +732,19 @@ with st.sidebar:
     fecha_inicio = st.date_input("Fecha inicio", datetime.now() - timedelta(days=30))
 
     st.subheader("🎯 División de Parcela")
-    n_divisiones = st.slider("Número de zonas de manejo:", min_value=16, max_value=48, value=32)
+    modo_division = st.radio("Modo de división:", ["Número de zonas", "Tamaño de celda (m)", "Clústeres (terreno)"], horizontal=True)
+    zonificacion = 'clusteres' if modo_division == "Clústeres (terreno)" else 'grilla'
+    if modo_division == "Número de zonas":
+        n_divisiones = st.slider("Número de zonas de manejo:", min_value=16, max_value=48, value=32)
+        tamano_celda_m = None
+    elif modo_division == "Clústeres (terreno)":
+        n_divisiones = st.slider("Número de zonas de manejo:", min_value=2, max_value=12, value=5,
+                                 help="Zonas delineadas agrupando píxeles por elevación y pendiente")
+        tamano_celda_m = None
+    else:
+        tamano_celda_m = st.number_input("Lado de celda (metros):", min_value=5.0, max_value=2000.0, value=100.0, step=5.0,
+                                         help="Por ejemplo, un múltiplo del ancho de labor del implemento")
+        n_divisiones = 0
 
     st.subheader("🏔️ Configuración Curvas de Nivel")
     intervalo_curvas = st.slider("Intervalo entre curvas (metros):", 1.0, 20.0, 5.0, 1.0)
@@ -1002,9 +759,194 @@ with st.sidebar:
     
     usar_datos_reales = fuente_dem in ["NASA SRTM (Datos Reales)", "ASTER GDEM"]
 
+    st.subheader("🗺️ Mapa Base")
+    modo_offline_basemap = st.checkbox(
+        "Modo sin conexión (solo teselas en caché)",
+        value=os.environ.get('ANALIZADOR_BASEMAP_OFFLINE', '0') == '1',
+        help="Usa únicamente las teselas de imagen satelital ya descargadas"
+    )
+
     st.subheader("📤 Subir Parcela")
-    uploaded_file = st.file_uploader("Subir archivo de tu parcela", type=['zip', 'kml', 'kmz'],
-                                     help="Formatos aceptados: Shapefile (.zip), KML (.kml), KMZ (.kmz)")
+    uploaded_file = st.file_uploader("Subir archivo de tu parcela",
+                                     type=['zip', 'kml', 'kmz', 'gpkg', 'parquet', 'geoparquet', 'fgb'],
+                                     help="Formatos aceptados: Shapefile (.zip), KML (.kml), KMZ (.kmz), "
+                                          "GeoPackage (.gpkg), GeoParquet (.parquet) y FlatGeobuf (.fgb)")
+    
+    modo_lotes = st.checkbox("🧩 Analizar cada lote por separado", value=False,
+                             help="Mantiene cada polígono del archivo como un lote y ejecuta el análisis completo para cada uno")
+    
+    filtros_lectura = {}
+    with st.expander("🔎 Filtrar lotes al leer (GeoPackage / GeoParquet / FlatGeobuf)"):
+        texto_bbox = st.text_input("Extensión (lon_min, lat_min, lon_max, lat_max):", "",
+                                   help="Solo se leen los lotes que intersecan esta extensión")
+        filtro_atributos = st.text_input("Filtro de atributos:", "",
+                                         help="Ej.: lote = 'A12' AND campania = 2025")
+        capa_lectura = st.text_input("Capa (GeoPackage con varias capas):", "")
+        if texto_bbox.strip():
+            try:
+                valores_bbox = tuple(float(v) for v in texto_bbox.replace(';', ',').split(','))
+                if len(valores_bbox) != 4:
+                    raise ValueError
+                filtros_lectura['bbox'] = valores_bbox
+            except ValueError:
+                st.warning("⚠️ Extensión inválida: se esperan 4 números separados por comas")
+        if filtro_atributos.strip():
+            filtros_lectura['where'] = filtro_atributos.strip()
+        if capa_lectura.strip():
+            filtros_lectura['capa'] = capa_lectura.strip()
+
+# ===== CACHÉS EN MEMORIA COMPARTIDAS ENTRE RERUNS Y SESIONES =====
+DIRECTORIO_CACHE = os.environ.get(
+    'ANALIZADOR_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'analizador_multicultivo_cache')
+)
+CACHE_PARCELAS_MAX_ENTRADAS = 16
+CACHE_PARCELAS_MAX_MB = 256
+CACHE_GEE_TTL_HORAS = 24
+CACHE_RENDERS_MAX_ENTRADAS = 64
+CACHE_RENDERS_MAX_MB = 128
+BASEMAP_URL = 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'
+BASEMAP_ATRIBUCION = ('Tiles (C) Esri -- Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, '
+                      'Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community')
+BASEMAP_MAX_MB = 512
+BASEMAP_MAX_TESELAS = 36
+BASEMAP_ZOOM_MAX = 19
+
+def estimar_tamano_bytes(obj):
+    """Estimación aproximada de la memoria ocupada por un objeto cacheado"""
+    try:
+        if obj is None:
+            return 0
+        if isinstance(obj, (bytes, bytearray)):
+            return len(obj)
+        if isinstance(obj, np.ndarray):
+            return int(obj.nbytes)
+        if isinstance(obj, shapely.Geometry):
+            return int(shapely.get_num_coordinates(obj)) * 16 + 64
+        if isinstance(obj, Parcela):
+            # Incluye las proyecciones y uniones ya calculadas (cached_property)
+            return sum(estimar_tamano_bytes(v) for v in vars(obj).values())
+        if hasattr(obj, 'memory_usage'):
+            total = int(obj.memory_usage(deep=True).sum())
+            if hasattr(obj, 'geometry'):
+                # Las coordenadas viven fuera de pandas: 16 bytes por vértice 2D
+                total += int(shapely.get_num_coordinates(np.asarray(obj.geometry)).sum()) * 16
+            return total
+        if isinstance(obj, dict):
+            return sum(estimar_tamano_bytes(v) for v in obj.values())
+        if isinstance(obj, (list, tuple)):
+            return sum(estimar_tamano_bytes(v) for v in obj)
+        return sys.getsizeof(obj)
+    except Exception:
+        return sys.getsizeof(obj)
+
+class CacheLRU:
+    """Caché LRU acotada por número de entradas y por memoria total"""
+
+    def __init__(self, max_entradas=32, max_bytes=128 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()
+        self._tamanos = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return self._datos[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, valor, tamano=None):
+        if tamano is None:
+            tamano = estimar_tamano_bytes(valor)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._datos:
+                self._bytes -= self._tamanos.pop(clave)
+                del self._datos[clave]
+            self._datos[clave] = valor
+            self._tamanos[clave] = tamano
+            self._bytes += tamano
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                clave_antigua, _ = self._datos.popitem(last=False)
+                self._bytes -= self._tamanos.pop(clave_antigua)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._tamanos.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._datos),
+                'memoria_mb': round(self._bytes / (1024 * 1024), 2),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos
+            }
+
+class CachePersistenteTTL:
+    """Caché clave-valor (JSON) persistida en SQLite con tiempo de vida por entrada"""
+
+    def __init__(self, ruta, ttl_segundos):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self.aciertos = 0
+        self.fallos = 0
+        with self._conectar() as con:
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS cache (clave TEXT PRIMARY KEY, valor TEXT NOT NULL, creado REAL NOT NULL)'
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def obtener(self, clave):
+        with self._conectar() as con:
+            fila = con.execute('SELECT valor, creado FROM cache WHERE clave = ?', (clave,)).fetchone()
+        if fila is None or time.time() - fila[1] > self.ttl_segundos:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave, valor):
+        with self._conectar() as con:
+            con.execute(
+                'INSERT OR REPLACE INTO cache (clave, valor, creado) VALUES (?, ?, ?)',
+                (clave, json.dumps(valor, default=str), time.time())
+            )
+            con.execute('DELETE FROM cache WHERE creado < ?', (time.time() - self.ttl_segundos,))
+
+    def estadisticas(self):
+        with self._conectar() as con:
+            entradas = con.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'entradas': entradas, 'aciertos': self.aciertos, 'fallos': self.fallos}
+
+@st.cache_resource
+def obtener_cache_parcelas():
+    """Caché de parcelas ya ingeridas (EPSG:4326), indexada por hash del archivo subido"""
+    return CacheLRU(
+        max_entradas=CACHE_PARCELAS_MAX_ENTRADAS,
+        max_bytes=CACHE_PARCELAS_MAX_MB * 1024 * 1024
+    )
+
+@st.cache_resource
+def obtener_cache_renders():
+    """Caché de mapas ya renderizados (bytes PNG), indexada por huella de resultados y parámetros"""
+    return CacheLRU(
+        max_entradas=CACHE_RENDERS_MAX_ENTRADAS,
+        max_bytes=CACHE_RENDERS_MAX_MB * 1024 * 1024
+    )
+
 # ===== FUNCIONES AUXILIARES - CORREGIDAS PARA EPSG:4326 =====
 def validar_y_corregir_crs(gdf):
     if gdf is None or len(gdf) == 0:
@@ -1026,125 +968,127 @@ def calcular_superficie(gdf):
     try:
         if gdf is None or len(gdf) == 0:
             return 0.0
-        gdf = validar_y_corregir_crs(gdf)
-        bounds = gdf.total_bounds
+        parcela = como_parcela(gdf)
+        gdf = parcela.gdf
+        bounds = parcela.bounds
         if bounds[0] < -180 or bounds[2] > 180 or bounds[1] < -90 or bounds[3] > 90:
             st.warning("⚠️ Coordenadas fuera de rango para cálculo preciso de área")
             area_grados2 = gdf.geometry.area.sum()
             area_m2 = area_grados2 * 111000 * 111000
             return area_m2 / 10000
-        gdf_projected = gdf.to_crs('EPSG:3857')
-        area_m2 = gdf_projected.geometry.area.sum()
-        return area_m2 / 10000
+        return parcela.area_ha
     except Exception as e:
         try:
             return gdf.geometry.area.sum() / 10000
         except:
             return 0.0
 
-def dividir_parcela_en_zonas(gdf, n_zonas):
-    if len(gdf) == 0:
-        return gdf
-    gdf = validar_y_corregir_crs(gdf)
-    parcela_principal = gdf.iloc[0].geometry
-    bounds = parcela_principal.bounds
-    minx, miny, maxx, maxy = bounds
-    sub_poligonos = []
-    n_cols = math.ceil(math.sqrt(n_zonas))
-    n_rows = math.ceil(n_zonas / n_cols)
-    width = (maxx - minx) / n_cols
-    height = (maxy - miny) / n_rows
-    for i in range(n_rows):
-        for j in range(n_cols):
-            if len(sub_poligonos) >= n_zonas:
-                break
-            cell_minx = minx + (j * width)
-            cell_maxx = minx + ((j + 1) * width)
-            cell_miny = miny + (i * height)
-            cell_maxy = miny + ((i + 1) * height)
-            cell_poly = Polygon([(cell_minx, cell_miny), (cell_maxx, cell_miny), (cell_maxx, cell_maxy), (cell_minx, cell_maxy)])
-            intersection = parcela_principal.intersection(cell_poly)
-            if not intersection.is_empty and intersection.area > 0:
-                sub_poligonos.append(intersection)
-    if sub_poligonos:
-        nuevo_gdf = gpd.GeoDataFrame({'id_zona': range(1, len(sub_poligonos) + 1), 'geometry': sub_poligonos}, crs='EPSG:4326')
-        return nuevo_gdf
-    else:
-        return gdf
-
 # ===== FUNCIONES PARA CARGAR ARCHIVOS =====
+LECTURA_ARROW_DISPONIBLE = importlib.util.find_spec('pyarrow') is not None
+EXTENSIONES_VECTORIALES_ZIP = ('.gpkg', '.geojson', '.json', '.fgb', '.kml')
+
+def leer_vectorial_en_memoria(datos, layer=None, **filtros):
+    """Lee una capa vectorial desde bytes vía /vsimem de GDAL (pyogrio), con Arrow si está disponible"""
+    if LECTURA_ARROW_DISPONIBLE:
+        try:
+            return pyogrio.read_dataframe(datos, layer=layer, use_arrow=True, **filtros)
+        except Exception as e:
+            print(f"⚠️ Lectura Arrow fallida, reintentando sin Arrow: {str(e)}")
+    return pyogrio.read_dataframe(datos, layer=layer, **filtros)
+
 def cargar_shapefile_desde_zip(zip_file):
+    """Lee el shapefile (o la primera capa vectorial) del ZIP subido sin extraerlo a disco"""
     try:
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                zip_ref.extractall(tmp_dir)
-            shp_files = [f for f in os.listdir(tmp_dir) if f.endswith('.shp')]
+        contenido = zip_file.getvalue() if hasattr(zip_file, 'getvalue') else zip_file.read()
+        with zipfile.ZipFile(io.BytesIO(contenido), 'r') as zip_ref:
+            nombres = [n for n in zip_ref.namelist()
+                       if not n.endswith('/') and not n.startswith('__MACOSX')]
+            shp_files = sorted(n for n in nombres if n.lower().endswith('.shp'))
             if shp_files:
-                shp_path = os.path.join(tmp_dir, shp_files[0])
-                gdf = gpd.read_file(shp_path)
-                gdf = validar_y_corregir_crs(gdf)
-                return gdf
+                base = os.path.splitext(shp_files[0])[0]
+                if '/' not in base:
+                    # Shapefile en la raíz: GDAL lo abre directamente con /vsizip/ sobre los bytes subidos
+                    gdf = leer_vectorial_en_memoria(contenido, layer=base)
+                else:
+                    # Shapefile en una subcarpeta: se reempaquetan sus archivos en un ZIP plano en memoria
+                    plano = io.BytesIO()
+                    with zipfile.ZipFile(plano, 'w', zipfile.ZIP_STORED) as zip_plano:
+                        for nombre in nombres:
+                            if os.path.splitext(nombre)[0] == base:
+                                zip_plano.writestr(os.path.basename(nombre), zip_ref.read(nombre))
+                    gdf = leer_vectorial_en_memoria(plano.getvalue())
             else:
-                st.error("❌ No se encontró ningún archivo .shp en el ZIP")
-                return None
+                otras_capas = sorted(n for n in nombres if n.lower().endswith(EXTENSIONES_VECTORIALES_ZIP))
+                if not otras_capas:
+                    st.error("❌ No se encontró ningún archivo .shp en el ZIP")
+                    return None
+                gdf = leer_vectorial_en_memoria(zip_ref.read(otras_capas[0]))
+        gdf = validar_y_corregir_crs(gdf)
+        return gdf
     except Exception as e:
         st.error(f"❌ Error cargando shapefile desde ZIP: {str(e)}")
         return None
 
+def coordenadas_kml(texto):
+    """Convierte un bloque <coordinates> (lon,lat[,alt] ...) en un array (n, 2) de una sola vez"""
+    tuplas = texto.split()
+    if not tuplas:
+        return np.empty((0, 2))
+    dimension = tuplas[0].count(',') + 1
+    valores = np.array(texto.replace(',', ' ').split(), dtype=np.float64)
+    if dimension >= 2 and valores.size == len(tuplas) * dimension:
+        return valores.reshape(-1, dimension)[:, :2]
+    # Tuplas con dimensión mixta (con y sin altitud): decodificación tupla a tupla
+    coords = [t.split(',')[:2] for t in tuplas if t.count(',') >= 1]
+    return np.array(coords, dtype=np.float64).reshape(-1, 2)
+
 def parsear_kml_manual(contenido_kml):
+    """Parser KML en streaming (iterparse): polígonos con anillos interiores, sin cargar todo el árbol"""
     try:
-        root = ET.fromstring(contenido_kml)
-        namespaces = {'kml': 'http://www.opengis.net/kml/2.2'}
+        if isinstance(contenido_kml, str):
+            contenido_kml = contenido_kml.encode('utf-8')
+        if isinstance(contenido_kml, (bytes, bytearray)):
+            contenido_kml = io.BytesIO(contenido_kml)
+        
         polygons = []
-        for polygon_elem in root.findall('.//kml:Polygon', namespaces):
-            coords_elem = polygon_elem.find('.//kml:coordinates', namespaces)
-            if coords_elem is not None and coords_elem.text:
-                coord_text = coords_elem.text.strip()
-                coord_list = []
-                for coord_pair in coord_text.split():
-                    parts = coord_pair.split(',')
-                    if len(parts) >= 2:
-                        lon = float(parts[0])
-                        lat = float(parts[1])
-                        coord_list.append((lon, lat))
-                if len(coord_list) >= 3:
-                    polygons.append(Polygon(coord_list))
+        alternativos = []
+        pila = []
+        exterior, interiores = None, []
+        alternativo_placemark = None
+        for evento, elem in ET.iterparse(contenido_kml, events=('start', 'end')):
+            etiqueta = elem.tag.rsplit('}', 1)[-1]
+            if evento == 'start':
+                pila.append(etiqueta)
+                if etiqueta == 'Polygon':
+                    exterior, interiores = None, []
+                elif etiqueta == 'Placemark':
+                    alternativo_placemark = None
+                continue
+            
+            pila.pop()
+            if etiqueta == 'coordinates':
+                coords = coordenadas_kml(elem.text or '')
+                if 'outerBoundaryIs' in pila:
+                    exterior = coords
+                elif 'innerBoundaryIs' in pila:
+                    if len(coords) >= 3:
+                        interiores.append(coords)
+                elif 'Placemark' in pila and alternativo_placemark is None and len(coords) >= 3:
+                    # LineString/LinearRing/Point sueltos: solo se usan si el KML no trae polígonos
+                    alternativo_placemark = coords
+                elem.clear()
+            elif etiqueta == 'Polygon':
+                if exterior is not None and len(exterior) >= 3:
+                    polygons.append(Polygon(exterior, interiores))
+                exterior, interiores = None, []
+            elif etiqueta == 'Placemark':
+                if alternativo_placemark is not None:
+                    alternativos.append(Polygon(alternativo_placemark))
+                alternativo_placemark = None
+                elem.clear()
+        
         if not polygons:
-            for multi_geom in root.findall('.//kml:MultiGeometry', namespaces):
-                for polygon_elem in multi_geom.findall('.//kml:Polygon', namespaces):
-                    coords_elem = polygon_elem.find('.//kml:coordinates', namespaces)
-                    if coords_elem is not None and coords_elem.text:
-                        coord_text = coords_elem.text.strip()
-                        coord_list = []
-                        for coord_pair in coord_text.split():
-                            parts = coord_pair.split(',')
-                            if len(parts) >= 2:
-                                lon = float(parts[0])
-                                lat = float(parts[1])
-                                coord_list.append((lon, lat))
-                        if len(coord_list) >= 3:
-                            polygons.append(Polygon(coord_list))
-        if polygons:
-            gdf = gpd.GeoDataFrame({'geometry': polygons}, crs='EPSG:4326')
-            return gdf
-        else:
-            for placemark in root.findall('.//kml:Placemark', namespaces):
-                for elem_name in ['Polygon', 'LineString', 'Point', 'LinearRing']:
-                    elem = placemark.find(f'.//kml:{elem_name}', namespaces)
-                    if elem is not None:
-                        coords_elem = elem.find('.//kml:coordinates', namespaces)
-                        if coords_elem is not None and coords_elem.text:
-                            coord_text = coords_elem.text.strip()
-                            coord_list = []
-                            for coord_pair in coord_text.split():
-                                parts = coord_pair.split(',')
-                                if len(parts) >= 2:
-                                    lon = float(parts[0])
-                                    lat = float(parts[1])
-                                    coord_list.append((lon, lat))
-                            if len(coord_list) >= 3:
-                                polygons.append(Polygon(coord_list))
-                            break
+            polygons = alternativos
         if polygons:
             gdf = gpd.GeoDataFrame({'geometry': polygons}, crs='EPSG:4326')
             return gdf
@@ -1156,31 +1100,26 @@ def parsear_kml_manual(contenido_kml):
 def cargar_kml(kml_file):
     try:
         if kml_file.name.endswith('.kmz'):
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                with zipfile.ZipFile(kml_file, 'r') as zip_ref:
-                    zip_ref.extractall(tmp_dir)
-                kml_files = [f for f in os.listdir(tmp_dir) if f.endswith('.kml')]
-                if kml_files:
-                    kml_path = os.path.join(tmp_dir, kml_files[0])
-                    with open(kml_path, 'r', encoding='utf-8') as f:
-                        contenido = f.read()
-                    gdf = parsear_kml_manual(contenido)
-                    if gdf is not None:
-                        return gdf
-                    else:
-                        try:
-                            gdf = gpd.read_file(kml_path)
-                            gdf = validar_y_corregir_crs(gdf)
-                            return gdf
-                        except:
-                            st.error("❌ No se pudo cargar el archivo KML/KMZ")
-                            return None
-                else:
+            # Se lee el miembro .kml directamente del ZIP, sin extraerlo a disco
+            with zipfile.ZipFile(kml_file, 'r') as zip_ref:
+                kml_files = [n for n in zip_ref.namelist() if n.lower().endswith('.kml')]
+                if not kml_files:
                     st.error("❌ No se encontró ningún archivo .kml en el KMZ")
                     return None
+                with zip_ref.open(kml_files[0]) as miembro:
+                    gdf = parsear_kml_manual(miembro)
+                if gdf is not None:
+                    return gdf
+                try:
+                    gdf = gpd.read_file(io.BytesIO(zip_ref.read(kml_files[0])))
+                    gdf = validar_y_corregir_crs(gdf)
+                    return gdf
+                except:
+                    st.error("❌ No se pudo cargar el archivo KML/KMZ")
+                    return None
         else:
-            contenido = kml_file.read().decode('utf-8')
-            gdf = parsear_kml_manual(contenido)
+            kml_file.seek(0)
+            gdf = parsear_kml_manual(kml_file)
             if gdf is not None:
                 return gdf
             else:
@@ -1192,28 +1131,181 @@ def cargar_kml(kml_file):
         st.error(f"❌ Error cargando archivo KML/KMZ: {str(e)}")
         return None
 
-def cargar_archivo_parcela(uploaded_file):
+# ===== FORMATOS INDEXADOS / COLUMNARES (GEOPACKAGE, GEOPARQUET, FLATGEOBUF) =====
+FILTRO_PYARROW_REGEX = re.compile(
+    r"^\s*(\w+)\s*(==|=|!=|<>|<=|>=|<|>|\bin\b|\bnot in\b)\s*(.+?)\s*$", re.IGNORECASE
+)
+
+def bbox_en_crs(bbox_wgs84, crs_destino):
+    """Transforma un bbox (lon/lat) al CRS de la capa para filtrar en la lectura"""
+    if bbox_wgs84 is None or crs_destino is None:
+        return bbox_wgs84
+    destino = pyproj.CRS.from_user_input(crs_destino)
+    if destino.equals(pyproj.CRS.from_epsg(4326), ignore_axis_order=True):
+        return bbox_wgs84
+    transformador = pyproj.Transformer.from_crs('EPSG:4326', destino, always_xy=True)
+    return tuple(transformador.transform_bounds(*bbox_wgs84))
+
+def valor_filtro(texto):
+    """Literal de un filtro de atributos: texto entre comillas o número"""
+    texto = texto.strip()
+    if len(texto) >= 2 and texto[0] == texto[-1] and texto[0] in ('"', "'"):
+        return texto[1:-1]
+    try:
+        return int(texto)
+    except ValueError:
+        return float(texto)
+
+def filtro_a_pyarrow(where):
+    """Convierte un filtro simple 'col op valor [AND ...]' a filtros de pyarrow (predicado empujado a la lectura)"""
+    filtros = []
+    for condicion in re.split(r'\s+and\s+', where.strip(), flags=re.IGNORECASE):
+        coincidencia = FILTRO_PYARROW_REGEX.match(condicion)
+        if not coincidencia:
+            raise ValueError(f"condición no soportada: {condicion}")
+        columna, operador, valor = coincidencia.groups()
+        operador = {'=': '==', '<>': '!='}.get(operador.lower(), operador.lower())
+        if operador in ('in', 'not in'):
+            valor = [valor_filtro(v) for v in valor.strip().strip('()').split(',') if v.strip()]
+        else:
+            valor = valor_filtro(valor)
+        filtros.append((columna, operador, valor))
+    return filtros
+
+def cargar_capa_indexada(uploaded_file, filtros):
+    """GeoPackage/FlatGeobuf: bbox y atributos se aplican en GDAL, solo se decodifican los lotes pedidos"""
+    try:
+        contenido = uploaded_file.getvalue()
+        capa = filtros.get('capa') or None
+        info = pyogrio.read_info(contenido, layer=capa)
+        argumentos = {}
+        if filtros.get('bbox'):
+            argumentos['bbox'] = bbox_en_crs(filtros['bbox'], info.get('crs'))
+        if filtros.get('where'):
+            argumentos['where'] = filtros['where']
+        gdf = leer_vectorial_en_memoria(contenido, layer=capa, **argumentos)
+        st.info(f"ℹ️ {len(gdf)} de {info.get('features', '?')} entidad(es) leídas de la capa")
+        return validar_y_corregir_crs(gdf)
+    except Exception as e:
+        st.error(f"❌ Error cargando capa vectorial: {str(e)}")
+        return None
+
+def crs_geoparquet(buffer):
+    """CRS de la columna geométrica primaria según los metadatos 'geo' de GeoParquet"""
+    esquema = importlib.import_module('pyarrow.parquet').read_schema(buffer)
+    buffer.seek(0)
+    metadatos = json.loads((esquema.metadata or {}).get(b'geo', b'{}'))
+    columna = metadatos.get('columns', {}).get(metadatos.get('primary_column', 'geometry'), {})
+    return columna.get('crs', 'OGC:CRS84')
+
+def cargar_geoparquet(uploaded_file, filtros):
+    """GeoParquet: filtros de atributos y bbox empujados a pyarrow (grupos de filas descartados sin leer)"""
+    try:
+        buffer = io.BytesIO(uploaded_file.getvalue())
+        argumentos = {}
+        if filtros.get('where'):
+            try:
+                argumentos['filters'] = filtro_a_pyarrow(filtros['where'])
+            except ValueError as e:
+                st.warning(f"⚠️ Filtro de atributos ignorado para GeoParquet ({e}). Use 'columna = valor [AND ...]'")
+        bbox = None
+        if filtros.get('bbox'):
+            crs = crs_geoparquet(buffer)
+            bbox = bbox_en_crs(filtros['bbox'], crs if isinstance(crs, str) else json.dumps(crs))
+        try:
+            gdf = gpd.read_parquet(buffer, bbox=bbox, **argumentos)
+        except ValueError as e:
+            if bbox is None:
+                raise
+            # Sin columna de cobertura bbox no hay poda por extensión: se filtra tras leer
+            print(f"⚠️ GeoParquet sin cobertura bbox, filtrando en memoria: {str(e)}")
+            buffer.seek(0)
+            gdf = gpd.read_parquet(buffer, **argumentos)
+            gdf = gdf[gdf.intersects(shapely.box(*bbox))]
+        return validar_y_corregir_crs(gdf)
+    except Exception as e:
+        st.error(f"❌ Error cargando GeoParquet: {str(e)}")
+        return None
+
+def cargar_archivo_parcela(uploaded_file, filtros=None, unir=True):
+    """Carga la parcela (como Parcela) reutilizando la ya normalizada si el contenido y los filtros no cambiaron"""
+    filtros = filtros or {}
+    try:
+        contenido = uploaded_file.getvalue()
+    except Exception:
+        return como_parcela(leer_archivo_parcela(uploaded_file, filtros, unir))
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    clave = (hashlib.sha256(contenido).hexdigest(), extension, tuple(sorted(filtros.items())), unir)
+    cache = obtener_cache_parcelas()
+    parcela = cache.obtener(clave)
+    if parcela is None:
+        gdf = leer_archivo_parcela(uploaded_file, filtros, unir)
+        if gdf is None:
+            return None
+        # Se cachea la Parcela completa: sus proyecciones y uniones sobreviven a los reruns.
+        # Es compartida entre sesiones: las etapas que agregan columnas trabajan sobre copias
+        # (dividir_parcela_en_zonas nunca devuelve parcela.gdf tal cual).
+        # Las proyecciones se calculan antes de guardarla para que el tope de memoria cuente la entrada completa
+        parcela = Parcela(gdf).precalcular()
+        cache.guardar(clave, parcela, tamano=estimar_tamano_bytes(parcela))
+    return parcela
+
+COLUMNAS_NOMBRE_LOTE = ['nombre', 'Nombre', 'NOMBRE', 'name', 'Name', 'NAME', 'lote', 'Lote', 'LOTE']
+
+def nombrar_lotes(gdf):
+    """Nombre único por lote a partir de una columna de nombre conocida, o 'Lote N'"""
+    columna = next((c for c in COLUMNAS_NOMBRE_LOTE if c in gdf.columns), None)
+    nombres = []
+    for i in range(len(gdf)):
+        valor = gdf[columna].iloc[i] if columna else None
+        nombre = str(valor).strip() if valor is not None and str(valor).strip() not in ('', 'nan', 'None') else f"Lote {i + 1}"
+        if nombre in nombres:
+            nombre = f"{nombre} ({i + 1})"
+        nombres.append(nombre)
+    return nombres
+
+def leer_archivo_parcela(uploaded_file, filtros=None, unir=True):
+    filtros = filtros or {}
     try:
-        if uploaded_file.name.endswith('.zip'):
+        nombre = uploaded_file.name.lower()
+        if nombre.endswith('.zip'):
             gdf = cargar_shapefile_desde_zip(uploaded_file)
-        elif uploaded_file.name.endswith(('.kml', '.kmz')):
+        elif nombre.endswith(('.kml', '.kmz')):
             gdf = cargar_kml(uploaded_file)
+        elif nombre.endswith(('.gpkg', '.fgb')):
+            gdf = cargar_capa_indexada(uploaded_file, filtros)
+        elif nombre.endswith(('.parquet', '.geoparquet')):
+            gdf = cargar_geoparquet(uploaded_file, filtros)
         else:
             st.error("❌ Formato de archivo no soportado")
             return None
         
         if gdf is not None:
             gdf = validar_y_corregir_crs(gdf)
+            gdf = preprocesar_geometria(gdf)
+            preprocesamiento = gdf.attrs['preprocesamiento']
+            if not unir:
+                # Modo por lotes: cada entidad poligonal es un lote con sus atributos
+                gdf = gdf[gdf.geometry.geom_type.isin(['Polygon', 'MultiPolygon'])].reset_index(drop=True)
+                if len(gdf) == 0:
+                    st.error("❌ No se encontraron polígonos en el archivo")
+                    return None
+                gdf['nombre_lote'] = nombrar_lotes(gdf)
+                gdf['id_zona'] = 1
+                gdf.attrs['preprocesamiento'] = preprocesamiento
+                st.info(f"✅ Se cargaron {len(gdf)} lote(s) independientes.")
+                return gdf
             gdf = gdf.explode(ignore_index=True)
             gdf = gdf[gdf.geometry.geom_type.isin(['Polygon', 'MultiPolygon'])]
             if len(gdf) == 0:
                 st.error("❌ No se encontraron polígonos en el archivo")
                 return None
-            geometria_unida = gdf.unary_union
+            geometria_unida = gdf.geometry.union_all()
             gdf_unido = gpd.GeoDataFrame([{'geometry': geometria_unida}], crs='EPSG:4326')
             gdf_unido = validar_y_corregir_crs(gdf_unido)
             st.info(f"✅ Se unieron {len(gdf)} polígono(s) en una sola geometría.")
             gdf_unido['id_zona'] = 1
+            gdf_unido.attrs['preprocesamiento'] = preprocesamiento
             return gdf_unido
         return gdf
     except Exception as e:
@@ -1223,15 +1315,16 @@ def cargar_archivo_parcela(uploaded_file):
         return None
 
 # ===== FUNCIONES PARA DATOS SATELITALES =====
-def descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
+def descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice='NDVI', semilla=None):
     try:
+        rng = np.random.default_rng(semilla)
         datos_simulados = {
             'indice': indice,
-            'valor_promedio': 0.65 + np.random.normal(0, 0.1),
+            'valor_promedio': 0.65 + rng.normal(0, 0.1),
             'fuente': 'Landsat-8',
-            'fecha': datetime.now().strftime('%Y-%m-%d'),
-            'id_escena': f"LC08_{np.random.randint(1000000, 9999999)}",
-            'cobertura_nubes': f"{np.random.randint(0, 15)}%",
+            'fecha': fecha_fin.strftime('%Y-%m-%d'),
+            'id_escena': f"LC08_{rng.integers(1000000, 9999999)}",
+            'cobertura_nubes': f"{rng.integers(0, 15)}%",
             'resolucion': '30m'
         }
         return datos_simulados
@@ -1239,15 +1332,16 @@ def descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
         st.error(f"❌ Error procesando Landsat 8: {str(e)}")
         return None
 
-def descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
+def descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice='NDVI', semilla=None):
     try:
+        rng = np.random.default_rng(semilla)
         datos_simulados = {
             'indice': indice,
-            'valor_promedio': 0.72 + np.random.normal(0, 0.08),
+            'valor_promedio': 0.72 + rng.normal(0, 0.08),
             'fuente': 'Sentinel-2',
-            'fecha': datetime.now().strftime('%Y-%m-%d'),
-            'id_escena': f"S2A_{np.random.randint(1000000, 9999999)}",
-            'cobertura_nubes': f"{np.random.randint(0, 10)}%",
+            'fecha': fecha_fin.strftime('%Y-%m-%d'),
+            'id_escena': f"S2A_{rng.integers(1000000, 9999999)}",
+            'cobertura_nubes': f"{rng.integers(0, 10)}%",
             'resolucion': '10m'
         }
         return datos_simulados
@@ -1255,38 +1349,65 @@ def descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
         st.error(f"❌ Error procesando Sentinel-2: {str(e)}")
         return None
 
-def generar_datos_simulados(gdf, cultivo, indice='NDVI'):
+def generar_datos_simulados(gdf, cultivo, indice='NDVI', semilla=None, fecha=None):
+    rng = np.random.default_rng(semilla)
+    fecha = fecha or datetime.now()
     datos_simulados = {
         'indice': indice,
-        'valor_promedio': PARAMETROS_CULTIVOS[cultivo]['NDVI_OPTIMO'] * 0.8 + np.random.normal(0, 0.1),
+        'valor_promedio': PARAMETROS_CULTIVOS[cultivo]['NDVI_OPTIMO'] * 0.8 + rng.normal(0, 0.1),
         'fuente': 'Simulación',
-        'fecha': datetime.now().strftime('%Y-%m-%d'),
+        'fecha': fecha.strftime('%Y-%m-%d'),
         'resolucion': '10m'
     }
     return datos_simulados
 
 # ===== FUNCIONES GOOGLE EARTH ENGINE =====
-def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
+@st.cache_resource
+def obtener_cache_gee():
+    """Caché persistente de estadísticas de índices calculadas en GEE"""
+    os.makedirs(DIRECTORIO_CACHE, exist_ok=True)
+    return CachePersistenteTTL(
+        os.path.join(DIRECTORIO_CACHE, 'gee_estadisticas.sqlite'),
+        ttl_segundos=CACHE_GEE_TTL_HORAS * 3600
+    )
+
+def clave_cache_gee(geometria, dataset, fecha_inicio, fecha_fin, indice, max_nubes, escala):
+    """Clave de caché: geometría, colección, rango de fechas, índice, umbral de nubes y escala"""
+    return '|'.join([huella_geometria(geometria), dataset, fecha_inicio, fecha_fin,
+                     indice, str(max_nubes), str(escala)])
+
+def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI', max_nubes=20):
     """Obtener datos reales de Sentinel-2 usando Google Earth Engine"""
     if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
         return None
     try:
         # Obtener bounding box de la parcela
-        bounds = gdf.total_bounds
+        parcela = como_parcela(gdf)
+        bounds = parcela.bounds
         min_lon, min_lat, max_lon, max_lat = bounds
         
-        # Crear geometría de la parcela
-        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
-        
         # Formatear fechas para GEE
         start_date = fecha_inicio.strftime('%Y-%m-%d')
         end_date = fecha_fin.strftime('%Y-%m-%d')
         
+        # Reutilizar estadísticas ya calculadas para los mismos parámetros
+        dataset = 'COPERNICUS/S2_SR_HARMONIZED'
+        escala = 10
+        clave_cache = clave_cache_gee(parcela.geometria_simplificada, dataset, start_date, end_date, indice, max_nubes, escala)
+        cache_gee = obtener_cache_gee()
+        resultado_cacheado = cache_gee.obtener(clave_cache)
+        if resultado_cacheado is not None:
+            return resultado_cacheado
+        
+        # Crear geometría de la parcela (rectángulo para filtrar escenas, contorno simplificado para estadísticas)
+        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+        geometria_parcela = ee.Geometry(shapely.geometry.mapping(parcela.geometria_simplificada))
+        
         # Cargar colección Sentinel-2
-        collection = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+        collection = (ee.ImageCollection(dataset)
                      .filterBounds(geometry)
                      .filterDate(start_date, end_date)
-                     .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)))
+                     .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', max_nubes)))
         
         # Seleccionar la imagen con menor cobertura de nubes
         image = collection.sort('CLOUDY_PIXEL_PERCENTAGE').first()
@@ -1344,8 +1465,8 @@ def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
                 reducer2=ee.Reducer.stdDev(),
                 sharedInputs=True
             ),
-            geometry=geometry,
-            scale=10,
+            geometry=geometria_parcela,
+            scale=escala,
             bestEffort=True
         )
         
@@ -1367,7 +1488,7 @@ def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
         if fecha_imagen:
             fecha_imagen = datetime.fromtimestamp(fecha_imagen / 1000).strftime('%Y-%m-%d')
         
-        return {
+        resultado = {
             'indice': indice,
             'valor_promedio': valor_promedio,
             'valor_min': valor_min,
@@ -1380,27 +1501,39 @@ def obtener_datos_sentinel2_gee(gdf, fecha_inicio, fecha_fin, indice='NDVI'):
             'estado': 'exitosa',
             'cobertura_nubes': image.get('CLOUDY_PIXEL_PERCENTAGE').getInfo() if image.get('CLOUDY_PIXEL_PERCENTAGE') else 'N/A'
         }
+        cache_gee.guardar(clave_cache, resultado)
+        return resultado
         
     except Exception as e:
         st.error(f"❌ Error obteniendo datos de Google Earth Engine: {str(e)}")
         return None
 
-def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC08/C02/T1_L2', indice='NDVI'):
+def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC08/C02/T1_L2', indice='NDVI', max_nubes=20):
     """Obtener datos reales de Landsat usando Google Earth Engine"""
     if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
         return None
     try:
         # Obtener bounding box de la parcela
-        bounds = gdf.total_bounds
+        parcela = como_parcela(gdf)
+        bounds = parcela.bounds
         min_lon, min_lat, max_lon, max_lat = bounds
         
-        # Crear geometría de la parcela
-        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
-        
         # Formatear fechas para GEE
         start_date = fecha_inicio.strftime('%Y-%m-%d')
         end_date = fecha_fin.strftime('%Y-%m-%d')
         
+        # Reutilizar estadísticas ya calculadas para los mismos parámetros
+        escala = 30
+        clave_cache = clave_cache_gee(parcela.geometria_simplificada, dataset, start_date, end_date, indice, max_nubes, escala)
+        cache_gee = obtener_cache_gee()
+        resultado_cacheado = cache_gee.obtener(clave_cache)
+        if resultado_cacheado is not None:
+            return resultado_cacheado
+        
+        # Crear geometría de la parcela (rectángulo para filtrar escenas, contorno simplificado para estadísticas)
+        geometry = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+        geometria_parcela = ee.Geometry(shapely.geometry.mapping(parcela.geometria_simplificada))
+        
         # Determinar nombre de bandas según el dataset
         if 'LC08' in dataset or 'LANDSAT/LC08' in dataset:
             red_band = 'SR_B4'
@@ -1419,7 +1552,7 @@ def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC0
         collection = (ee.ImageCollection(dataset)
                      .filterBounds(geometry)
                      .filterDate(start_date, end_date)
-                     .filter(ee.Filter.lt('CLOUD_COVER', 20)))
+                     .filter(ee.Filter.lt('CLOUD_COVER', max_nubes)))
         
         # Seleccionar la imagen con menor cobertura de nubes
         image = collection.sort('CLOUD_COVER').first()
@@ -1477,8 +1610,8 @@ def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC0
                 reducer2=ee.Reducer.stdDev(),
                 sharedInputs=True
             ),
-            geometry=geometry,
-            scale=30,
+            geometry=geometria_parcela,
+            scale=escala,
             bestEffort=True
         )
         
@@ -1508,7 +1641,7 @@ def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC0
         else:
             nombre_satelite = 'Landsat'
         
-        return {
+        resultado = {
             'indice': indice,
             'valor_promedio': valor_promedio,
             'valor_min': valor_min,
@@ -1521,6 +1654,8 @@ def obtener_datos_landsat_gee(gdf, fecha_inicio, fecha_fin, dataset='LANDSAT/LC0
             'estado': 'exitosa',
             'cobertura_nubes': image.get('CLOUD_COVER').getInfo() if image.get('CLOUD_COVER') else 'N/A'
         }
+        cache_gee.guardar(clave_cache, resultado)
+        return resultado
         
     except Exception as e:
         st.error(f"❌ Error obteniendo datos de Landsat desde GEE: {str(e)}")
@@ -1538,39 +1673,191 @@ def descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indi
         return None
 
 # ===== FUNCIÓN PARA OBTENER DATOS DE NASA POWER =====
+# Grilla meteorológica de POWER (MERRA-2): 0.5° lat x 0.625° lon
+POWER_PASO_LAT = 0.5
+POWER_PASO_LON = 0.625
+# Grilla solar de POWER (CERES/FLASHFlux): 1° x 1° con bordes en grados enteros
+POWER_PASO_SOLAR = 1.0
+POWER_PARAMETROS = {
+    'ALLSKY_SFC_SW_DWN': 'radiacion_solar',
+    'WS2M': 'viento_2m',
+    'T2M': 'temperatura',
+    'PRECTOTCORR': 'precipitacion'
+}
+
+def celda_nasa_power(lat, lon):
+    """
+    Devuelve el identificador de la celda POWER que contiene el punto y el punto de consulta.
+    La celda es la intersección de la celda meteorológica y la solar, y el punto de consulta
+    su centro, estrictamente dentro de ambas para que POWER no resuelva bordes al azar.
+    """
+    i = int(round((lat + 90) / POWER_PASO_LAT))
+    j = int(round((lon + 180) / POWER_PASO_LON))
+    lat_met = -90 + i * POWER_PASO_LAT
+    lon_met = -180 + j * POWER_PASO_LON
+    si = int(np.floor(lat / POWER_PASO_SOLAR))
+    sj = int(np.floor(lon / POWER_PASO_SOLAR))
+    lat_min = max(lat_met - POWER_PASO_LAT / 2, si * POWER_PASO_SOLAR)
+    lat_max = min(lat_met + POWER_PASO_LAT / 2, (si + 1) * POWER_PASO_SOLAR)
+    lon_min = max(lon_met - POWER_PASO_LON / 2, sj * POWER_PASO_SOLAR)
+    lon_max = min(lon_met + POWER_PASO_LON / 2, (sj + 1) * POWER_PASO_SOLAR)
+    lat_consulta = round((lat_min + lat_max) / 2, 4)
+    lon_consulta = round((lon_min + lon_max) / 2, 4)
+    return f"{i}_{j}_s{si}_{sj}", lat_consulta, lon_consulta
+
+def descargar_nasa_power(lat, lon, fecha_inicio, fecha_fin):
+    """Descarga la serie diaria de NASA POWER para un punto (valores -999 como NaN)"""
+    params = {
+        'parameters': ','.join(POWER_PARAMETROS.keys()),
+        'community': 'RE',
+        'longitude': lon,
+        'latitude': lat,
+        'start': fecha_inicio.strftime("%Y%m%d"),
+        'end': fecha_fin.strftime("%Y%m%d"),
+        'format': 'JSON'
+    }
+    url = "https://power.larc.nasa.gov/api/temporal/daily/point"
+    response = requests.get(url, params=params, timeout=15)
+    data = response.json()
+    if 'properties' not in data or 'parameter' not in data['properties']:
+        return None
+    series = data['properties']['parameter']
+    df = pd.DataFrame({
+        columna: pd.Series(series[parametro]) for parametro, columna in POWER_PARAMETROS.items()
+    })
+    df.index = pd.to_datetime(df.index, format='%Y%m%d')
+    df = df.replace(-999, np.nan)
+    df.index.name = 'fecha'
+    return df.reset_index()
+
+class AlmacenNasaPower:
+    """Almacén SQLite de series diarias POWER por celda y día, con descarga incremental"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._locks_celdas = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.peticiones = 0
+        columnas = ', '.join(f'{c} REAL' for c in POWER_PARAMETROS.values())
+        with self._conectar() as con:
+            con.execute(
+                f'CREATE TABLE IF NOT EXISTS power_diario ('
+                f'celda TEXT NOT NULL, fecha TEXT NOT NULL, {columnas}, actualizado TEXT NOT NULL, '
+                f'PRIMARY KEY (celda, fecha))'
+            )
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def _leer(self, celda, inicio, fin):
+        columnas = ', '.join(POWER_PARAMETROS.values())
+        with self._lock, self._conectar() as con:
+            df = pd.read_sql_query(
+                f'SELECT fecha, {columnas}, actualizado FROM power_diario '
+                f'WHERE celda = ? AND fecha BETWEEN ? AND ? ORDER BY fecha',
+                con, params=(celda, inicio.strftime('%Y-%m-%d'), fin.strftime('%Y-%m-%d'))
+            )
+        df['fecha'] = pd.to_datetime(df['fecha'])
+        return df
+
+    def _guardar(self, celda, df):
+        hoy = datetime.now().strftime('%Y-%m-%d')
+        columnas = list(POWER_PARAMETROS.values())
+        filas = [
+            (celda, fecha.strftime('%Y-%m-%d'), *[None if pd.isna(v) else float(v) for v in valores], hoy)
+            for fecha, valores in zip(df['fecha'], df[columnas].itertuples(index=False))
+        ]
+        marcadores = ', '.join('?' * (len(columnas) + 3))
+        with self._lock, self._conectar() as con:
+            con.executemany(
+                f'INSERT OR REPLACE INTO power_diario (celda, fecha, {", ".join(columnas)}, actualizado) '
+                f'VALUES ({marcadores})',
+                filas
+            )
+
+    @staticmethod
+    def _tramos_faltantes(fechas):
+        """Agrupa fechas faltantes (ordenadas) en tramos contiguos [inicio, fin]"""
+        tramos = []
+        for fecha in fechas:
+            if tramos and (fecha - tramos[-1][1]).days == 1:
+                tramos[-1][1] = fecha
+            else:
+                tramos.append([fecha, fecha])
+        return tramos
+
+    def _lock_celda(self, celda):
+        with self._lock:
+            return self._locks_celdas.setdefault(celda, threading.Lock())
+
+    def _pendientes(self, celda, inicio, fin, hoy):
+        """Días almacenados del rango y días que faltan descargar"""
+        existentes = self._leer(celda, inicio, fin)
+        # Los días incompletos (-999 en origen) se vuelven a pedir solo si no se consultaron hoy
+        incompletos = existentes[list(POWER_PARAMETROS.values())].isna().any(axis=1)
+        vigentes = existentes[~incompletos | (existentes['actualizado'] == hoy.strftime('%Y-%m-%d'))]
+        fechas = pd.date_range(inicio, fin, freq='D')
+        return existentes, fechas, fechas[~fechas.isin(vigentes['fecha'])]
+
+    def obtener_serie(self, lat, lon, fecha_inicio, fecha_fin):
+        celda, lat_consulta, lon_consulta = celda_nasa_power(lat, lon)
+        inicio = pd.Timestamp(fecha_inicio).normalize()
+        hoy = pd.Timestamp(datetime.now().date())
+        fin = min(pd.Timestamp(fecha_fin).normalize(), hoy)
+        if fin < inicio:
+            return None
+        existentes, fechas, faltantes = self._pendientes(celda, inicio, fin, hoy)
+        if len(faltantes) > 0:
+            # Una sola descarga en curso por celda; las demás celdas y las lecturas no esperan al HTTP
+            with self._lock_celda(celda):
+                existentes, fechas, faltantes = self._pendientes(celda, inicio, fin, hoy)
+                for tramo_inicio, tramo_fin in self._tramos_faltantes(list(faltantes)):
+                    with self._lock:
+                        self.peticiones += 1
+                    nuevos = descargar_nasa_power(lat_consulta, lon_consulta, tramo_inicio, tramo_fin)
+                    if nuevos is not None and not nuevos.empty:
+                        self._guardar(celda, nuevos)
+                if len(faltantes) > 0:
+                    existentes = self._leer(celda, inicio, fin)
+        with self._lock:
+            self.aciertos += len(fechas) - len(faltantes)
+            self.fallos += len(faltantes)
+        return existentes.drop(columns='actualizado')
+
+    def estadisticas(self):
+        with self._conectar() as con:
+            dias, celdas = con.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT celda) FROM power_diario'
+            ).fetchone()
+        return {
+            'celdas': celdas,
+            'dias_almacenados': dias,
+            'aciertos_dias': self.aciertos,
+            'fallos_dias': self.fallos,
+            'peticiones_http': self.peticiones
+        }
+
+@st.cache_resource
+def obtener_almacen_nasa_power():
+    """Almacén NASA POWER compartido por todas las sesiones del proceso"""
+    os.makedirs(DIRECTORIO_CACHE, exist_ok=True)
+    return AlmacenNasaPower(os.path.join(DIRECTORIO_CACHE, 'nasa_power.sqlite'))
+
 def obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin):
     """
     Obtiene datos meteorológicos diarios de NASA POWER para el centroide de la parcela.
+    Solo se descargan los días que aún no están en el almacén local.
     """
     try:
-        centroid = gdf.geometry.unary_union.centroid
-        lat = round(centroid.y, 4)
-        lon = round(centroid.x, 4)
-        start = fecha_inicio.strftime("%Y%m%d")
-        end = fecha_fin.strftime("%Y%m%d")
-        params = {
-            'parameters': 'ALLSKY_SFC_SW_DWN,WS2M,T2M,PRECTOTCORR',
-            'community': 'RE',
-            'longitude': lon,
-            'latitude': lat,
-            'start': start,
-            'end': end,
-            'format': 'JSON'
-        }
-        url = "https://power.larc.nasa.gov/api/temporal/daily/point"
-        response = requests.get(url, params=params, timeout=15)
-        data = response.json()
-        if 'properties' not in data or 'parameter' not in data['properties']:
+        centroid = como_parcela(gdf).centroide
+        df_power = obtener_almacen_nasa_power().obtener_serie(
+            centroid.y, centroid.x, fecha_inicio, fecha_fin
+        )
+        if df_power is None:
             return None
-        series = data['properties']['parameter']
-        df_power = pd.DataFrame({
-            'fecha': pd.to_datetime(list(series['ALLSKY_SFC_SW_DWN'].keys())),
-            'radiacion_solar': list(series['ALLSKY_SFC_SW_DWN'].values()),
-            'viento_2m': list(series['WS2M'].values()),
-            'temperatura': list(series['T2M'].values()),
-            'precipitacion': list(series['PRECTOTCORR'].values())
-        })
-        df_power = df_power.replace(-999, np.nan).dropna()
+        df_power = df_power.dropna().reset_index(drop=True)
         if df_power.empty:
             return None
         return df_power
@@ -1579,66 +1866,141 @@ def obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin):
 
 # ===== FUNCIONES DEM REAL CON DATOS NASA SRTM Y MEJORAS TOPOGRÁFICAS =====
 
+class AlmacenTeselasSRTM:
+    """Almacén local de teselas SRTM de 1°x1° guardadas como GeoTIFF teselado y comprimido"""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        self._locks_teselas = {}
+        self.aciertos = 0
+        self.descargas = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta_tesela(self, lat_sw, lon_sw):
+        ns = 'N' if lat_sw >= 0 else 'S'
+        ew = 'E' if lon_sw >= 0 else 'W'
+        return os.path.join(self.directorio, f"SRTMGL1_{ns}{abs(lat_sw):02d}{ew}{abs(lon_sw):03d}.tif")
+
+    def _descargar_tesela(self, lat_sw, lon_sw, ruta):
+        """Descarga la tesela desde OpenTopography y la reescribe teselada y comprimida"""
+        params = {
+            'west': lon_sw,
+            'south': lat_sw,
+            'east': lon_sw + 1,
+            'north': lat_sw + 1,
+            'outputFormat': 'GTiff',
+            'demtype': 'SRTMGL1'  # SRTM 30m
+        }
+        url = "https://portal.opentopography.org/API/globaldem"
+        response = requests.get(url, params=params, stream=True, timeout=120)
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenTopography respondió {response.status_code}")
+        fd, ruta_descarga = tempfile.mkstemp(suffix='.tif', dir=self.directorio)
+        fd_final, ruta_temporal = tempfile.mkstemp(suffix='.tif', dir=self.directorio)
+        os.close(fd_final)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    tmp_file.write(chunk)
+            with rasterio.open(ruta_descarga) as src:
+                perfil = src.profile.copy()
+                perfil.update(driver='GTiff', tiled=True, blockxsize=256, blockysize=256,
+                              compress='deflate', predictor=2)
+                with rasterio.open(ruta_temporal, 'w', **perfil) as dst:
+                    for _, ventana in src.block_windows(1):
+                        dst.write(src.read(1, window=ventana), 1, window=ventana)
+            # Publicación atómica: nunca queda una tesela a medio escribir
+            os.replace(ruta_temporal, ruta)
+        finally:
+            for ruta_sobrante in (ruta_descarga, ruta_temporal):
+                if os.path.exists(ruta_sobrante):
+                    os.unlink(ruta_sobrante)
+
+    def _lock_tesela(self, ruta):
+        with self._lock:
+            return self._locks_teselas.setdefault(ruta, threading.Lock())
+
+    def asegurar_teselas(self, min_lon, min_lat, max_lon, max_lat):
+        """Devuelve las rutas de las teselas que cubren el bbox, descargando solo las que faltan"""
+        rutas = []
+        for lat_sw in range(math.floor(min_lat), math.floor(max_lat) + 1):
+            for lon_sw in range(math.floor(min_lon), math.floor(max_lon) + 1):
+                ruta = self.ruta_tesela(lat_sw, lon_sw)
+                if os.path.exists(ruta):
+                    with self._lock:
+                        self.aciertos += 1
+                else:
+                    # Una sola descarga en curso por tesela; las demás teselas y las lecturas no esperan al HTTP
+                    with self._lock_tesela(ruta):
+                        if not os.path.exists(ruta):
+                            with self._lock:
+                                self.descargas += 1
+                            self._descargar_tesela(lat_sw, lon_sw, ruta)
+                rutas.append(ruta)
+        return rutas
+
+    def leer_ventana(self, min_lon, min_lat, max_lon, max_lat):
+        """Lee solo la ventana del bbox; devuelve (Z float32 con NaN, transform)"""
+        rutas = self.asegurar_teselas(min_lon, min_lat, max_lon, max_lat)
+        if len(rutas) == 1:
+            with rasterio.open(rutas[0]) as src:
+                ventana = rasterio_windows.from_bounds(min_lon, min_lat, max_lon, max_lat, transform=src.transform)
+                ventana = ventana.round_offsets().round_lengths()
+                # Lectura enmascarada: nodata (si la tesela lo declara) y lo que cae fuera de ella quedan en NaN
+                Z = src.read(1, window=ventana, boundless=True, masked=True)
+                transform = src.window_transform(ventana)
+            Z = Z.astype(np.float32).filled(np.nan)
+        else:
+            fuentes = [rasterio.open(ruta) for ruta in rutas]
+            try:
+                mosaico, transform = rasterio_merge.merge(
+                    fuentes, bounds=(min_lon, min_lat, max_lon, max_lat), dtype='float32', nodata=np.nan
+                )
+                Z = mosaico[0]
+            finally:
+                for fuente in fuentes:
+                    fuente.close()
+        return Z, transform
+
+    def estadisticas(self):
+        teselas = [f for f in os.listdir(self.directorio) if f.startswith('SRTMGL1_')]
+        tamano = sum(os.path.getsize(os.path.join(self.directorio, f)) for f in teselas)
+        return {
+            'teselas': len(teselas),
+            'disco_mb': round(tamano / (1024 * 1024), 2),
+            'aciertos': self.aciertos,
+            'descargas': self.descargas
+        }
+
+@st.cache_resource
+def obtener_almacen_srtm():
+    """Almacén de teselas SRTM compartido por todas las sesiones del proceso"""
+    return AlmacenTeselasSRTM(os.path.join(DIRECTORIO_CACHE, 'srtm'))
+
 def obtener_datos_srtm_nasa(gdf):
-    """Obtiene datos de elevación reales de NASA SRTM (30m resolución)"""
+    """Obtiene datos de elevación reales de NASA SRTM (30m resolución) desde el almacén local de teselas"""
     try:
         # Calcular bounding box
-        bounds = gdf.total_bounds
+        bounds = como_parcela(gdf).bounds
         min_lon, min_lat, max_lon, max_lat = bounds
         
         # Añadir buffer de 0.01 grados para asegurar cobertura
         buffer = 0.01
-        min_lon -= buffer
-        min_lat -= buffer
-        max_lon += buffer
-        max_lat += buffer
-        
-        # Definir parámetros para la API de OpenTopography (usa SRTM)
-        # Nota: OpenTopography ofrece acceso gratuito a SRTM
-        params = {
-            'west': min_lon,
-            'south': min_lat,
-            'east': max_lon,
-            'north': max_lat,
-            'outputFormat': 'GTiff',
-            'demtype': 'SRTMGL1'  # SRTM 30m
-        }
         
-        # URL de OpenTopography API
-        url = "https://portal.opentopography.org/API/globaldem"
-        
-        # Intentar descargar datos SRTM
         try:
-            response = requests.get(url, params=params, stream=True, timeout=30)
-            if response.status_code == 200:
-                # Guardar temporalmente el archivo TIFF
-                with tempfile.NamedTemporaryFile(suffix='.tif', delete=False) as tmp_file:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        tmp_file.write(chunk)
-                    tmp_path = tmp_file.name
-                
-                # Leer el archivo TIFF con rasterio
-                import rasterio
-                with rasterio.open(tmp_path) as src:
-                    # Leer datos
-                    dem_data = src.read(1)
-                    
-                    # Obtener transformación de coordenadas
-                    transform = src.transform
-                    
-                    # Crear grids X, Y
-                    x = np.arange(transform[2], transform[2] + transform[0] * dem_data.shape[1], transform[0])
-                    y = np.arange(transform[5], transform[5] + transform[4] * dem_data.shape[0], transform[4])
-                    X, Y = np.meshgrid(x, y)
-                    
-                    # Convertir a WGS84 si es necesario
-                    Z = dem_data.astype(float)
-                    
-                    # Limpiar archivo temporal
-                    os.unlink(tmp_path)
-                    
-                    st.success("✅ Datos SRTM de NASA obtenidos exitosamente (30m resolución)")
-                    return X, Y, Z, bounds
+            Z, transform = obtener_almacen_srtm().leer_ventana(
+                min_lon - buffer, min_lat - buffer, max_lon + buffer, max_lat + buffer
+            )
+            
+            # Coordenadas de los centros de píxel a partir de la transformación
+            x = transform.c + (np.arange(Z.shape[1]) + 0.5) * transform.a
+            y = transform.f + (np.arange(Z.shape[0]) + 0.5) * transform.e
+            X, Y = np.meshgrid(x, y)
+            Z[~mascara_geometria(como_parcela(gdf).union, x, y)] = np.nan
+            
+            st.success("✅ Datos SRTM de NASA obtenidos exitosamente (30m resolución)")
+            return X, Y, Z.astype(float), bounds
                     
         except Exception as e:
             st.warning(f"⚠️ No se pudieron obtener datos SRTM: {e}. Usando datos sintéticos mejorados.")
@@ -1674,7 +2036,6 @@ def obtener_datos_aster_gdem(gdf):
             urllib.request.urlretrieve(base_url, tmp_path)
             
             # Leer con rasterio
-            import rasterio
             with rasterio.open(tmp_path) as src:
                 dem_data = src.read(1)
                 transform = src.transform
@@ -1739,10 +2100,9 @@ def generar_dem_realista_mejorado(gdf, resolucion=30.0, usar_datos_reales=True):
 
 def interpolar_dem(X, Y, Z, nueva_resolucion):
     """Interpola DEM a diferente resolución"""
-    from scipy.interpolate import RegularGridInterpolator
     
     # Crear interpolador
-    interp = RegularGridInterpolator((Y[:, 0], X[0, :]), Z, 
+    interp = scipy_interpolate.RegularGridInterpolator((Y[:, 0], X[0, :]), Z, 
                                      method='linear', bounds_error=False, fill_value=np.nan)
     
     # Crear nueva grid
@@ -1756,10 +2116,12 @@ def interpolar_dem(X, Y, Z, nueva_resolucion):
     
     return new_X, new_Y, new_Z
 
-def generar_dem_sintetico_avanzado(gdf, resolucion=10.0):
+def generar_dem_sintetico_avanzado(gdf, resolucion=10.0, semilla=None):
     """Genera un DEM sintético avanzado basado en características reales"""
-    gdf = validar_y_corregir_crs(gdf)
-    bounds = gdf.total_bounds
+    parcela = como_parcela(gdf)
+    if semilla is None:
+        semilla = derivar_semilla(parcela.huella, 'dem')
+    bounds = parcela.bounds
     minx, miny, maxx, maxy = bounds
     
     # Crear grid optimizado
@@ -1771,7 +2133,7 @@ def generar_dem_sintetico_avanzado(gdf, resolucion=10.0):
     X, Y = np.meshgrid(x, y)
 
     # Obtener características geográficas para realismo
-    centroid = gdf.geometry.unary_union.centroid
+    centroid = parcela.centroide
     lat, lon = centroid.y, centroid.x
     
     # Determinar tipo de terreno basado en ubicación
@@ -1779,25 +2141,22 @@ def generar_dem_sintetico_avanzado(gdf, resolucion=10.0):
     
     # Generar terreno según tipo
     if tipo_terreno == "LLANURA":
-        Z = generar_terreno_llanura(X, Y, lat, lon)
+        Z = generar_terreno_llanura(X, Y, lat, lon, semilla)
     elif tipo_terreno == "MESETA":
-        Z = generar_terreno_meseta(X, Y, lat, lon)
+        Z = generar_terreno_meseta(X, Y, lat, lon, semilla)
     elif tipo_terreno == "MONTANOSO":
-        Z = generar_terreno_montanoso(X, Y, lat, lon)
+        Z = generar_terreno_montanoso(X, Y, lat, lon, semilla)
     elif tipo_terreno == "VALLE":
-        Z = generar_terreno_valle(X, Y, lat, lon)
+        Z = generar_terreno_valle(X, Y, lat, lon, semilla)
     else:
-        Z = generar_terreno_mixto(X, Y, lat, lon)
+        Z = generar_terreno_mixto(X, Y, lat, lon, semilla)
     
     # Aplicar máscara de la parcela
-    points = np.vstack([X.flatten(), Y.flatten()]).T
-    parcel_mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
-    parcel_mask = parcel_mask.reshape(X.shape)
+    parcel_mask = mascara_geometria(parcela.union, x, y)
     Z[~parcel_mask] = np.nan
     
     # Suavizar
-    from scipy.ndimage import gaussian_filter
-    Z = gaussian_filter(Z, sigma=1.5)
+    Z = scipy_ndimage.gaussian_filter(Z, sigma=1.5)
     
     return X, Y, Z, bounds
 
@@ -1824,9 +2183,9 @@ def clasificar_terreno_por_ubicacion(lat, lon):
     
     return "MIXTO"
 
-def generar_terreno_llanura(X, Y, lat, lon):
+def generar_terreno_llanura(X, Y, lat, lon, semilla):
     """Genera terreno de llanura con pendientes suaves"""
-    rng = np.random.RandomState(int(abs(lat * 100 + lon * 100)) % (2**32))
+    rng = np.random.default_rng(semilla)
     
     # Elevación base baja
     elevacion_base = rng.uniform(50, 150)
@@ -1837,7 +2196,7 @@ def generar_terreno_llanura(X, Y, lat, lon):
     
     # Suaves ondulaciones
     relief = np.zeros_like(X)
-    n_ondulaciones = rng.randint(5, 15)
+    n_ondulaciones = rng.integers(5, 15)
     
     for _ in range(n_ondulaciones):
         center_x = rng.uniform(X.min(), X.max())
@@ -1849,7 +2208,7 @@ def generar_terreno_llanura(X, Y, lat, lon):
         relief += height * np.exp(-(dist**2) / (2 * radius**2))
     
     # Valles de drenaje suaves
-    n_valleys = rng.randint(1, 3)
+    n_valleys = rng.integers(1, 3)
     for _ in range(n_valleys):
         start_x = rng.uniform(X.min(), X.max() * 0.8)
         start_y = rng.uniform(Y.min(), Y.max() * 0.8)
@@ -1870,14 +2229,13 @@ def generar_terreno_llanura(X, Y, lat, lon):
     Z = elevacion_base + slope_x * (X - X.min()) + slope_y * (Y - Y.min()) + relief
     
     # Suavizar
-    from scipy.ndimage import gaussian_filter
-    Z = gaussian_filter(Z, sigma=2)
+    Z = scipy_ndimage.gaussian_filter(Z, sigma=2)
     
     return Z
 
-def generar_terreno_montanoso(X, Y, lat, lon):
+def generar_terreno_montanoso(X, Y, lat, lon, semilla):
     """Genera terreno montañoso con valles pronunciados"""
-    rng = np.random.RandomState(int(abs(lat * 100 + lon * 100)) % (2**32))
+    rng = np.random.default_rng(semilla)
     
     # Elevación base más alta
     elevacion_base = rng.uniform(500, 1500)
@@ -1888,7 +2246,7 @@ def generar_terreno_montanoso(X, Y, lat, lon):
     
     # Montañas principales
     relief = np.zeros_like(X)
-    n_mountains = rng.randint(3, 8)
+    n_mountains = rng.integers(3, 8)
     
     for _ in range(n_mountains):
         center_x = rng.uniform(X.min() + 0.1*(X.max()-X.min()), X.max() - 0.1*(X.max()-X.min()))
@@ -1901,7 +2259,7 @@ def generar_terreno_montanoso(X, Y, lat, lon):
         relief += mountain
     
     # Valles profundos
-    n_valleys = rng.randint(2, 5)
+    n_valleys = rng.integers(2, 5)
     for _ in range(n_valleys):
         start_x = rng.uniform(X.min(), X.max() * 0.7)
         start_y = rng.uniform(Y.min(), Y.max() * 0.7)
@@ -1919,7 +2277,7 @@ def generar_terreno_montanoso(X, Y, lat, lon):
         relief -= valley_profile * valley_mask.astype(float)
     
     # Crestas
-    n_ridges = rng.randint(2, 4)
+    n_ridges = rng.integers(2, 4)
     for _ in range(n_ridges):
         start_x = rng.uniform(X.min(), X.max() * 0.8)
         start_y = rng.uniform(Y.min(), Y.max() * 0.8)
@@ -1943,8 +2301,7 @@ def generar_terreno_montanoso(X, Y, lat, lon):
     Z += noise * 20
     
     # Suavizar moderadamente
-    from scipy.ndimage import gaussian_filter
-    Z = gaussian_filter(Z, sigma=1)
+    Z = scipy_ndimage.gaussian_filter(Z, sigma=1)
     
     return Z
 
@@ -1957,12 +2314,11 @@ def generar_ruido_fractal(shape, octaves, rng):
         amplitude = 1.0 / (frequency ** 0.5)
         
         # Crear ruido simple
-        octave_noise = rng.randn(shape[0], shape[1])
+        octave_noise = rng.standard_normal(shape)
         
         # Suavizar según frecuencia
-        from scipy.ndimage import gaussian_filter
         sigma = max(1, 8 // frequency)
-        octave_noise = gaussian_filter(octave_noise, sigma=sigma)
+        octave_noise = scipy_ndimage.gaussian_filter(octave_noise, sigma=sigma)
         
         noise += octave_noise * amplitude
     
@@ -1976,7 +2332,6 @@ def calcular_pendiente_mejorada(X, Y, Z, resolucion):
     """Calcula pendiente con métodos topográficos profesionales"""
     try:
         # Calcular gradientes usando método de Horn (1981) - estándar en SIG
-        from scipy.ndimage import convolve
         
         # Kernel para gradiente en dirección x
         kernel_x = np.array([[-1, 0, 1],
@@ -1989,8 +2344,8 @@ def calcular_pendiente_mejorada(X, Y, Z, resolucion):
                              [1, 2, 1]]) / (8.0 * resolucion)
         
         # Aplicar convolución
-        dx = convolve(Z, kernel_x, mode='nearest')
-        dy = convolve(Z, kernel_y, mode='nearest')
+        dx = scipy_ndimage.convolve(Z, kernel_x, mode='nearest')
+        dy = scipy_ndimage.convolve(Z, kernel_y, mode='nearest')
         
         # Calcular pendiente en porcentaje
         pendiente_porcentaje = np.sqrt(dx**2 + dy**2) * 100
@@ -2117,8 +2472,6 @@ def calcular_curvatura(dx, dy, resolucion):
 
 def generar_curvas_nivel_profesional(X, Y, Z, intervalo=5.0, suavizado=True):
     """Genera curvas de nivel profesionales con interpolación y etiquetado"""
-    from scipy.interpolate import griddata
-    from scipy.ndimage import gaussian_filter
     
     # Verificar datos
     if np.all(np.isnan(Z)):
@@ -2126,7 +2479,7 @@ def generar_curvas_nivel_profesional(X, Y, Z, intervalo=5.0, suavizado=True):
     
     # Suavizar si se solicita
     if suavizado:
-        Z_smooth = gaussian_filter(Z, sigma=1.5)
+        Z_smooth = scipy_ndimage.gaussian_filter(Z, sigma=1.5)
         Z_smooth[np.isnan(Z)] = np.nan
     else:
         Z_smooth = Z.copy()
@@ -2159,7 +2512,6 @@ def generar_curvas_nivel_profesional(X, Y, Z, intervalo=5.0, suavizado=True):
         return [], []
     
     # Usar matplotlib para contornos profesionales
-    import matplotlib.pyplot as plt
     
     curvas_nivel = []
     elevaciones = []
@@ -2182,11 +2534,10 @@ def generar_curvas_nivel_profesional(X, Y, Z, intervalo=5.0, suavizado=True):
                 if len(path.vertices) > 3:
                     # Suavizar con spline
                     try:
-                        from scipy.interpolate import splprep, splev
-                        tck, u = splprep([path.vertices[:, 0], path.vertices[:, 1]], 
+                        tck, u = scipy_interpolate.splprep([path.vertices[:, 0], path.vertices[:, 1]], 
                                         s=0, k=3)
                         u_new = np.linspace(u.min(), u.max(), max(50, len(u)))
-                        x_new, y_new = splev(u_new, tck)
+                        x_new, y_new = scipy_interpolate.splev(u_new, tck)
                         vertices = np.column_stack([x_new, y_new])
                     except:
                         vertices = path.vertices
@@ -2212,80 +2563,39 @@ def ejecutar_analisis_completo_con_nasa(gdf, cultivo, n_divisiones, satelite, fe
     """Versión mejorada con datos NASA SRTM"""
     
    # ===== FUNCIONES DEM SINTÉTICO Y CURVAS DE NIVEL =====
-def generar_dem_sintetico(gdf, resolucion=10.0):
-    """Genera un DEM sintético para análisis de terreno"""
-    gdf = validar_y_corregir_crs(gdf)
-    bounds = gdf.total_bounds
-    minx, miny, maxx, maxy = bounds
-    
-    # Crear grid
-    num_cells_x = int((maxx - minx) * 111000 / resolucion)  # 1 grado ≈ 111km
-    num_cells_y = int((maxy - miny) * 111000 / resolucion)
-    num_cells_x = max(50, min(num_cells_x, 200))
-    num_cells_y = max(50, min(num_cells_y, 200))
+FUENTES_DEM_REALES = ("NASA SRTM (Datos Reales)", "ASTER GDEM")
 
-    x = np.linspace(minx, maxx, num_cells_x)
-    y = np.linspace(miny, maxy, num_cells_y)
-    X, Y = np.meshgrid(x, y)
-
-    # Generar terreno sintético
-    centroid = gdf.geometry.unary_union.centroid
-    seed_value = int(centroid.x * 10000 + centroid.y * 10000) % (2**32)
-    rng = np.random.RandomState(seed_value)
-
-    # Elevación base
-    elevacion_base = rng.uniform(100, 300)
-
-    # Pendiente general
-    slope_x = rng.uniform(-0.001, 0.001)
-    slope_y = rng.uniform(-0.001, 0.001)
-
-    # Relieve
-    relief = np.zeros_like(X)
-    n_hills = rng.randint(3, 7)
-    for _ in range(n_hills):
-        hill_center_x = rng.uniform(minx, maxx)
-        hill_center_y = rng.uniform(miny, maxy)
-        hill_radius = rng.uniform(0.001, 0.005)
-        hill_height = rng.uniform(20, 80)
-        dist = np.sqrt((X - hill_center_x)**2 + (Y - hill_center_y)**2)
-        relief += hill_height * np.exp(-(dist**2) / (2 * hill_radius**2))
-
-    # Valles
-    n_valleys = rng.randint(2, 5)
-    for _ in range(n_valleys):
-        valley_center_x = rng.uniform(minx, maxx)
-        valley_center_y = rng.uniform(miny, maxy)
-        valley_radius = rng.uniform(0.002, 0.006)
-        valley_depth = rng.uniform(10, 40)
-        dist = np.sqrt((X - valley_center_x)**2 + (Y - valley_center_y)**2)
-        relief -= valley_depth * np.exp(-(dist**2) / (2 * valley_radius**2))
-
-    # Ruido
-    noise = rng.randn(*X.shape) * 5
-
-    Z = elevacion_base + slope_x * (X - minx) + slope_y * (Y - miny) + relief + noise
-    Z = np.maximum(Z, 50)  # Evitar valores negativos
-
-    # Aplicar máscara de la parcela
-    points = np.vstack([X.flatten(), Y.flatten()]).T
-    parcel_mask = gdf.geometry.unary_union.contains([Point(p) for p in points])
-    parcel_mask = parcel_mask.reshape(X.shape)
-
-    Z[~parcel_mask] = np.nan
-
-    return X, Y, Z, bounds
+def obtener_dem_real(parcela, fuente_dem=None):
+    """DEM (X, Y, Z, bounds, fuente) de la fuente real elegida, o None para usar el DEM sintético"""
+    if fuente_dem == "NASA SRTM (Datos Reales)":
+        dem_real = obtener_datos_srtm_nasa(parcela)
+        if dem_real is not None:
+            return (*dem_real, 'NASA SRTM')
+    elif fuente_dem == "ASTER GDEM":
+        dem_real = obtener_datos_aster_gdem(como_parcela(parcela).gdf)
+        if dem_real is not None:
+            return (*dem_real, 'ASTER GDEM')
+    if fuente_dem in FUENTES_DEM_REALES:
+        st.info("🔬 Usando DEM sintético (datos reales no disponibles)")
+    return None
 
-def calcular_pendiente(X, Y, Z, resolucion):
-    """Calcula pendiente a partir del DEM"""
-    # Calcular gradientes
-    dy = np.gradient(Z, axis=0) / resolucion
-    dx = np.gradient(Z, axis=1) / resolucion
-    # Calcular pendiente en porcentaje
-    pendiente = np.sqrt(dx**2 + dy**2) * 100
-    pendiente = np.clip(pendiente, 0, 100)
+def comprimir_dem(X, Y, Z, pendientes, bounds, curvas_nivel=None, elevaciones=None):
+    """Representación compacta de un DEM regular: ejes 1-D (float64) y rásters float32"""
+    return {
+        'x': np.ascontiguousarray(X[0, :], dtype=np.float64),
+        'y': np.ascontiguousarray(Y[:, 0], dtype=np.float64),
+        'Z': np.asarray(Z, dtype=np.float32),
+        'pendientes': np.asarray(pendientes, dtype=np.float32),
+        'bounds': bounds,
+        'curvas_nivel': curvas_nivel,
+        'elevaciones': elevaciones
+    }
 
-    return pendiente
+def expandir_malla(x, y):
+    """Mallas 2-D a partir de ejes 1-D (o las mismas mallas si ya son 2-D)"""
+    if np.ndim(x) == 1 and np.ndim(y) == 1:
+        return np.meshgrid(x, y)
+    return x, y
 
 def generar_curvas_nivel(X, Y, Z, intervalo=5.0):
     """Genera curvas de nivel a partir del DEM"""
@@ -2314,9 +2624,8 @@ def generar_curvas_nivel(X, Y, Z, intervalo=5.0):
         
         if np.any(mascara):
             # Encontrar contornos
-            from scipy import ndimage
-            estructura = ndimage.generate_binary_structure(2, 2)
-            labeled, num_features = ndimage.label(mascara, structure=estructura)
+            estructura = scipy_ndimage.generate_binary_structure(2, 2)
+            labeled, num_features = scipy_ndimage.label(mascara, structure=estructura)
             
             for i in range(1, num_features + 1):
                 # Extraer contorno
@@ -2489,231 +2798,67 @@ def crear_mapa_topografico_completo(X, Y, Z, curvas_nivel, elevaciones, gdf_orig
         st.error(f"❌ Error creando mapa topográfico: {str(e)}")
         return None
 
-# ===== FUNCIONES DE ANÁLISIS COMPLETOS =====
-def analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales):
-    """Análisis de fertilidad actual"""
-    n_poligonos = len(gdf_dividido)
-    resultados = []
-    gdf_centroids = gdf_dividido.copy()
-    gdf_centroids['centroid'] = gdf_dividido.geometry.centroid
-    gdf_centroids['x'] = gdf_centroids.centroid.x
-    gdf_centroids['y'] = gdf_centroids.centroid.y
-    x_coords = gdf_centroids['x'].tolist()
-    y_coords = gdf_centroids['y'].tolist()
-    x_min, x_max = min(x_coords), max(x_coords)
-    y_min, y_max = min(y_coords), max(y_coords)
-    params = PARAMETROS_CULTIVOS[cultivo]
-    valor_base_satelital = datos_satelitales.get('valor_promedio', 0.6) if datos_satelitales else 0.6
-    for idx, row in gdf_centroids.iterrows():
-        x_norm = (row['x'] - x_min) / (x_max - x_min) if x_max != x_min else 0.5
-        y_norm = (row['y'] - y_min) / (y_max - y_min) if y_max != y_min else 0.5
-        patron_espacial = (x_norm * 0.6 + y_norm * 0.4)
-        
-        base_mo = params['MATERIA_ORGANICA_OPTIMA'] * 0.7
-        variabilidad_mo = patron_espacial * (params['MATERIA_ORGANICA_OPTIMA'] * 0.6)
-        materia_organica = base_mo + variabilidad_mo + np.random.normal(0, 0.2)
-        materia_organica = max(0.5, min(8.0, materia_organica))
-        
-        base_humedad = params['HUMEDAD_OPTIMA'] * 0.8
-        variabilidad_humedad = patron_espacial * (params['HUMEDAD_OPTIMA'] * 0.4)
-        humedad_suelo = base_humedad + variabilidad_humedad + np.random.normal(0, 0.05)
-        humedad_suelo = max(0.1, min(0.8, humedad_suelo))
-        
-        ndvi_base = valor_base_satelital * 0.8
-        ndvi_variacion = patron_espacial * (valor_base_satelital * 0.4)
-        ndvi = ndvi_base + ndvi_variacion + np.random.normal(0, 0.06)
-        ndvi = max(0.1, min(0.9, ndvi))
-        
-        ndre_base = params['NDRE_OPTIMO'] * 0.7
-        ndre_variacion = patron_espacial * (params['NDRE_OPTIMO'] * 0.4)
-        ndre = ndre_base + ndre_variacion + np.random.normal(0, 0.04)
-        ndre = max(0.05, min(0.7, ndre))
-        
-        ndwi = 0.2 + np.random.normal(0, 0.08)
-        ndwi = max(0, min(1, ndwi))
-        
-        npk_actual = (ndvi * 0.4) + (ndre * 0.3) + ((materia_organica / 8) * 0.2) + (humedad_suelo * 0.1)
-        npk_actual = max(0, min(1, npk_actual))
-        
-        resultados.append({
-            'materia_organica': round(materia_organica, 2),
-            'humedad_suelo': round(humedad_suelo, 3),
-            'ndvi': round(ndvi, 3),
-            'ndre': round(ndre, 3),
-            'ndwi': round(ndwi, 3),
-            'npk_actual': round(npk_actual, 3)
-        })
-
-    return resultados
-
-def analizar_recomendaciones_npk(indices, cultivo):
-    """Análisis de recomendaciones NPK"""
-    recomendaciones_n = []
-    recomendaciones_p = []
-    recomendaciones_k = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-
-    for idx in indices:
-        ndre = idx['ndre']
-        materia_organica = idx['materia_organica']
-        humedad_suelo = idx['humedad_suelo']
-        ndvi = idx['ndvi']
-        
-        factor_n = ((1 - ndre) * 0.6 + (1 - ndvi) * 0.4)
-        n_recomendado = (factor_n * (params['NITROGENO']['max'] - params['NITROGENO']['min']) + params['NITROGENO']['min'])
-        n_recomendado = max(params['NITROGENO']['min'] * 0.8, min(params['NITROGENO']['max'] * 1.2, n_recomendado))
-        recomendaciones_n.append(round(n_recomendado, 1))
-        
-        factor_p = ((1 - (materia_organica / 8)) * 0.7 + (1 - humedad_suelo) * 0.3)
-        p_recomendado = (factor_p * (params['FOSFORO']['max'] - params['FOSFORO']['min']) + params['FOSFORO']['min'])
-        p_recomendado = max(params['FOSFORO']['min'] * 0.8, min(params['FOSFORO']['max'] * 1.2, p_recomendado))
-        recomendaciones_p.append(round(p_recomendado, 1))
-        
-        factor_k = ((1 - ndre) * 0.4 + (1 - humedad_suelo) * 0.4 + (1 - (materia_organica / 8)) * 0.2)
-        k_recomendado = (factor_k * (params['POTASIO']['max'] - params['POTASIO']['min']) + params['POTASIO']['min'])
-        k_recomendado = max(params['POTASIO']['min'] * 0.8, min(params['POTASIO']['max'] * 1.2, k_recomendado))
-        recomendaciones_k.append(round(k_recomendado, 1))
-
-    return recomendaciones_n, recomendaciones_p, recomendaciones_k
-
-def analizar_costos(gdf_dividido, cultivo, recomendaciones_n, recomendaciones_p, recomendaciones_k):
-    """Análisis de costos de fertilización"""
-    costos = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-    precio_n = 1.2  # USD/kg N
-    precio_p = 2.5  # USD/kg P2O5
-    precio_k = 1.8  # USD/kg K2O
-
-    for i in range(len(gdf_dividido)):
-        costo_n = recomendaciones_n[i] * precio_n
-        costo_p = recomendaciones_p[i] * precio_p
-        costo_k = recomendaciones_k[i] * precio_k
-        costo_total = costo_n + costo_p + costo_k + params['COSTO_FERTILIZACION']
-        
-        costos.append({
-            'costo_nitrogeno': round(costo_n, 2),
-            'costo_fosforo': round(costo_p, 2),
-            'costo_potasio': round(costo_k, 2),
-            'costo_total': round(costo_total, 2)
-        })
-
-    return costos
-
-def analizar_proyecciones_cosecha(gdf_dividido, cultivo, indices):
-    """Análisis de proyecciones de cosecha con y sin fertilización"""
-    proyecciones = []
-    params = PARAMETROS_CULTIVOS[cultivo]
-    for idx in indices:
-        npk_actual = idx['npk_actual']
-        ndvi = idx['ndvi']
-        
-        # Rendimiento base sin fertilización
-        rendimiento_base = params['RENDIMIENTO_OPTIMO'] * npk_actual * 0.7
-        
-        # Incremento esperado con fertilización
-        incremento = (1 - npk_actual) * 0.4 + (1 - ndvi) * 0.2
-        rendimiento_con_fert = rendimiento_base * (1 + incremento)
-        
-        proyecciones.append({
-            'rendimiento_sin_fert': round(rendimiento_base, 0),
-            'rendimiento_con_fert': round(rendimiento_con_fert, 0),
-            'incremento_esperado': round(incremento * 100, 1)
-        })
+# ===== COLORES DE LAS CLASES TEXTURALES USDA =====
+COLORES_TEXTURA = {
+    'Arenoso': '#f6e8c3',
+    'Arenoso franco': '#f0d99a',
+    'Franco arenoso': '#dfc27d',
+    'Franco': '#c7eae5',
+    'Franco limoso': '#a6dba0',
+    'Limoso': '#5aae61',
+    'Franco arcillo arenoso': '#bf812d',
+    'Franco arcilloso': '#5ab4ac',
+    'Franco arcillo limoso': '#35978f',
+    'Arcilloso arenoso': '#8c510a',
+    'Arcilloso limoso': '#01665e',
+    'Arcilloso': '#543005',
+    'NO_DETERMINADA': '#999999'
+}
 
-    return proyecciones
+# ===== FUNCIÓN PARA EJECUTAR TODOS LOS ANÁLISIS =====
+def preparar_entradas_analisis(parcela, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
+                               tamano_celda_m=None, zonificacion='grilla', fuente_dem=None):
+    """Semilla, escena satelital y DEM real de la parcela: las entradas que usan red, cachés o la sesión GEE.
 
-def clasificar_textura_suelo(arena, limo, arcilla):
+    Devuelve (semilla, datos_satelitales, dem_real); dem_real es None si se usa el DEM sintético.
+    """
+    # Semilla determinista: la misma parcela con la misma configuración da resultados idénticos;
+    # cada etapa estocástica usa su propia semilla derivada. El terreno y la textura son propiedades
+    # de la parcela: se siembran solo con su huella para no cambiar con la configuración del análisis
+    semilla = derivar_semilla(parcela.huella, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
+                              indice_seleccionado, tamano_celda_m, zonificacion)
+    
+    # Obtener datos satelitales
+    datos_satelitales = None
+    if satelite in ['SENTINEL-2_GEE', 'LANDSAT-8_GEE', 'LANDSAT-9_GEE']:
+        # Usar Google Earth Engine
+        datos_satelitales = descargar_datos_satelitales_gee(parcela, fecha_inicio, fecha_fin, satelite, indice_seleccionado)
+        if datos_satelitales is None:
+            st.warning("⚠️ No se pudieron obtener datos de GEE. Usando datos simulados.")
+            datos_satelitales = generar_datos_simulados(parcela.gdf, cultivo, indice_seleccionado,
+                                                        derivar_semilla(semilla, 'satelite'), fecha_fin)
+    elif satelite == "SENTINEL-2":
+        datos_satelitales = descargar_datos_sentinel2(parcela.gdf, fecha_inicio, fecha_fin, indice_seleccionado,
+                                                      derivar_semilla(semilla, 'satelite'))
+    elif satelite == "LANDSAT-8":
+        datos_satelitales = descargar_datos_landsat8(parcela.gdf, fecha_inicio, fecha_fin, indice_seleccionado,
+                                                     derivar_semilla(semilla, 'satelite'))
+    else:
+        datos_satelitales = generar_datos_simulados(parcela.gdf, cultivo, indice_seleccionado,
+                                                    derivar_semilla(semilla, 'satelite'), fecha_fin)
+    
+    # DEM real (si no está disponible, las etapas de cálculo generan el sintético)
+    dem_real = None
     try:
-        total = arena + limo + arcilla
-        if total == 0:
-            return "NO_DETERMINADA"
-        arena_norm = (arena / total) * 100
-        limo_norm = (limo / total) * 100
-        arcilla_norm = (arcilla / total) * 100
-        if arcilla_norm >= 35:
-            return "Franco arcilloso"
-        elif arcilla_norm >= 25 and arcilla_norm <= 35 and arena_norm >= 20 and arena_norm <= 45:
-            return "Franco arcilloso"
-        elif arena_norm >= 55 and arena_norm <= 70 and arcilla_norm >= 10 and arcilla_norm <= 20:
-            return "Franco arenoso"
-        elif arena_norm >= 40 and arena_norm <= 55 and arcilla_norm >= 20 and arcilla_norm <= 30:
-            return "Franco"
-        else:
-            return "Franco"
+        dem_real = obtener_dem_real(parcela, fuente_dem)
     except Exception as e:
-        return "NO_DETERMINADA"
-
-def analizar_textura_suelo(gdf_dividido, cultivo):
-    """Análisis de textura del suelo"""
-    gdf_dividido = validar_y_corregir_crs(gdf_dividido)
-    params_textura = TEXTURA_SUELO_OPTIMA[cultivo]
-    gdf_dividido['area_ha'] = 0.0
-    gdf_dividido['arena'] = 0.0
-    gdf_dividido['limo'] = 0.0
-    gdf_dividido['arcilla'] = 0.0
-    gdf_dividido['textura_suelo'] = "NO_DETERMINADA"
-
-    for idx, row in gdf_dividido.iterrows():
-        try:
-            area_gdf = gpd.GeoDataFrame({'geometry': [row.geometry]}, crs=gdf_dividido.crs)
-            area_ha = calcular_superficie(area_gdf)
-            if hasattr(area_ha, 'iloc'):
-                area_ha = float(area_ha.iloc[0])
-            elif hasattr(area_ha, '__len__') and len(area_ha) > 0:
-                area_ha = float(area_ha[0])
-            else:
-                area_ha = float(area_ha)
-            
-            centroid = row.geometry.centroid if hasattr(row.geometry, 'centroid') else row.geometry.representative_point()
-            seed_value = abs(hash(f"{centroid.x:.6f}_{centroid.y:.6f}_{cultivo}_textura")) % (2**32)
-            rng = np.random.RandomState(seed_value)
-            
-            lat_norm = (centroid.y + 90) / 180 if centroid.y else 0.5
-            lon_norm = (centroid.x + 180) / 360 if centroid.x else 0.5
-            variabilidad_local = 0.15 + 0.7 * (lat_norm * lon_norm)
-            
-            arena_optima = params_textura['arena_optima']
-            limo_optima = params_textura['limo_optima']
-            arcilla_optima = params_textura['arcilla_optima']
-            
-            arena_val = max(5, min(95, rng.normal(
-                arena_optima * (0.8 + 0.4 * variabilidad_local),
-                arena_optima * 0.15
-            )))
-            limo_val = max(5, min(95, rng.normal(
-                limo_optima * (0.7 + 0.6 * variabilidad_local),
-                limo_optima * 0.2
-            )))
-            arcilla_val = max(5, min(95, rng.normal(
-                arcilla_optima * (0.75 + 0.5 * variabilidad_local),
-                arcilla_optima * 0.15
-            )))
-            
-            total = arena_val + limo_val + arcilla_val
-            arena_pct = (arena_val / total) * 100
-            limo_pct = (limo_val / total) * 100
-            arcilla_pct = (arcilla_val / total) * 100
-            
-            textura = clasificar_textura_suelo(arena_pct, limo_pct, arcilla_pct)
-            
-            gdf_dividido.at[idx, 'area_ha'] = area_ha
-            gdf_dividido.at[idx, 'arena'] = float(arena_pct)
-            gdf_dividido.at[idx, 'limo'] = float(limo_pct)
-            gdf_dividido.at[idx, 'arcilla'] = float(arcilla_pct)
-            gdf_dividido.at[idx, 'textura_suelo'] = textura
-            
-        except Exception as e:
-            gdf_dividido.at[idx, 'area_ha'] = 0.0
-            gdf_dividido.at[idx, 'arena'] = float(params_textura['arena_optima'])
-            gdf_dividido.at[idx, 'limo'] = float(params_textura['limo_optima'])
-            gdf_dividido.at[idx, 'arcilla'] = float(params_textura['arcilla_optima'])
-            gdf_dividido.at[idx, 'textura_suelo'] = params_textura['textura_optima']
-
-    return gdf_dividido
+        st.warning(f"⚠️ Error obteniendo el DEM real: {e}")
+    
+    return semilla, datos_satelitales, dem_real
 
-# ===== FUNCIÓN PARA EJECUTAR TODOS LOS ANÁLISIS =====
 def ejecutar_analisis_completo(gdf, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin,
-                               intervalo_curvas=5.0, resolucion_dem=10.0):
+                               intervalo_curvas=5.0, resolucion_dem=10.0, tamano_celda_m=None,
+                               zonificacion='grilla', fuente_dem=None):
     """Ejecuta todos los análisis y guarda los resultados"""
     resultados = {
         'exitoso': False,
@@ -2733,117 +2878,63 @@ def ejecutar_analisis_completo(gdf, cultivo, n_divisiones, satelite, fecha_inici
     }
 
     try:
-        # Cargar y preparar datos
-        gdf = validar_y_corregir_crs(gdf)
-        area_total = calcular_superficie(gdf)
+        # Cargar y preparar datos (la parcela cachea proyecciones, unión y centroide)
+        parcela = como_parcela(gdf)
+        area_total = calcular_superficie(parcela)
         resultados['area_total'] = area_total
         
-        # Obtener datos satelitales
-        datos_satelitales = None
-        if satelite in ['SENTINEL-2_GEE', 'LANDSAT-8_GEE', 'LANDSAT-9_GEE']:
-            # Usar Google Earth Engine
-            datos_satelitales = descargar_datos_satelitales_gee(gdf, fecha_inicio, fecha_fin, satelite, indice_seleccionado)
-            if datos_satelitales is None:
-                st.warning("⚠️ No se pudieron obtener datos de GEE. Usando datos simulados.")
-                datos_satelitales = generar_datos_simulados(gdf, cultivo, indice_seleccionado)
-        elif satelite == "SENTINEL-2":
-            datos_satelitales = descargar_datos_sentinel2(gdf, fecha_inicio, fecha_fin, indice_seleccionado)
-        elif satelite == "LANDSAT-8":
-            datos_satelitales = descargar_datos_landsat8(gdf, fecha_inicio, fecha_fin, indice_seleccionado)
-        else:
-            datos_satelitales = generar_datos_simulados(gdf, cultivo, indice_seleccionado)
-        
+        semilla, datos_satelitales, dem_real = preparar_entradas_analisis(
+            parcela, cultivo, n_divisiones, satelite, fecha_inicio, fecha_fin, tamano_celda_m, zonificacion, fuente_dem
+        )
+        resultados['semilla'] = semilla
         resultados['datos_satelitales'] = datos_satelitales
         
         # Obtener datos meteorológicos
-        df_power = obtener_datos_nasa_power(gdf, fecha_inicio, fecha_fin)
+        df_power = obtener_datos_nasa_power(parcela, fecha_inicio, fecha_fin)
         resultados['df_power'] = df_power
         
-        # Dividir parcela
-        gdf_dividido = dividir_parcela_en_zonas(gdf, n_divisiones)
+        # Etapas de cálculo: DEM, zonas, fertilidad, prescripción NPK (dosis, costos y proyecciones),
+        # textura y terreno por zona. Son las mismas que el modo por lotes reparte entre procesos
+        etapas = analizar_zonas(parcela, cultivo, n_divisiones, datos_satelitales, semilla, resolucion_dem,
+                                tamano_celda_m, zonificacion, dem=dem_real)
+        for aviso in etapas['avisos']:
+            st.warning(aviso)
+        gdf_dividido = etapas['gdf_dividido']
         resultados['gdf_dividido'] = gdf_dividido
         
-        # Calcular áreas
-        areas_ha_list = []
-        for idx, row in gdf_dividido.iterrows():
-            area_gdf = gpd.GeoDataFrame({'geometry': [row.geometry]}, crs=gdf_dividido.crs)
-            area_ha = calcular_superficie(area_gdf)
-            if hasattr(area_ha, 'iloc'):
-                area_ha = float(area_ha.iloc[0])
-            elif hasattr(area_ha, '__len__') and len(area_ha) > 0:
-                area_ha = float(area_ha[0])
-            else:
-                area_ha = float(area_ha)
-            areas_ha_list.append(area_ha)
+        # Precargar teselas del mapa base para los mapas de resultados
+        precargar_basemap(gdf_dividido, offline=modo_offline_basemap)
         
-        gdf_dividido['area_ha'] = areas_ha_list
-        
-        # 1. Análisis de fertilidad actual
-        fertilidad_actual = analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales)
-        resultados['fertilidad_actual'] = fertilidad_actual
-        
-        # 2. Análisis de recomendaciones NPK
-        rec_n, rec_p, rec_k = analizar_recomendaciones_npk(fertilidad_actual, cultivo)
+        resultados['fertilidad_actual'] = etapas['fertilidad_actual']
+        prescripcion = etapas['prescripcion']
         resultados['recomendaciones_npk'] = {
-            'N': rec_n,
-            'P': rec_p,
-            'K': rec_k
+            'N': prescripcion['rec_N'],
+            'P': prescripcion['rec_P'],
+            'K': prescripcion['rec_K']
         }
+        resultados['costos'] = {columna: prescripcion[columna] for columna in COLUMNAS_COSTOS}
+        resultados['proyecciones'] = {columna: prescripcion[columna] for columna in COLUMNAS_PROYECCIONES}
+        resultados['textura'] = etapas['textura']
         
-        # 3. Análisis de costos
-        costos = analizar_costos(gdf_dividido, cultivo, rec_n, rec_p, rec_k)
-        resultados['costos'] = costos
-        
-        # 4. Análisis de proyecciones
-        proyecciones = analizar_proyecciones_cosecha(gdf_dividido, cultivo, fertilidad_actual)
-        resultados['proyecciones'] = proyecciones
-        
-        # 5. Análisis de textura
-        textura = analizar_textura_suelo(gdf_dividido, cultivo)
-        resultados['textura'] = textura
-        
-        # 6. Análisis DEM y curvas de nivel
-        try:
-            X, Y, Z, bounds = generar_dem_sintetico(gdf, resolucion_dem)
-            pendientes = calcular_pendiente(X, Y, Z, resolucion_dem)
-            curvas_nivel, elevaciones = generar_curvas_nivel(X, Y, Z, intervalo_curvas)
-            
-            resultados['dem_data'] = {
-                'X': X,
-                'Y': Y,
-                'Z': Z,
-                'bounds': bounds,
-                'pendientes': pendientes,
-                'curvas_nivel': curvas_nivel,
-                'elevaciones': elevaciones
-            }
-        except Exception as e:
-            st.warning(f"⚠️ Error generando DEM y curvas de nivel: {e}")
-        
-        # Combinar todos los resultados en un solo GeoDataFrame
-        gdf_completo = textura.copy()
-        
-        # Añadir fertilidad
-        for i, fert in enumerate(fertilidad_actual):
-            for key, value in fert.items():
-                gdf_completo.at[gdf_completo.index[i], f'fert_{key}'] = value
-        
-        # Añadir recomendaciones NPK
-        gdf_completo['rec_N'] = rec_n
-        gdf_completo['rec_P'] = rec_p
-        gdf_completo['rec_K'] = rec_k
-        
-        # Añadir costos
-        for i, costo in enumerate(costos):
-            for key, value in costo.items():
-                gdf_completo.at[gdf_completo.index[i], f'costo_{key}'] = value
-        
-        # Añadir proyecciones
-        for i, proy in enumerate(proyecciones):
-            for key, value in proy.items():
-                gdf_completo.at[gdf_completo.index[i], f'proy_{key}'] = value
+        # Curvas de nivel; se guardan solo los ejes 1-D y rásters float32: las mallas se reconstruyen al graficar
+        dem = etapas.pop('dem')
+        if dem is not None:
+            try:
+                X, Y, Z, bounds, pendientes, fuente_dem_usada = dem
+                dem = None
+                curvas_nivel, elevaciones = generar_curvas_nivel(X, Y, Z, intervalo_curvas)
+                resultados['dem_data'] = comprimir_dem(X, Y, Z, pendientes, bounds, curvas_nivel, elevaciones)
+                resultados['dem_data']['fuente'] = fuente_dem_usada
+                if etapas['etiquetas_zonas'] is not None:
+                    resultados['dem_data']['etiquetas_zonas'] = etapas['etiquetas_zonas']
+                del X, Y, Z, pendientes
+            except Exception as e:
+                st.warning(f"⚠️ Error generando DEM y curvas de nivel: {e}")
         
+        gdf_completo = etapas['gdf_completo']
         resultados['gdf_completo'] = gdf_completo
+        resultados['zonas'] = Parcela(gdf_completo)
+        resultados['huella'] = huella_resultados(resultados)
         resultados['exitoso'] = True
         
         return resultados
@@ -2854,13 +2945,365 @@ def ejecutar_analisis_completo(gdf, cultivo, n_divisiones, satelite, fecha_inici
         traceback.print_exc()
         return resultados
 
+# ===== MODO POR LOTES: ETAPAS DE CÁLCULO EN UN POOL DE PROCESOS =====
+LOTES_MAX_PROCESOS = int(os.environ.get('ANALIZADOR_MAX_PROCESOS', os.cpu_count() or 1))
+LOTES_TIMEOUT_S = 900
+
+def ejecutar_analisis_por_lotes(parcela, parametros, progreso=None):
+    """Analiza cada lote por separado, repartiendo las etapas de cálculo en un pool de procesos.
+
+    Las entradas que usan red, cachés o la sesión GEE (escena satelital y DEM
+    real) se preparan en el hilo de la sesión. Las etapas de cálculo
+    (nucleo_analisis) corren en procesos 'spawn', que importan solo ese módulo;
+    si el pool no está disponible o vence el tiempo, los lotes pendientes se
+    procesan en serie. Por lote se conserva solo lo que usan la tabla
+    consolidada y el ZIP, más la geometría del lote para detallarlo bajo demanda.
+    """
+    gdf = parcela.gdf
+    tareas = []
+    resumenes = {}
+    for i, nombre in enumerate(gdf['nombre_lote']):
+        lote = Parcela(gdf.iloc[[i]].reset_index(drop=True))
+        semilla, datos_satelitales, dem_real = preparar_entradas_analisis(
+            lote, parametros['cultivo'], parametros['n_divisiones'], parametros['satelite'],
+            parametros['fecha_inicio'], parametros['fecha_fin'], parametros['tamano_celda_m'],
+            parametros['zonificacion'], parametros['fuente_dem']
+        )
+        resumenes[nombre] = {'gdf_lote': lote.gdf, 'area_total': calcular_superficie(lote), 'semilla': semilla}
+        tareas.append((nombre, lote.gdf, {
+            'cultivo': parametros['cultivo'], 'n_divisiones': parametros['n_divisiones'],
+            'datos_satelitales': datos_satelitales, 'semilla': semilla,
+            'resolucion_dem': parametros['resolucion_dem'], 'tamano_celda_m': parametros['tamano_celda_m'],
+            'zonificacion': parametros['zonificacion'], 'dem': dem_real
+        }))
+    salidas = {}
+    
+    def avisar():
+        if progreso is not None:
+            progreso(len(salidas), len(tareas))
+    
+    n_procesos = min(LOTES_MAX_PROCESOS, len(tareas))
+    if n_procesos > 1:
+        pool = ProcessPoolExecutor(max_workers=n_procesos, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            futuros = {pool.submit(analizar_lote, tarea): tarea[0] for tarea in tareas}
+            for futuro in as_completed(futuros, timeout=LOTES_TIMEOUT_S):
+                salidas[futuros[futuro]] = futuro.result()
+                avisar()
+        except Exception as e:
+            print(f"⚠️ Pool de procesos no disponible ({str(e)}); se continúa en serie")
+        finally:
+            # Sin esperar a procesos colgados: sus lotes se vuelven a procesar en serie
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    for tarea in tareas:
+        if tarea[0] not in salidas:
+            salidas[tarea[0]] = analizar_lote(tarea)
+            avisar()
+    
+    for nombre, resumen in resumenes.items():
+        salida = salidas[nombre]
+        for aviso in salida['avisos']:
+            st.warning(f"{nombre}: {aviso}")
+        resumen['exitoso'] = salida['exitoso']
+        if salida['exitoso']:
+            resumen['gdf_completo'] = salida['gdf_completo']
+            resumen['huella'] = huella_resultados(resumen)
+    return resumenes
+
+def tabla_consolidada_lotes(resultados_lotes):
+    """Una fila por lote con los indicadores principales de su análisis"""
+    filas = []
+    for nombre, resultados in resultados_lotes.items():
+        gdf_completo = resultados.get('gdf_completo')
+        if not resultados.get('exitoso') or gdf_completo is None:
+            filas.append({'Lote': nombre, 'Estado': 'Error'})
+            continue
+        rend_sin = gdf_completo['proy_rendimiento_sin_fert'].sum()
+        rend_con = gdf_completo['proy_rendimiento_con_fert'].sum()
+        filas.append({
+            'Lote': nombre,
+            'Estado': 'OK',
+            'Área (ha)': round(resultados['area_total'], 2),
+            'Zonas': len(gdf_completo),
+            'Índice NPK': round(gdf_completo['fert_npk_actual'].mean(), 3),
+            'N (kg/ha)': round(gdf_completo['rec_N'].mean(), 1),
+            'P (kg/ha)': round(gdf_completo['rec_P'].mean(), 1),
+            'K (kg/ha)': round(gdf_completo['rec_K'].mean(), 1),
+            'Costo total (USD)': round(gdf_completo['costo_costo_total'].sum(), 2),
+            'Rend. sin fert. (kg)': round(rend_sin, 0),
+            'Rend. con fert. (kg)': round(rend_con, 0),
+            'Incremento (%)': round((rend_con - rend_sin) / rend_sin * 100, 1) if rend_sin > 0 else 0.0,
+            'Textura predominante': gdf_completo['textura_suelo'].mode()[0] if len(gdf_completo) > 0 else 'N/D'
+        })
+    return pd.DataFrame(filas)
+
+def generar_zip_lotes(resultados_lotes, cultivo, satelite):
+    """ZIP con la tabla consolidada y, por lote, sus zonas (GeoJSON/CSV) y el mapa de fertilidad"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_salida:
+        zip_salida.writestr('resumen_lotes.csv', tabla_consolidada_lotes(resultados_lotes).to_csv(index=False))
+        for nombre, resultados in resultados_lotes.items():
+            if not resultados.get('exitoso'):
+                continue
+            carpeta = re.sub(r'[^\w\-]+', '_', nombre).strip('_') or 'lote'
+            gdf_completo = resultados['gdf_completo']
+            zip_salida.writestr(f"{carpeta}/zonas.geojson", gdf_completo.to_json())
+            zip_salida.writestr(f"{carpeta}/zonas.csv", gdf_completo.drop(columns='geometry').to_csv(index=False))
+            mapa = renderizar_con_cache(
+                'fertilidad', resultados.get('huella'), (cultivo, satelite, modo_offline_basemap),
+                crear_mapa_fertilidad, resultados.get('zonas') or gdf_completo, cultivo, satelite
+            )
+            if mapa:
+                zip_salida.writestr(f"{carpeta}/mapa_fertilidad.png", mapa)
+    return buffer.getvalue()
+
+# ===== MAPA BASE: CACHÉ LOCAL DE TESELAS =====
+ORIGEN_WEB_MERCATOR = 20037508.342789244
+
+class CacheTeselasBasemap:
+    """Teselas z/x/y del mapa base guardadas en disco, con desalojo LRU por tamaño total"""
+
+    def __init__(self, directorio, url=BASEMAP_URL, max_bytes=BASEMAP_MAX_MB * 1024 * 1024):
+        self.directorio = directorio
+        self.url = url
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self.descargas = 0
+        self.errores = 0
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        self._bytes = sum(os.path.getsize(r) for r in self._archivos())
+
+    def _archivos(self):
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if nombre.endswith('.tile'):
+                    yield os.path.join(raiz, nombre)
+
+    def _ruta(self, z, x, y):
+        return os.path.join(self.directorio, str(z), str(x), f"{y}.tile")
+
+    def _desalojar(self):
+        """Borra las teselas menos usadas recientemente hasta volver bajo el límite"""
+        archivos = sorted(self._archivos(), key=os.path.getmtime)
+        for ruta in archivos:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                tamano = os.path.getsize(ruta)
+                os.remove(ruta)
+                self._bytes -= tamano
+            except OSError:
+                pass
+
+    def obtener_tesela(self, z, x, y, offline=False):
+        """Bytes de la tesela desde disco o, si se permite, desde el servidor"""
+        ruta = self._ruta(z, x, y)
+        if os.path.exists(ruta):
+            try:
+                os.utime(ruta)
+                with open(ruta, 'rb') as f:
+                    datos = f.read()
+                self.aciertos += 1
+                return datos
+            except OSError:
+                pass
+        self.fallos += 1
+        if offline:
+            return None
+        
+        try:
+            respuesta = requests.get(self.url.format(z=z, x=x, y=y), timeout=15,
+                                     headers={'User-Agent': 'analizador-multicultivo'})
+            respuesta.raise_for_status()
+            datos = respuesta.content
+        except Exception as e:
+            self.errores += 1
+            print(f"⚠️ Error descargando tesela {z}/{x}/{y}: {str(e)}")
+            return None
+        
+        self.descargas += 1
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, 'wb') as f:
+            f.write(datos)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._bytes += len(datos)
+            if self._bytes > self.max_bytes:
+                self._desalojar()
+        return datos
+
+    @staticmethod
+    def zoom_para_extension(xmin, ymin, xmax, ymax, max_teselas=BASEMAP_MAX_TESELAS):
+        """Mayor zoom cuya cobertura de la extensión no supera max_teselas"""
+        for z in range(BASEMAP_ZOOM_MAX, -1, -1):
+            x0, y0, x1, y1 = CacheTeselasBasemap.rango_teselas(xmin, ymin, xmax, ymax, z)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_teselas:
+                return z
+        return 0
+
+    @staticmethod
+    def rango_teselas(xmin, ymin, xmax, ymax, z):
+        """Índices de tesela (x0, y0, x1, y1) que cubren una extensión en EPSG:3857"""
+        n = 2 ** z
+        lado = 2 * ORIGEN_WEB_MERCATOR / n
+        def col(x):
+            return int(min(n - 1, max(0, (x + ORIGEN_WEB_MERCATOR) // lado)))
+        def fila(y):
+            return int(min(n - 1, max(0, (ORIGEN_WEB_MERCATOR - y) // lado)))
+        return col(xmin), fila(ymax), col(xmax), fila(ymin)
+
+    def mosaico(self, xmin, ymin, xmax, ymax, offline=False):
+        """Mosaico RGBA de la extensión, su extent en EPSG:3857 y si quedó completo"""
+        z = self.zoom_para_extension(xmin, ymin, xmax, ymax)
+        x0, y0, x1, y1 = self.rango_teselas(xmin, ymin, xmax, ymax, z)
+        lado = 2 * ORIGEN_WEB_MERCATOR / 2 ** z
+        imagen = None
+        completo = True
+        for ty in range(y0, y1 + 1):
+            for tx in range(x0, x1 + 1):
+                datos = self.obtener_tesela(z, tx, ty, offline=offline)
+                if datos is None:
+                    completo = False
+                    continue
+                try:
+                    tesela = plt.imread(io.BytesIO(datos))
+                except Exception as e:
+                    completo = False
+                    print(f"⚠️ Tesela {z}/{tx}/{ty} ilegible: {str(e)}")
+                    continue
+                if tesela.dtype != np.uint8:
+                    tesela = (np.clip(tesela, 0, 1) * 255).astype(np.uint8)
+                if tesela.ndim == 2:
+                    tesela = np.stack([tesela] * 3, axis=-1)
+                if tesela.shape[2] == 3:
+                    tesela = np.dstack([tesela, np.full(tesela.shape[:2], 255, dtype=np.uint8)])
+                alto, ancho = tesela.shape[:2]
+                if imagen is None:
+                    imagen = np.zeros(((y1 - y0 + 1) * alto, (x1 - x0 + 1) * ancho, 4), dtype=np.uint8)
+                fila, columna = (ty - y0) * alto, (tx - x0) * ancho
+                imagen[fila:fila + alto, columna:columna + ancho] = tesela[:, :, :4]
+        extent = (
+            -ORIGEN_WEB_MERCATOR + x0 * lado,
+            -ORIGEN_WEB_MERCATOR + (x1 + 1) * lado,
+            ORIGEN_WEB_MERCATOR - (y1 + 1) * lado,
+            ORIGEN_WEB_MERCATOR - y0 * lado
+        )
+        return imagen, extent, completo
+
+    def estadisticas(self):
+        return {
+            'memoria_disco_mb': round(self._bytes / (1024 * 1024), 2),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'descargas': self.descargas,
+            'errores': self.errores
+        }
+
+@st.cache_resource
+def obtener_cache_basemap():
+    """Caché de teselas del mapa base compartida por el proceso"""
+    return CacheTeselasBasemap(os.path.join(DIRECTORIO_CACHE, 'teselas_basemap'))
+
+@st.cache_resource
+def obtener_mosaicos_basemap():
+    """Mosaicos ya ensamblados por extensión, reutilizados por todos los mapas de una parcela"""
+    return CacheLRU(max_entradas=16, max_bytes=256 * 1024 * 1024)
+
+def extension_basemap(gdf_3857, margen=0.05):
+    """Extensión de dibujo (con el mismo margen que matplotlib) de una capa en EPSG:3857"""
+    xmin, ymin, xmax, ymax = gdf_3857.total_bounds
+    dx, dy = (xmax - xmin) * margen, (ymax - ymin) * margen
+    return (round(xmin - dx, 1), round(ymin - dy, 1), round(xmax + dx, 1), round(ymax + dy, 1))
+
+def obtener_mosaico_basemap(extension, offline=False):
+    """Mosaico del mapa base para una extensión, ensamblado una sola vez"""
+    mosaicos = obtener_mosaicos_basemap()
+    clave = (extension, offline)
+    guardado = mosaicos.obtener(clave)
+    if guardado is not None:
+        return guardado
+    imagen, extent, completo = obtener_cache_basemap().mosaico(*extension, offline=offline)
+    if imagen is None:
+        return None
+    # Los mosaicos incompletos por fallos de red no se fijan, para reintentar en el próximo render
+    if completo or offline:
+        mosaicos.guardar(clave, (imagen, extent), tamano=imagen.nbytes)
+    return imagen, extent
+
+def precargar_basemap(gdf, offline=False):
+    """Descarga por adelantado las teselas que cubren la parcela"""
+    try:
+        return obtener_mosaico_basemap(extension_basemap(como_parcela(gdf).gdf_3857), offline=offline) is not None
+    except Exception as e:
+        print(f"⚠️ Error precargando mapa base: {str(e)}")
+        return False
+
+def agregar_basemap(ax, gdf_plot, alpha=0.7):
+    """Dibuja el mapa base compartido bajo las zonas de un mapa en EPSG:3857"""
+    extension = extension_basemap(gdf_plot)
+    ax.set_xlim(extension[0], extension[2])
+    ax.set_ylim(extension[1], extension[3])
+    try:
+        mosaico = obtener_mosaico_basemap(extension, offline=modo_offline_basemap)
+    except Exception as e:
+        print(f"⚠️ Error obteniendo mapa base: {str(e)}")
+        return
+    if mosaico is None:
+        print("⚠️ Mapa base no disponible para esta extensión")
+        return
+    imagen, extent = mosaico
+    ax.imshow(imagen, extent=extent, alpha=alpha, zorder=0, interpolation='bilinear')
+    ax.set_xlim(extension[0], extension[2])
+    ax.set_ylim(extension[1], extension[3])
+    # Atribución de las teselas de Esri World Imagery (la que dibujaba contextily)
+    ax.text(0.005, 0.005, BASEMAP_ATRIBUCION, transform=ax.transAxes, size=8, ha='left', va='bottom',
+            wrap=True, zorder=10, bbox={'facecolor': 'white', 'alpha': 0.6, 'edgecolor': 'none', 'pad': 1})
+
 # ===== FUNCIONES DE VISUALIZACIÓN CON BOTONES DESCARGA =====
-def crear_mapa_fertilidad(gdf_completo, cultivo, satelite):
+def huella_resultados(resultados):
+    """Huella estable del contenido de los resultados (zonas y DEM) para indexar renders"""
+    h = hashlib.sha256()
+    gdf_completo = resultados.get('gdf_completo')
+    if gdf_completo is not None:
+        atributos = gdf_completo.drop(columns=gdf_completo.geometry.name)
+        h.update(pd.util.hash_pandas_object(atributos, index=True).values.tobytes())
+        h.update(b''.join(shapely.to_wkb(np.asarray(gdf_completo.geometry.values))))
+    dem_data = resultados.get('dem_data') or {}
+    for clave in ('x', 'y', 'Z', 'pendientes', 'elevaciones'):
+        if dem_data.get(clave) is not None:
+            h.update(clave.encode())
+            h.update(np.ascontiguousarray(dem_data[clave], dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+def renderizar_con_cache(tipo, huella, parametros, funcion, *args):
+    """Devuelve el PNG (bytes) de un render, ejecutando matplotlib solo si no está en caché"""
+    cache = obtener_cache_renders()
+    clave = (tipo, huella, parametros)
+    if huella is not None:
+        guardado = cache.obtener(clave)
+        if guardado is not None:
+            return guardado
+    
+    salida = funcion(*args)
+    buf, extra = salida if isinstance(salida, tuple) else (salida, None)
+    if buf is None:
+        return salida
+    png = buf.getvalue()
+    resultado = (png, extra) if isinstance(salida, tuple) else png
+    if huella is not None:
+        cache.guardar(clave, resultado, tamano=len(png))
+    return resultado
+
+def crear_mapa_fertilidad(zonas, cultivo, satelite):
     """Crear mapa de fertilidad actual"""
     try:
-        gdf_plot = gdf_completo.to_crs(epsg=3857)
+        gdf_plot = como_parcela(zonas).gdf_3857
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
-        cmap = LinearSegmentedColormap.from_list('fertilidad_gee', PALETAS_GEE['FERTILIDAD'])
+        cmap = mcolors.LinearSegmentedColormap.from_list('fertilidad_gee', PALETAS_GEE['FERTILIDAD'])
         vmin, vmax = 0, 1
         
         for idx, row in gdf_plot.iterrows():
@@ -2877,10 +3320,7 @@ def crear_mapa_fertilidad(gdf_completo, cultivo, satelite):
                         fontsize=8, color='black', weight='bold',
                         bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
         
-        try:
-            ctx.add_basemap(ax, source=ctx.providers.Esri.WorldImagery, alpha=0.7)
-        except:
-            pass
+        agregar_basemap(ax, gdf_plot, alpha=0.7)
         
         info_satelite = SATELITES_DISPONIBLES.get(satelite, SATELITES_DISPONIBLES['DATOS_SIMULADOS'])
         ax.set_title(f'{ICONOS_CULTIVOS[cultivo]} FERTILIDAD ACTUAL - {cultivo}\n'
@@ -2905,25 +3345,25 @@ def crear_mapa_fertilidad(gdf_completo, cultivo, satelite):
         st.error(f"❌ Error creando mapa de fertilidad: {str(e)}")
         return None
 
-def crear_mapa_npk(gdf_completo, cultivo, nutriente='N'):
+def crear_mapa_npk(zonas, cultivo, nutriente='N'):
     """Crear mapa de recomendaciones NPK"""
     try:
-        gdf_plot = gdf_completo.to_crs(epsg=3857)
+        gdf_plot = como_parcela(zonas).gdf_3857
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
         if nutriente == 'N':
-            cmap = LinearSegmentedColormap.from_list('nitrogeno_gee', PALETAS_GEE['NITROGENO'])
+            cmap = mcolors.LinearSegmentedColormap.from_list('nitrogeno_gee', PALETAS_GEE['NITROGENO'])
             columna = 'rec_N'
             titulo_nut = 'NITRÓGENO'
             vmin = PARAMETROS_CULTIVOS[cultivo]['NITROGENO']['min'] * 0.8
             vmax = PARAMETROS_CULTIVOS[cultivo]['NITROGENO']['max'] * 1.2
         elif nutriente == 'P':
-            cmap = LinearSegmentedColormap.from_list('fosforo_gee', PALETAS_GEE['FOSFORO'])
+            cmap = mcolors.LinearSegmentedColormap.from_list('fosforo_gee', PALETAS_GEE['FOSFORO'])
             columna = 'rec_P'
             titulo_nut = 'FÓSFORO'
             vmin = PARAMETROS_CULTIVOS[cultivo]['FOSFORO']['min'] * 0.8
             vmax = PARAMETROS_CULTIVOS[cultivo]['FOSFORO']['max'] * 1.2
         else:
-            cmap = LinearSegmentedColormap.from_list('potasio_gee', PALETAS_GEE['POTASIO'])
+            cmap = mcolors.LinearSegmentedColormap.from_list('potasio_gee', PALETAS_GEE['POTASIO'])
             columna = 'rec_K'
             titulo_nut = 'POTASIO'
             vmin = PARAMETROS_CULTIVOS[cultivo]['POTASIO']['min'] * 0.8
@@ -2943,10 +3383,7 @@ def crear_mapa_npk(gdf_completo, cultivo, nutriente='N'):
                         fontsize=8, color='black', weight='bold',
                         bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
         
-        try:
-            ctx.add_basemap(ax, source=ctx.providers.Esri.WorldImagery, alpha=0.7)
-        except:
-            pass
+        agregar_basemap(ax, gdf_plot, alpha=0.7)
         
         ax.set_title(f'{ICONOS_CULTIVOS[cultivo]} RECOMENDACIONES {titulo_nut} - {cultivo}',
                      fontsize=16, fontweight='bold', pad=20)
@@ -2969,34 +3406,27 @@ def crear_mapa_npk(gdf_completo, cultivo, nutriente='N'):
         st.error(f"❌ Error creando mapa NPK: {str(e)}")
         return None
 
-def crear_mapa_texturas(gdf_completo, cultivo):
+def crear_mapa_texturas(zonas, cultivo):
     """Crear mapa de texturas"""
     try:
-        gdf_plot = gdf_completo.to_crs(epsg=3857)
+        gdf_plot = como_parcela(zonas).gdf_3857
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
-        colores_textura = {
-            'Franco': '#c7eae5',
-            'Franco arcilloso': '#5ab4ac',
-            'Franco arenoso': '#f6e8c3',
-            'NO_DETERMINADA': '#999999'
-        }
+        presentes = set(gdf_plot['textura_suelo'])
+        colores_textura = {textura: color for textura, color in COLORES_TEXTURA.items() if textura in presentes}
         
         for idx, row in gdf_plot.iterrows():
             textura = row['textura_suelo']
-            color = colores_textura.get(textura, '#999999')
+            color = COLORES_TEXTURA.get(textura, '#999999')
             
             gdf_plot.iloc[[idx]].plot(ax=ax, color=color, edgecolor='black', linewidth=1.5, alpha=0.8)
             
             centroid = row.geometry.centroid
-            ax.annotate(f"Z{row['id_zona']}\n{textura[:10]}", (centroid.x, centroid.y),
+            ax.annotate(f"Z{row['id_zona']}\n{textura}", (centroid.x, centroid.y),
                         xytext=(5, 5), textcoords="offset points",
                         fontsize=8, color='black', weight='bold',
                         bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
         
-        try:
-            ctx.add_basemap(ax, source=ctx.providers.Esri.WorldImagery, alpha=0.6)
-        except:
-            pass
+        agregar_basemap(ax, gdf_plot, alpha=0.6)
         
         ax.set_title(f'{ICONOS_CULTIVOS[cultivo]} MAPA DE TEXTURAS - {cultivo}',
                      fontsize=16, fontweight='bold', pad=20)
@@ -3058,7 +3488,7 @@ def crear_grafico_composicion_textura(arena_prom, limo_prom, arcilla_prom, textu
         ax1.set_title('Composición Promedio del Suelo')
         
         ax2.bar(textura_dist.index, textura_dist.values, 
-               color=[PALETAS_GEE['TEXTURA'][i % len(PALETAS_GEE['TEXTURA'])] for i in range(len(textura_dist))])
+               color=[COLORES_TEXTURA.get(textura, '#999999') for textura in textura_dist.index])
         ax2.set_title('Distribución de Texturas')
         ax2.set_xlabel('Textura')
         ax2.set_ylabel('Número de Zonas')
@@ -3114,6 +3544,7 @@ def crear_grafico_proyecciones_rendimiento(zonas, sin_fert, con_fert):
 def crear_mapa_pendientes(X, Y, pendientes, gdf_original):
     """Crear mapa de pendientes"""
     try:
+        X, Y = expandir_malla(X, Y)
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
         # Mapa de calor de pendientes
         scatter = ax1.scatter(X.flatten(), Y.flatten(), c=pendientes.flatten(), 
@@ -3178,6 +3609,7 @@ Estadísticas:
 def crear_mapa_curvas_nivel(X, Y, Z, curvas_nivel, elevaciones, gdf_original):
     """Crear mapa con curvas de nivel"""
     try:
+        X, Y = expandir_malla(X, Y)
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
         # Mapa de elevación
         contour = ax.contourf(X, Y, Z, levels=20, cmap='terrain', alpha=0.7)
@@ -3218,6 +3650,7 @@ def crear_mapa_curvas_nivel(X, Y, Z, curvas_nivel, elevaciones, gdf_original):
 def crear_visualizacion_3d(X, Y, Z):
     """Crear visualización 3D del terreno"""
     try:
+        X, Y = expandir_malla(X, Y)
         fig = plt.figure(figsize=(14, 10))
         ax = fig.add_subplot(111, projection='3d')
         # Plot superficie 3D
@@ -3248,13 +3681,13 @@ def crear_visualizacion_3d(X, Y, Z):
         return None
 
 # ===== FUNCIÓN PARA VISUALIZAR IMÁGENES GEE =====
-def visualizar_imagen_gee(gdf, satelite, fecha_inicio, fecha_fin):
+def visualizar_imagen_gee(parcela, satelite, fecha_inicio, fecha_fin):
     """Generar y mostrar una imagen de GEE"""
     if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
         return None
     try:
         # Obtener bounding box
-        bounds = gdf.total_bounds
+        bounds = como_parcela(parcela).bounds
         min_lon, min_lat, max_lon, max_lat = bounds
         
         # Crear geometría
@@ -3335,14 +3768,14 @@ def exportar_a_geojson(gdf, nombre_base="parcela"):
 def generar_reporte_completo(resultados, cultivo, satelite, fecha_inicio, fecha_fin):
     """Generar reporte DOCX con todos los análisis"""
     try:
-        doc = Document()
+        doc = docx.Document()
         # Título
         title = doc.add_heading(f'REPORTE COMPLETO DE ANÁLISIS - {cultivo}', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        title.alignment = docx_text.WD_ALIGN_PARAGRAPH.CENTER
         
         # Subtítulo con variedad
         subtitle = doc.add_paragraph(f'Fecha: {datetime.now().strftime("%d/%m/%Y %H:%M")}')
-        subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        subtitle.alignment = docx_text.WD_ALIGN_PARAGRAPH.CENTER
         
         doc.add_paragraph()
         
@@ -3580,14 +4013,15 @@ def crear_boton_descarga_png(buffer, nombre_archivo, texto_boton="📥 Descargar
             mime="image/png"
         )
 # ===== FUNCIÓN PARA VISUALIZACIÓN RGB NATURAL CON GEEMAP =====
-def visualizar_rgb_gee(gdf, satelite, fecha_inicio, fecha_fin):
+def visualizar_rgb_gee(zonas, satelite, fecha_inicio, fecha_fin):
     """Genera visualización RGB natural usando geemap/folium (compatible con Streamlit Cloud)"""
     if not GEE_AVAILABLE or not st.session_state.gee_authenticated:
         return None, "❌ Google Earth Engine no está autenticado"
     
     try:
         # Obtener bounding box de la parcela
-        bounds = gdf.total_bounds
+        parcela = como_parcela(zonas)
+        bounds = parcela.bounds
         min_lon, min_lat, max_lon, max_lat = bounds
         
         # Crear geometría
@@ -3649,8 +4083,7 @@ def visualizar_rgb_gee(gdf, satelite, fecha_inicio, fecha_fin):
             title += f" - {fecha_str}"
         
         # Crear mapa centrado en la parcela
-        import folium
-        centroid = gdf.geometry.unary_union.centroid
+        centroid = parcela.centroide
         m = folium.Map(
             location=[centroid.y, centroid.x],
             zoom_start=14,
@@ -3670,8 +4103,7 @@ def visualizar_rgb_gee(gdf, satelite, fecha_inicio, fecha_fin):
         # Agregar imagen RGB de GEE
         try:
             # Usar geemap para agregar la capa (más confiable que Map.addLayer)
-            import geemap.foliumap as geemap
-            Map = geemap.Map(center=[centroid.y, centroid.x], zoom=14, height=500)
+            Map = geemap_folium.Map(center=[centroid.y, centroid.x], zoom=14, height=500)
             Map.addLayer(image, vis_params, title)
             Map.addLayer(ee.FeatureCollection(geometry), {'color': 'red'}, 'Parcela')
             Map.centerObject(geometry, 14)
@@ -3694,7 +4126,7 @@ def visualizar_rgb_gee(gdf, satelite, fecha_inicio, fecha_fin):
             
             # Agregar parcela como overlay
             folium.GeoJson(
-                gdf.__geo_interface__,
+                parcela.gdf_visualizacion.__geo_interface__,
                 style_function=lambda x: {
                     'fillColor': 'transparent',
                     'color': 'red',
@@ -3717,10 +4149,11 @@ st.title("ANALIZADOR MULTI-CULTIVO SATELITAL")
 if uploaded_file:
     with st.spinner("Cargando parcela..."):
         try:
-            gdf = cargar_archivo_parcela(uploaded_file)
-            if gdf is not None:
+            parcela = cargar_archivo_parcela(uploaded_file, filtros_lectura, unir=not modo_lotes)
+            if parcela is not None:
+                gdf = parcela.gdf
                 st.success(f"✅ Parcela cargada exitosamente: {len(gdf)} polígono(s)")
-                area_total = calcular_superficie(gdf)
+                area_total = calcular_superficie(parcela)
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write("**📊 INFORMACIÓN DE LA PARCELA:**")
@@ -3728,10 +4161,17 @@ if uploaded_file:
                     st.write(f"- Área total: {area_total:.1f} ha")
                     st.write(f"- CRS: {gdf.crs}")
                     st.write(f"- Formato: {uploaded_file.name.split('.')[-1].upper()}")
+                    reporte_vertices = parcela.reporte_vertices
+                    if reporte_vertices.get('geometrias_reparadas'):
+                        st.write(f"- Geometrías reparadas: {reporte_vertices['geometrias_reparadas']}")
+                    st.write(f"- Vértices: {reporte_vertices.get('vertices_originales', reporte_vertices['vertices_limpios'])} "
+                             f"→ {reporte_vertices['vertices_limpios']} limpios "
+                             f"({reporte_vertices['vertices_consultas_remotas']} en consultas remotas, "
+                             f"{reporte_vertices['vertices_visualizacion']} en mapas)")
                     
                     # Vista previa
                     fig, ax = plt.subplots(figsize=(8, 6))
-                    gdf.plot(ax=ax, color='lightgreen', edgecolor='darkgreen', alpha=0.7)
+                    parcela.gdf_visualizacion.plot(ax=ax, color='lightgreen', edgecolor='darkgreen', alpha=0.7)
                     ax.set_title(f"Parcela: {uploaded_file.name}")
                     ax.set_xlabel("Longitud")
                     ax.set_ylabel("Latitud")
@@ -3752,7 +4192,12 @@ if uploaded_file:
                     st.write("**🎯 CONFIGURACIÓN**")
                     st.write(f"- Cultivo: {ICONOS_CULTIVOS[cultivo]} {cultivo}")
                     st.write(f"- Variedad: {variedad}")
-                    st.write(f"- Zonas: {n_divisiones}")
+                    if tamano_celda_m:
+                        st.write(f"- Zonas: celdas de {tamano_celda_m:.0f} m")
+                    elif zonificacion == 'clusteres':
+                        st.write(f"- Zonas: {n_divisiones} (clústeres de terreno)")
+                    else:
+                        st.write(f"- Zonas: {n_divisiones}")
                     st.write(f"- Satélite: {SATELITES_DISPONIBLES[satelite_seleccionado]['nombre']}")
                     st.write(f"- Período: {fecha_inicio} a {fecha_fin}")
                     st.write(f"- Intervalo curvas: {intervalo_curvas} m")
@@ -3765,16 +4210,45 @@ if uploaded_file:
                         else:
                             st.error("❌ GEE no autenticado - usando datos simulados")
                 
-                if st.button("🚀 EJECUTAR ANÁLISIS COMPLETO", type="primary", use_container_width=True):
+                if modo_lotes:
+                    st.write(f"**🧩 {len(gdf)} lote(s) a analizar:** " + ", ".join(gdf['nombre_lote'].head(20)) +
+                             (" ..." if len(gdf) > 20 else ""))
+                    if st.button("🚀 EJECUTAR ANÁLISIS POR LOTE", type="primary", use_container_width=True):
+                        barra = st.progress(0.0, text="Analizando lotes...")
+                        def progreso_lotes(hechos, total):
+                            barra.progress(hechos / total, text=f"Lotes analizados: {hechos}/{total}")
+                        parametros_lotes = {
+                            'cultivo': cultivo, 'n_divisiones': n_divisiones,
+                            'satelite': satelite_seleccionado, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin,
+                            'intervalo_curvas': intervalo_curvas, 'resolucion_dem': resolucion_dem,
+                            'tamano_celda_m': tamano_celda_m, 'zonificacion': zonificacion,
+                            'fuente_dem': fuente_dem
+                        }
+                        resultados_lotes = ejecutar_analisis_por_lotes(parcela, parametros_lotes, progreso_lotes)
+                        exitosos = [n for n, r in resultados_lotes.items() if r.get('exitoso')]
+                        if exitosos:
+                            st.session_state.resultados_lotes = resultados_lotes
+                            st.session_state.parametros_lotes = parametros_lotes
+                            # El análisis completo (DEM, curvas, clima) se calcula solo para el lote que se detalla
+                            st.session_state.resultados_todos = {}
+                            st.session_state.lote_detallado = None
+                            st.session_state.analisis_completado = True
+                            st.success(f"✅ {len(exitosos)} de {len(resultados_lotes)} lote(s) analizados")
+                            st.rerun()
+                        else:
+                            st.error("❌ No se pudo analizar ningún lote")
+                elif st.button("🚀 EJECUTAR ANÁLISIS COMPLETO", type="primary", use_container_width=True):
                     with st.spinner("Ejecutando análisis completo..."):
                         resultados = ejecutar_analisis_completo(
-                            gdf, cultivo, n_divisiones, 
+                            parcela, cultivo, n_divisiones, 
                             satelite_seleccionado, fecha_inicio, fecha_fin,
-                            intervalo_curvas, resolucion_dem
+                            intervalo_curvas, resolucion_dem, tamano_celda_m, zonificacion, fuente_dem
                         )
                         
                         if resultados['exitoso']:
                             st.session_state.resultados_todos = resultados
+                            st.session_state.resultados_lotes = {}
+                            st.session_state.lote_detallado = None
                             st.session_state.analisis_completado = True
                             st.success("✅ Análisis completado exitosamente!")
                             st.rerun()
@@ -3793,6 +4267,38 @@ if uploaded_file:
 if st.session_state.analisis_completado and 'resultados_todos' in st.session_state:
     resultados = st.session_state.resultados_todos
     
+    # Modo por lotes: tabla consolidada, descarga de artefactos y selección del lote a detallar
+    resultados_lotes = st.session_state.get('resultados_lotes') or {}
+    if resultados_lotes:
+        st.subheader("🧩 RESUMEN POR LOTE")
+        st.dataframe(tabla_consolidada_lotes(resultados_lotes), use_container_width=True)
+        if st.button("📦 Preparar ZIP con resultados por lote"):
+            with st.spinner("Generando artefactos por lote..."):
+                st.session_state.zip_lotes = generar_zip_lotes(resultados_lotes, cultivo, satelite_seleccionado)
+        if st.session_state.get('zip_lotes'):
+            st.download_button(
+                label="📥 Descargar resultados por lote (ZIP)",
+                data=st.session_state.zip_lotes,
+                file_name=f"resultados_lotes_{cultivo}_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                mime="application/zip"
+            )
+        lotes_exitosos = [n for n, r in resultados_lotes.items() if r.get('exitoso')]
+        lote_detalle = st.selectbox("Lote a detallar:", lotes_exitosos)
+        if st.session_state.get('lote_detallado') != lote_detalle:
+            # Mismas semillas y etapas que el pool: las zonas coinciden con las de la tabla consolidada
+            with st.spinner(f"Analizando en detalle el lote {lote_detalle}..."):
+                st.session_state.resultados_todos = ejecutar_analisis_completo(
+                    resultados_lotes[lote_detalle]['gdf_lote'], **st.session_state.parametros_lotes
+                )
+                st.session_state.lote_detallado = lote_detalle
+        resultados = st.session_state.resultados_todos
+        if not resultados.get('exitoso'):
+            st.error(f"❌ No se pudo detallar el lote {lote_detalle}")
+            st.stop()
+    
+    huella = resultados.get('huella')
+    zonas = resultados.get('zonas') or como_parcela(resultados['gdf_completo'])
+    
     # Mostrar resultados en pestañas
     tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
         "📊 Fertilidad Actual",
@@ -3822,7 +4328,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
         
         # Mapa de fertilidad
         st.subheader("🗺️ MAPA DE FERTILIDAD")
-        mapa_fert = crear_mapa_fertilidad(resultados['gdf_completo'], cultivo, satelite_seleccionado)
+        mapa_fert = renderizar_con_cache('fertilidad', huella, (cultivo, satelite_seleccionado, modo_offline_basemap),
+                                         crear_mapa_fertilidad, zonas, cultivo, satelite_seleccionado)
         if mapa_fert:
             st.image(mapa_fert, use_container_width=True)
             crear_boton_descarga_png(
@@ -3857,7 +4364,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
         st.subheader("🗺️ MAPAS DE RECOMENDACIONES")
         col_n, col_p, col_k = st.columns(3)
         with col_n:
-            mapa_n = crear_mapa_npk(resultados['gdf_completo'], cultivo, 'N')
+            mapa_n = renderizar_con_cache('npk', huella, (cultivo, 'N', modo_offline_basemap),
+                                          crear_mapa_npk, zonas, cultivo, 'N')
             if mapa_n:
                 st.image(mapa_n, use_container_width=True)
                 st.caption("Nitrógeno (N)")
@@ -3867,7 +4375,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                     "📥 Descargar Mapa N"
                 )
         with col_p:
-            mapa_p = crear_mapa_npk(resultados['gdf_completo'], cultivo, 'P')
+            mapa_p = renderizar_con_cache('npk', huella, (cultivo, 'P', modo_offline_basemap),
+                                          crear_mapa_npk, zonas, cultivo, 'P')
             if mapa_p:
                 st.image(mapa_p, use_container_width=True)
                 st.caption("Fósforo (P)")
@@ -3877,7 +4386,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                     "📥 Descargar Mapa P"
                 )
         with col_k:
-            mapa_k = crear_mapa_npk(resultados['gdf_completo'], cultivo, 'K')
+            mapa_k = renderizar_con_cache('npk', huella, (cultivo, 'K', modo_offline_basemap),
+                                          crear_mapa_npk, zonas, cultivo, 'K')
             if mapa_k:
                 st.image(mapa_k, use_container_width=True)
                 st.caption("Potasio (K)")
@@ -3953,7 +4463,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
         
         # Mapa de texturas
         st.subheader("🗺️ MAPA DE TEXTURAS")
-        mapa_text = crear_mapa_texturas(resultados['gdf_completo'], cultivo)
+        mapa_text = renderizar_con_cache('texturas', huella, (cultivo, modo_offline_basemap),
+                                         crear_mapa_texturas, zonas, cultivo)
         if mapa_text:
             st.image(mapa_text, use_container_width=True)
             crear_boton_descarga_png(
@@ -4021,6 +4532,7 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
         if 'dem_data' in resultados and resultados['dem_data']:
             dem_data = resultados['dem_data']
             st.subheader("🏔️ ANÁLISIS TOPOGRÁFICO")
+            st.caption(f"Fuente DEM: {dem_data.get('fuente', 'Sintético')}")
             
             col1, col2, col3, col4 = st.columns(4)
             with col1:
@@ -4036,9 +4548,17 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                 pend_prom = np.nanmean(dem_data['pendientes'])
                 st.metric("Pendiente Promedio", f"{pend_prom:.1f}%")
             
+            columnas_terreno = [c for c in resultados['gdf_completo'].columns if c.startswith('terreno_')]
+            if columnas_terreno:
+                st.subheader("📊 TERRENO POR ZONA")
+                tabla_terreno = resultados['gdf_completo'][['id_zona'] + columnas_terreno].copy()
+                tabla_terreno.columns = ['Zona'] + [c.replace('terreno_', '').replace('_', ' ') for c in columnas_terreno]
+                st.dataframe(tabla_terreno.round(2), use_container_width=True)
+            
             # Mapa de pendientes
             st.subheader("📉 MAPA DE PENDIENTES")
-            mapa_pend, stats_pend = crear_mapa_pendientes(dem_data['X'], dem_data['Y'], dem_data['pendientes'], resultados['gdf_completo'])
+            mapa_pend, stats_pend = renderizar_con_cache('pendientes', huella, (),
+                crear_mapa_pendientes, dem_data['x'], dem_data['y'], dem_data['pendientes'], resultados['gdf_completo'])
             if mapa_pend:
                 st.image(mapa_pend, use_container_width=True)
                 crear_boton_descarga_png(
@@ -4049,8 +4569,9 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
             
             # Mapa de curvas de nivel
             st.subheader("⛰️ MAPA DE CURVAS DE NIVEL")
-            mapa_curvas = crear_mapa_curvas_nivel(
-                dem_data['X'], dem_data['Y'], dem_data['Z'],
+            mapa_curvas = renderizar_con_cache(
+                'curvas_nivel', huella, (), crear_mapa_curvas_nivel,
+                dem_data['x'], dem_data['y'], dem_data['Z'],
                 dem_data.get('curvas_nivel', []), dem_data.get('elevaciones', []),
                 resultados['gdf_completo']
             )
@@ -4064,7 +4585,8 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
             
             # Visualización 3D
             st.subheader("🎨 VISUALIZACIÓN 3D DEL TERRENO")
-            visualizacion_3d = crear_visualizacion_3d(dem_data['X'], dem_data['Y'], dem_data['Z'])
+            visualizacion_3d = renderizar_con_cache('3d', huella, (), crear_visualizacion_3d,
+                                                    dem_data['x'], dem_data['y'], dem_data['Z'])
             if visualizacion_3d:
                 st.image(visualizacion_3d, use_container_width=True)
                 crear_boton_descarga_png(
@@ -4095,7 +4617,7 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                 # Generar visualización RGB
                 with st.spinner("Generando mapa interactivo..."):
                     mapa_rgb, mensaje = visualizar_rgb_gee(
-                        resultados['gdf_dividido'],
+                        zonas,
                         satelite_seleccionado,
                         fecha_inicio,
                         fecha_fin
@@ -4253,6 +4775,54 @@ if st.session_state.analisis_completado and 'resultados_todos' in st.session_sta
                     if key not in ['gee_authenticated', 'gee_project']:
                         del st.session_state[key]
                 st.rerun()
+# ===== ESTADO DE CACHÉS =====
+def estadisticas_caches():
+    """Resumen de uso (aciertos/fallos) de las cachés compartidas del proceso"""
+    return {
+        'Parcelas': obtener_cache_parcelas().estadisticas(),
+        'NASA POWER': obtener_almacen_nasa_power().estadisticas(),
+        'Teselas SRTM': obtener_almacen_srtm().estadisticas(),
+        'Estadísticas GEE': obtener_cache_gee().estadisticas(),
+        'Mapas renderizados': obtener_cache_renders().estadisticas(),
+        'Teselas mapa base': obtener_cache_basemap().estadisticas(),
+        'Cliente GEE': obtener_cliente_gee().estadisticas()
+    }
+
+with st.sidebar:
+    with st.expander("🗄️ Estado de cachés"):
+        st.json(estadisticas_caches())
+
+# ===== MEMORIA DE LA SESIÓN =====
+def reporte_memoria_sesion():
+    """Memoria aproximada (MB) retenida por cada clave de st.session_state de esta sesión"""
+    reporte = {}
+    for clave in list(st.session_state.keys()):
+        try:
+            reporte[str(clave)] = round(estimar_tamano_bytes(st.session_state[clave]) / (1024 * 1024), 3)
+        except Exception:
+            continue
+    reporte = dict(sorted(reporte.items(), key=lambda item: item[1], reverse=True))
+    return {'total_mb': round(sum(reporte.values()), 3), 'por_clave_mb': reporte}
+
+with st.sidebar:
+    with st.expander("🧠 Memoria de la sesión"):
+        st.json(reporte_memoria_sesion())
+
+# ===== TIEMPOS DE ARRANQUE =====
+registro = registro_arranque()
+duracion_script_ms = round((time.perf_counter() - _INICIO_SCRIPT) * 1000, 1)
+if registro['primera_ejecucion_ms'] is None:
+    registro['primera_ejecucion_ms'] = duracion_script_ms
+
+with st.sidebar:
+    with st.expander("⏱️ Arranque e importaciones"):
+        st.json({
+            'Imports iniciales (ms)': registro['imports_iniciales_ms'],
+            'Primera ejecución del script (ms)': registro['primera_ejecucion_ms'],
+            'Ejecución actual del script (ms)': duracion_script_ms,
+            'Módulos cargados bajo demanda (ms)': dict(registro['modulos_ms'])
+        })
+
 # ===== PIE DE PÁGINA =====
 st.markdown("---")
 col_footer1, col_footer2, col_footer3 = st.columns(3)
@@ -0,0 +1,145 @@
+"""Compara calcular_prescripcion (columnar) con los bucles por zona que reemplazó.
+
+Uso:
+    python benchmarks/benchmark_prescripcion.py [--zonas 1000 100000] [--cultivos TRIGO MAIZ | todos]
+
+El kernel y los parámetros de cultivo se importan de nucleo_analisis, que no
+depende de Streamlit. Verifica que dosis, costos y proyecciones coincidan
+exactamente y muestra los tiempos de ambas versiones.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nucleo_analisis  # noqa: E402
+
+def cargar_kernel():
+    """Espacio de nombres con el kernel de prescripción y los parámetros de cultivo"""
+    return {
+        'PARAMETROS_CULTIVOS': nucleo_analisis.PARAMETROS_CULTIVOS,
+        'PRECIOS_FERTILIZANTES': nucleo_analisis.PRECIOS_FERTILIZANTES,
+        'calcular_prescripcion': nucleo_analisis.calcular_prescripcion
+    }
+
+# ===== VERSIÓN ANTERIOR (UN DICT POR ZONA) =====
+def recomendaciones_por_zona(indices, params):
+    recomendaciones_n, recomendaciones_p, recomendaciones_k = [], [], []
+    for idx in indices:
+        ndre = idx['ndre']
+        materia_organica = idx['materia_organica']
+        humedad_suelo = idx['humedad_suelo']
+        ndvi = idx['ndvi']
+        
+        factor_n = ((1 - ndre) * 0.6 + (1 - ndvi) * 0.4)
+        n_recomendado = (factor_n * (params['NITROGENO']['max'] - params['NITROGENO']['min']) + params['NITROGENO']['min'])
+        n_recomendado = max(params['NITROGENO']['min'] * 0.8, min(params['NITROGENO']['max'] * 1.2, n_recomendado))
+        recomendaciones_n.append(round(n_recomendado, 1))
+        
+        factor_p = ((1 - (materia_organica / 8)) * 0.7 + (1 - humedad_suelo) * 0.3)
+        p_recomendado = (factor_p * (params['FOSFORO']['max'] - params['FOSFORO']['min']) + params['FOSFORO']['min'])
+        p_recomendado = max(params['FOSFORO']['min'] * 0.8, min(params['FOSFORO']['max'] * 1.2, p_recomendado))
+        recomendaciones_p.append(round(p_recomendado, 1))
+        
+        factor_k = ((1 - ndre) * 0.4 + (1 - humedad_suelo) * 0.4 + (1 - (materia_organica / 8)) * 0.2)
+        k_recomendado = (factor_k * (params['POTASIO']['max'] - params['POTASIO']['min']) + params['POTASIO']['min'])
+        k_recomendado = max(params['POTASIO']['min'] * 0.8, min(params['POTASIO']['max'] * 1.2, k_recomendado))
+        recomendaciones_k.append(round(k_recomendado, 1))
+    return recomendaciones_n, recomendaciones_p, recomendaciones_k
+
+def costos_por_zona(params, recomendaciones_n, recomendaciones_p, recomendaciones_k):
+    costos = []
+    precio_n, precio_p, precio_k = 1.2, 2.5, 1.8
+    for i in range(len(recomendaciones_n)):
+        costo_n = recomendaciones_n[i] * precio_n
+        costo_p = recomendaciones_p[i] * precio_p
+        costo_k = recomendaciones_k[i] * precio_k
+        costo_total = costo_n + costo_p + costo_k + params['COSTO_FERTILIZACION']
+        costos.append({
+            'costo_nitrogeno': round(costo_n, 2),
+            'costo_fosforo': round(costo_p, 2),
+            'costo_potasio': round(costo_k, 2),
+            'costo_total': round(costo_total, 2)
+        })
+    return costos
+
+def proyecciones_por_zona(indices, params):
+    proyecciones = []
+    for idx in indices:
+        npk_actual = idx['npk_actual']
+        ndvi = idx['ndvi']
+        rendimiento_base = params['RENDIMIENTO_OPTIMO'] * npk_actual * 0.7
+        incremento = (1 - npk_actual) * 0.4 + (1 - ndvi) * 0.2
+        rendimiento_con_fert = rendimiento_base * (1 + incremento)
+        proyecciones.append({
+            'rendimiento_sin_fert': round(rendimiento_base, 0),
+            'rendimiento_con_fert': round(rendimiento_con_fert, 0),
+            'incremento_esperado': round(incremento * 100, 1)
+        })
+    return proyecciones
+
+def prescripcion_por_zona(indices, params):
+    """Resultado de la versión anterior con las mismas claves que calcular_prescripcion"""
+    rec_n, rec_p, rec_k = recomendaciones_por_zona(indices, params)
+    costos = costos_por_zona(params, rec_n, rec_p, rec_k)
+    proyecciones = proyecciones_por_zona(indices, params)
+    salida = {'rec_N': rec_n, 'rec_P': rec_p, 'rec_K': rec_k}
+    for filas in (costos, proyecciones):
+        for clave in filas[0]:
+            salida[clave] = [fila[clave] for fila in filas]
+    return {clave: np.asarray(valores, dtype=float) for clave, valores in salida.items()}
+
+# ===== DATOS Y COMPARACIÓN =====
+def indices_aleatorios(n_zonas, semilla=0):
+    """Índices con la misma precisión que los de analizar_fertilidad_actual"""
+    rng = np.random.default_rng(semilla)
+    return {
+        'ndvi': np.round(rng.uniform(0.1, 0.9, n_zonas), 3),
+        'ndre': np.round(rng.uniform(0.05, 0.7, n_zonas), 3),
+        'humedad_suelo': np.round(rng.uniform(0.1, 0.8, n_zonas), 3),
+        'materia_organica': np.round(rng.uniform(0.5, 8.0, n_zonas), 2),
+        'npk_actual': np.round(rng.uniform(0.0, 1.0, n_zonas), 3)
+    }
+
+def comparar(n_zonas, cultivo, ns):
+    params = ns['PARAMETROS_CULTIVOS'][cultivo]
+    indices = indices_aleatorios(n_zonas)
+    
+    inicio = time.perf_counter()
+    nuevo = ns['calcular_prescripcion'](indices, params)
+    t_nuevo = time.perf_counter() - inicio
+    
+    por_zona = [{clave: valores[i] for clave, valores in indices.items()} for i in range(n_zonas)]
+    inicio = time.perf_counter()
+    anterior = prescripcion_por_zona(por_zona, params)
+    t_anterior = time.perf_counter() - inicio
+    
+    diferencias = {clave: float(np.abs(nuevo[clave] - anterior[clave]).max()) for clave in anterior}
+    iguales = all(np.array_equal(nuevo[clave], anterior[clave]) for clave in anterior)
+    return t_nuevo, t_anterior, diferencias, iguales
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--zonas', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--cultivos', nargs='+', default=['TRIGO'], help="Claves de PARAMETROS_CULTIVOS o 'todos'")
+    args = parser.parse_args()
+    
+    ns = cargar_kernel()
+    cultivos = list(ns['PARAMETROS_CULTIVOS']) if args.cultivos == ['todos'] else args.cultivos
+    todo_igual = True
+    for n_zonas in args.zonas:
+        for cultivo in cultivos:
+            t_nuevo, t_anterior, diferencias, iguales = comparar(n_zonas, cultivo, ns)
+            todo_igual &= iguales
+            peor = max(diferencias, key=diferencias.get)
+            print(f"{n_zonas:>8} zonas  {cultivo:<14}  columnar {t_nuevo:8.4f} s  por zona {t_anterior:8.3f} s  "
+                  f"x{t_anterior / max(t_nuevo, 1e-9):6.0f}  máx. dif. {diferencias[peor]:.3g} ({peor})  "
+                  f"{'OK' if iguales else 'DIFERENTE'}")
+    raise SystemExit(0 if todo_igual else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1273 @@
+"""Etapas de cálculo del análisis de fertilidad, sin Streamlit ni acceso a red.
+
+Zonificación, DEM sintético, fertilidad, prescripción NPK, textura y
+estadísticas de terreno por zona. app.py las usa en el hilo de la sesión y el
+modo por lotes las ejecuta en procesos 'spawn', que importan solo este módulo
+(importar app.py volvería a ejecutar la interfaz de Streamlit).
+"""
+import hashlib
+import importlib
+import importlib.util
+import math
+import sys
+import time
+from functools import cached_property, lru_cache
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# ===== IMPORTACIÓN PEREZOSA DE DEPENDENCIAS PESADAS =====
+# Milisegundos de la primera importación de cada módulo en este proceso
+TIEMPOS_IMPORTACION_MS = {}
+
+class ModuloPerezoso:
+    """Importa el módulo real en el primer acceso a un atributo y registra cuánto tardó"""
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def _cargar(self):
+        if self._modulo is None:
+            ya_importado = self._nombre in sys.modules
+            inicio = time.perf_counter()
+            self._modulo = importlib.import_module(self._nombre)
+            if not ya_importado:
+                TIEMPOS_IMPORTACION_MS[self._nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        return getattr(self._cargar(), atributo)
+
+gpd = ModuloPerezoso('geopandas')
+rasterio = ModuloPerezoso('rasterio')
+rasterio_features = ModuloPerezoso('rasterio.features')
+scipy_ndimage = ModuloPerezoso('scipy.ndimage')
+
+# ===== SEMILLAS Y GEOMETRÍA DE LA PARCELA =====
+def huella_geometria(geometria):
+    """Hash estable de una geometría shapely (WKB normalizado)"""
+    return hashlib.sha256(shapely.to_wkb(shapely.normalize(geometria))).hexdigest()[:16]
+
+def derivar_semilla(*partes):
+    """Semilla entera de 64 bits derivada de las partes (estable entre procesos, a diferencia de hash())"""
+    digest = hashlib.sha256('|'.join(str(parte) for parte in partes).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+def a_epsg4326(gdf):
+    """Lleva la capa a EPSG:4326 (asignándolo si no tiene CRS), sin avisos de interfaz"""
+    if gdf is None or len(gdf) == 0:
+        return gdf
+    if gdf.crs is None:
+        return gdf.set_crs('EPSG:4326', inplace=False)
+    if str(gdf.crs).upper() != 'EPSG:4326':
+        return gdf.to_crs('EPSG:4326')
+    return gdf
+
+PARCELA_TOLERANCIA_SIMPLIFICACION_M = 5.0
+PARCELA_TOLERANCIA_VISUALIZACION_M = 1.0
+METROS_POR_GRADO = 111320.0
+
+def contar_vertices(geometrias):
+    return int(shapely.get_num_coordinates(np.asarray(geometrias)).sum())
+
+def preprocesar_geometria(gdf):
+    """Repara geometrías inválidas, conserva solo las partes poligonales y elimina vértices repetidos"""
+    geometrias = np.asarray(gdf.geometry.values)
+    vertices_originales = contar_vertices(geometrias)
+    invalidas = ~shapely.is_valid(geometrias)
+    if invalidas.any():
+        geometrias = geometrias.copy()
+        geometrias[invalidas] = shapely.make_valid(geometrias[invalidas])
+        # make_valid puede devolver colecciones con líneas o puntos sueltos: se conservan los polígonos
+        for i in np.flatnonzero(shapely.get_type_id(geometrias) == 7):
+            partes = shapely.get_parts(geometrias[i])
+            partes = partes[np.isin(shapely.get_type_id(partes), (3, 6))]
+            geometrias[i] = shapely.union_all(partes) if len(partes) else shapely.Polygon()
+    geometrias = shapely.remove_repeated_points(geometrias, tolerance=0.0)
+    gdf = gdf.set_geometry(gpd.GeoSeries(geometrias, index=gdf.index, crs=gdf.crs))
+    gdf.attrs['preprocesamiento'] = {
+        'geometrias_reparadas': int(invalidas.sum()),
+        'vertices_originales': vertices_originales
+    }
+    return gdf
+
+class Parcela:
+    """Capa de polígonos en EPSG:4326 con sus geometrías derivadas calculadas una sola vez"""
+
+    def __init__(self, gdf):
+        self.gdf = a_epsg4326(gdf)
+        self._simplificadas = {}
+
+    def __len__(self):
+        return len(self.gdf)
+
+    @cached_property
+    def union(self):
+        return self.gdf.geometry.union_all()
+
+    @cached_property
+    def preparada(self):
+        """Unión preparada para consultas punto-en-polígono repetidas"""
+        geometria = self.union
+        shapely.prepare(geometria)
+        return geometria
+
+    @cached_property
+    def centroide(self):
+        return self.union.centroid
+
+    @cached_property
+    def huella(self):
+        """Hash estable de la geometría (base de las semillas del análisis)"""
+        return huella_geometria(self.union)
+
+    @cached_property
+    def bounds(self):
+        return self.gdf.total_bounds
+
+    @cached_property
+    def crs_utm(self):
+        return self.gdf.estimate_utm_crs()
+
+    @cached_property
+    def gdf_utm(self):
+        return self.gdf.to_crs(self.crs_utm)
+
+    @cached_property
+    def areas_ha(self):
+        """Área de cada polígono en UTM (sin la distorsión de Web Mercator)"""
+        return self.gdf_utm.geometry.area.to_numpy() / 10000
+
+    @cached_property
+    def area_ha(self):
+        return float(self.areas_ha.sum())
+
+    @cached_property
+    def gdf_3857(self):
+        return self.gdf.to_crs(epsg=3857)
+
+    def simplificada(self, tolerancia_m):
+        """Unión simplificada con tolerancia en metros (el área se sigue midiendo sobre la geometría exacta)"""
+        if tolerancia_m not in self._simplificadas:
+            self._simplificadas[tolerancia_m] = shapely.simplify(
+                self.union, tolerancia_m / METROS_POR_GRADO, preserve_topology=True
+            )
+        return self._simplificadas[tolerancia_m]
+
+    @cached_property
+    def geometria_simplificada(self):
+        """Unión simplificada (~5 m) para consultas a servicios remotos"""
+        return self.simplificada(PARCELA_TOLERANCIA_SIMPLIFICACION_M)
+
+    @cached_property
+    def gdf_visualizacion(self):
+        """Copia con geometrías simplificadas a una tolerancia imperceptible a escala de pantalla"""
+        minx, miny, maxx, maxy = self.bounds
+        diagonal_m = math.hypot(maxx - minx, maxy - miny) * METROS_POR_GRADO
+        tolerancia = max(PARCELA_TOLERANCIA_VISUALIZACION_M, diagonal_m / 2000) / METROS_POR_GRADO
+        geometrias = shapely.simplify(np.asarray(self.gdf.geometry.values), tolerancia, preserve_topology=True)
+        return self.gdf.set_geometry(gpd.GeoSeries(geometrias, index=self.gdf.index, crs=self.gdf.crs))
+
+    @cached_property
+    def reporte_vertices(self):
+        reporte = dict(self.gdf.attrs.get('preprocesamiento', {}))
+        # Conteos sobre la geometría guardada (ya unida), no sobre los polígonos de entrada
+        reporte['vertices_limpios'] = contar_vertices(self.gdf.geometry.values)
+        reporte['vertices_consultas_remotas'] = contar_vertices([self.geometria_simplificada])
+        reporte['vertices_visualizacion'] = contar_vertices(self.gdf_visualizacion.geometry.values)
+        return reporte
+
+    def precalcular(self):
+        """Calcula todas las geometrías derivadas (p. ej. antes de medir la parcela para una caché)"""
+        for propiedad in ('huella', 'bounds', 'area_ha', 'gdf_3857', 'reporte_vertices'):
+            getattr(self, propiedad)
+        return self
+
+def como_parcela(obj):
+    """Devuelve obj si ya es una Parcela; si es un GeoDataFrame lo envuelve"""
+    if obj is None or isinstance(obj, Parcela):
+        return obj
+    return Parcela(obj)
+
+def areas_ha(gdf, crs_metrico=None):
+    """Área (ha) de cada geometría en un CRS métrico local (UTM), en una sola pasada vectorizada"""
+    if crs_metrico is None:
+        crs_metrico = gdf.estimate_utm_crs()
+    return gdf.geometry.to_crs(crs_metrico).area.to_numpy() / 10000
+
+def grilla_celdas(minx, miny, maxx, maxy, ancho, alto):
+    """Todas las celdas rectangulares que cubren la extensión, en orden fila a fila, como array de Shapely"""
+    n_cols = max(1, int(math.ceil((maxx - minx) / ancho - 1e-9)))
+    n_rows = max(1, int(math.ceil((maxy - miny) / alto - 1e-9)))
+    filas, columnas = np.divmod(np.arange(n_rows * n_cols), n_cols)
+    return shapely.box(minx + columnas * ancho, miny + filas * alto,
+                       minx + (columnas + 1) * ancho, miny + (filas + 1) * alto)
+
+def recortar_celdas(celdas, geometria):
+    """Intersección en bloque de las celdas con la geometría usando un STRtree.
+    Las celdas totalmente interiores se conservan tal cual; solo las del borde se intersectan."""
+    shapely.prepare(geometria)
+    arbol = shapely.STRtree(celdas)
+    candidatas = np.sort(arbol.query(geometria, predicate='intersects'))
+    interiores = np.isin(candidatas, arbol.query(geometria, predicate='contains'))
+    recortes = celdas[candidatas].copy()
+    recortes[~interiores] = shapely.intersection(recortes[~interiores], geometria)
+    validas = ~shapely.is_empty(recortes) & (shapely.area(recortes) > 0)
+    return recortes[validas]
+
+def dividir_parcela_en_zonas(gdf, n_zonas, tamano_celda_m=None):
+    """Divide la parcela en una grilla de zonas: n_zonas celdas, o celdas de tamano_celda_m metros de lado"""
+    if len(gdf) == 0:
+        return como_parcela(gdf).gdf.copy()
+    parcela = como_parcela(gdf)
+    if tamano_celda_m:
+        # Grilla métrica en UTM (p. ej. múltiplos del ancho de labor del implemento)
+        geometria = shapely.union_all(np.asarray(parcela.gdf_utm.geometry.values))
+        minx, miny, maxx, maxy = geometria.bounds
+        celdas = grilla_celdas(minx, miny, maxx, maxy, tamano_celda_m, tamano_celda_m)
+        sub_poligonos = recortar_celdas(celdas, geometria)
+        crs_zonas = parcela.crs_utm
+    else:
+        geometria = parcela.union
+        minx, miny, maxx, maxy = geometria.bounds
+        n_cols = math.ceil(math.sqrt(n_zonas))
+        n_rows = math.ceil(n_zonas / n_cols)
+        celdas = grilla_celdas(minx, miny, maxx, maxy, (maxx - minx) / n_cols, (maxy - miny) / n_rows)
+        sub_poligonos = recortar_celdas(celdas, geometria)[:n_zonas]
+        crs_zonas = 'EPSG:4326'
+    if len(sub_poligonos) > 0:
+        nuevo_gdf = gpd.GeoDataFrame({'id_zona': np.arange(1, len(sub_poligonos) + 1), 'geometry': sub_poligonos}, crs=crs_zonas)
+        if tamano_celda_m:
+            nuevo_gdf = nuevo_gdf.to_crs('EPSG:4326')
+        return nuevo_gdf
+    else:
+        # Copia: la parcela puede estar en la caché compartida y las etapas siguientes agregan columnas
+        return parcela.gdf.copy()
+
+# ===== ZONIFICACIÓN POR CLÚSTERES (K-MEANS POR MINI-LOTES) =====
+CLUSTER_TAMANO_LOTE = 4096
+CLUSTER_MAX_ITERACIONES = 200
+CLUSTER_TOLERANCIA = 1e-4
+CLUSTER_MUESTRA_INICIAL = 20000
+CLUSTER_BLOQUE_PIXELES = 1 << 18
+CLUSTER_FRACCION_AREA_MINIMA = 0.02
+
+class PilaCaracteristicas:
+    """Capas ráster alineadas vistas como matriz (píxeles válidos × capas) estandarizada, sin materializarla"""
+
+    def __init__(self, capas, mascara):
+        self.capas = [np.asarray(capa, dtype=np.float32).ravel() for capa in capas]
+        self.validos = np.asarray(mascara).ravel().copy()
+        for capa in self.capas:
+            self.validos &= np.isfinite(capa)
+        self.n_validos = int(self.validos.sum())
+        self.media = np.array([capa[self.validos].mean() for capa in self.capas], dtype=np.float32)
+        desviacion = np.array([capa[self.validos].std() for capa in self.capas], dtype=np.float32)
+        self.desviacion = np.where(desviacion > 0, desviacion, 1.0).astype(np.float32)
+
+    def extraer(self, posiciones):
+        """Filas estandarizadas de los píxeles en las posiciones planas dadas"""
+        return (np.stack([capa[posiciones] for capa in self.capas], axis=1) - self.media) / self.desviacion
+
+    def muestrear(self, n, rng):
+        """n píxeles válidos al azar (por rechazo, sin índice de todos los válidos)"""
+        elegidos = []
+        faltan = n
+        while faltan > 0:
+            candidatos = rng.integers(0, len(self.validos), size=max(2 * faltan, 1024))
+            candidatos = candidatos[self.validos[candidatos]][:faltan]
+            elegidos.append(candidatos)
+            faltan -= len(candidatos)
+        return np.concatenate(elegidos)
+
+    def bloques(self, tamano=CLUSTER_BLOQUE_PIXELES):
+        """Recorre el ráster en bloques de posiciones planas: (posiciones válidas, filas estandarizadas)"""
+        for inicio in range(0, len(self.validos), tamano):
+            posiciones = inicio + np.flatnonzero(self.validos[inicio:inicio + tamano])
+            if len(posiciones) > 0:
+                yield posiciones, self.extraer(posiciones)
+
+def asignar_centros(filas, centros):
+    """Índice del centro más cercano (distancia euclídea) para cada fila"""
+    distancias = (filas * filas).sum(axis=1)[:, None] - 2 * filas @ centros.T + (centros * centros).sum(axis=1)[None, :]
+    return distancias.argmin(axis=1)
+
+def kmeans_minibatch(pila, n_clusters, rng):
+    """K-means por mini-lotes (Sculley, 2010): centros iniciales k-means++ sobre una muestra y
+    actualizaciones con tasa de aprendizaje 1/conteo por centro; memoria acotada por el tamaño del lote"""
+    muestra = pila.extraer(pila.muestrear(min(CLUSTER_MUESTRA_INICIAL, pila.n_validos * 4), rng))
+    centros = [muestra[rng.integers(len(muestra))]]
+    distancia_minima = ((muestra - centros[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        probabilidades = distancia_minima / distancia_minima.sum() if distancia_minima.sum() > 0 else None
+        centros.append(muestra[rng.choice(len(muestra), p=probabilidades)])
+        distancia_minima = np.minimum(distancia_minima, ((muestra - centros[-1]) ** 2).sum(axis=1))
+    centros = np.array(centros, dtype=np.float32)
+    
+    conteos = np.zeros(n_clusters)
+    for _ in range(CLUSTER_MAX_ITERACIONES):
+        lote = pila.extraer(pila.muestrear(CLUSTER_TAMANO_LOTE, rng))
+        asignacion = asignar_centros(lote, centros)
+        conteo_lote = np.bincount(asignacion, minlength=n_clusters)
+        activos = conteo_lote > 0
+        sumas = np.stack([np.bincount(asignacion, weights=lote[:, j], minlength=n_clusters)
+                          for j in range(lote.shape[1])], axis=1)
+        conteos += conteo_lote
+        tasa = np.where(activos, conteo_lote / np.maximum(conteos, 1), 0.0)[:, None]
+        medias_lote = sumas / np.maximum(conteo_lote, 1)[:, None]
+        nuevos = centros + (tasa * (medias_lote - centros)).astype(np.float32)
+        desplazamiento = float(((nuevos - centros) ** 2).sum())
+        centros = nuevos
+        if desplazamiento < CLUSTER_TOLERANCIA:
+            break
+    return centros
+
+def zonificar_por_clusteres(parcela, x, y, capas, n_zonas, semilla=0):
+    """Zonas de manejo a partir de capas ráster alineadas (ejes x, y en EPSG:4326).
+
+    Agrupa los píxeles de la parcela con k-means por mini-lotes, limpia las
+    manchas chicas (sieve), extiende las etiquetas a toda la grilla por vecino
+    más cercano y poligoniza recortando a la parcela. Devuelve un GeoDataFrame
+    con una zona (posiblemente multiparte) por clúster, o None si no es posible.
+    """
+    if not RASTERIZACION_RASTERIO:
+        return None
+    parcela = como_parcela(parcela)
+    x, y = ejes_grilla(x, y)
+    forma = (len(y), len(x))
+    dentro = mascara_geometria(parcela.union, x, y)
+    pila = PilaCaracteristicas(list(capas.values()), dentro)
+    if pila.n_validos < n_zonas * 4:
+        return None
+    rng = np.random.default_rng(semilla)
+    centros = kmeans_minibatch(pila, n_zonas, rng)
+    
+    # Etiquetas 1..k ordenadas por el valor medio de la primera capa (p. ej. elevación)
+    orden = np.empty(n_zonas, dtype=np.int16)
+    orden[np.argsort(centros[:, 0])] = np.arange(1, n_zonas + 1)
+    etiquetas = np.zeros(forma[0] * forma[1], dtype=np.int16)
+    for posiciones, filas in pila.bloques():
+        etiquetas[posiciones] = orden[asignar_centros(filas, centros)]
+    etiquetas = etiquetas.reshape(forma)
+    
+    # Limpieza: las manchas menores al área mínima se funden con su vecina más grande
+    area_minima = max(4, int(pila.n_validos * CLUSTER_FRACCION_AREA_MINIMA / n_zonas))
+    etiquetas = rasterio_features.sieve(etiquetas, size=area_minima, mask=dentro, connectivity=8)
+    etiquetas = np.where(dentro, etiquetas, 0).astype(np.int16)
+    
+    # Los píxeles sin etiqueta toman la del píxel etiquetado más cercano, para cubrir toda la parcela al recortar
+    _, (filas_cercanas, columnas_cercanas) = scipy_ndimage.distance_transform_edt(etiquetas == 0, return_indices=True)
+    etiquetas = etiquetas[filas_cercanas, columnas_cercanas]
+    
+    partes = {}
+    for forma_geojson, valor in rasterio_features.shapes(etiquetas, transform=transformada_grilla(x, y)):
+        partes.setdefault(int(valor), []).append(shapely.geometry.shape(forma_geojson))
+    ids = sorted(partes)
+    zonas = shapely.intersection(
+        np.array([shapely.union_all(partes[i]) for i in ids], dtype=object), parcela.union
+    )
+    zonas = shapely.make_valid(zonas)
+    no_vacias = ~shapely.is_empty(zonas)
+    if not no_vacias.any():
+        return None
+    return gpd.GeoDataFrame(
+        {'id_zona': np.arange(1, no_vacias.sum() + 1), 'geometry': zonas[no_vacias]}, crs='EPSG:4326'
+    )
+
+def capas_zonificacion(X, Y, Z, pendientes):
+    """Capas de la zonificación por clústeres: elevación y pendiente del DEM.
+
+    Los índices satelitales llegan como estadísticas de la parcela, no como
+    ráster por píxel, así que no entran en el agrupamiento.
+    """
+    def suavizar(capa):
+        validos = np.isfinite(capa)
+        suavizada = scipy_ndimage.gaussian_filter(np.where(validos, capa, np.nanmean(capa)), sigma=1)
+        return np.where(validos, suavizada, np.nan)
+    
+    return {
+        'elevacion': suavizar(Z),
+        'pendiente': suavizar(pendientes)
+    }
+
+# ===== DEM SINTÉTICO Y PENDIENTE =====
+def generar_dem_sintetico(gdf, resolucion=10.0, semilla=None):
+    """Genera un DEM sintético para análisis de terreno (determinista para la misma semilla)"""
+    parcela = como_parcela(gdf)
+    bounds = parcela.bounds
+    minx, miny, maxx, maxy = bounds
+    
+    # Crear grid
+    num_cells_x = int((maxx - minx) * 111000 / resolucion)  # 1 grado ≈ 111km
+    num_cells_y = int((maxy - miny) * 111000 / resolucion)
+    num_cells_x = max(50, min(num_cells_x, 200))
+    num_cells_y = max(50, min(num_cells_y, 200))
+
+    x = np.linspace(minx, maxx, num_cells_x)
+    y = np.linspace(miny, maxy, num_cells_y)
+    X, Y = np.meshgrid(x, y)
+
+    # Generar terreno sintético
+    if semilla is None:
+        semilla = derivar_semilla(parcela.huella, 'dem')
+    rng = np.random.default_rng(semilla)
+
+    # Elevación base
+    elevacion_base = rng.uniform(100, 300)
+
+    # Pendiente general
+    slope_x = rng.uniform(-0.001, 0.001)
+    slope_y = rng.uniform(-0.001, 0.001)
+
+    # Relieve
+    relief = np.zeros_like(X)
+    n_hills = rng.integers(3, 7)
+    for _ in range(n_hills):
+        hill_center_x = rng.uniform(minx, maxx)
+        hill_center_y = rng.uniform(miny, maxy)
+        hill_radius = rng.uniform(0.001, 0.005)
+        hill_height = rng.uniform(20, 80)
+        dist = np.sqrt((X - hill_center_x)**2 + (Y - hill_center_y)**2)
+        relief += hill_height * np.exp(-(dist**2) / (2 * hill_radius**2))
+
+    # Valles
+    n_valleys = rng.integers(2, 5)
+    for _ in range(n_valleys):
+        valley_center_x = rng.uniform(minx, maxx)
+        valley_center_y = rng.uniform(miny, maxy)
+        valley_radius = rng.uniform(0.002, 0.006)
+        valley_depth = rng.uniform(10, 40)
+        dist = np.sqrt((X - valley_center_x)**2 + (Y - valley_center_y)**2)
+        relief -= valley_depth * np.exp(-(dist**2) / (2 * valley_radius**2))
+
+    # Ruido
+    noise = rng.standard_normal(X.shape) * 5
+
+    Z = elevacion_base + slope_x * (X - minx) + slope_y * (Y - miny) + relief + noise
+    Z = np.maximum(Z, 50)  # Evitar valores negativos
+
+    # Aplicar máscara de la parcela
+    parcel_mask = mascara_geometria(parcela.union, x, y)
+
+    Z[~parcel_mask] = np.nan
+
+    return X, Y, Z, bounds
+
+# ===== RASTERIZACIÓN DE GEOMETRÍAS SOBRE GRILLAS REGULARES =====
+RASTERIZACION_RASTERIO = importlib.util.find_spec('rasterio') is not None
+
+def ejes_grilla(x, y):
+    """Ejes 1-D de centros de píxel a partir de ejes o mallas 2-D"""
+    if np.ndim(x) == 2:
+        x = x[0, :]
+    if np.ndim(y) == 2:
+        y = y[:, 0]
+    return np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+def transformada_grilla(x, y):
+    """Transformada afín de una grilla regular definida por los centros de píxel de sus ejes"""
+    dx = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 1.0
+    dy = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 1.0
+    return rasterio.Affine(dx, 0.0, x[0] - dx / 2, 0.0, dy, y[0] - dy / 2)
+
+def rasterizar_geometrias(geometrias, x, y, valores=None, relleno=0, dtype=np.int32):
+    """Ráster de etiquetas sobre la grilla (x, y): cada píxel toma el valor de la geometría que contiene su centro.
+
+    Con rasterio se usa la rasterización por líneas de barrido de GDAL; sin él,
+    `shapely.contains_xy` vectorizado dentro de la ventana de cada geometría.
+    """
+    x, y = ejes_grilla(x, y)
+    geometrias = list(geometrias)
+    valores = np.arange(1, len(geometrias) + 1) if valores is None else np.asarray(valores)
+    forma = (len(y), len(x))
+    if RASTERIZACION_RASTERIO:
+        pares = [(g, v) for g, v in zip(geometrias, valores.tolist()) if g is not None and not g.is_empty]
+        if not pares:
+            return np.full(forma, relleno, dtype=dtype)
+        return rasterio_features.rasterize(
+            pares, out_shape=forma, transform=transformada_grilla(x, y), fill=relleno, dtype=dtype
+        )
+    
+    etiquetas = np.full(forma, relleno, dtype=dtype)
+    for geometria, valor in zip(geometrias, valores):
+        if geometria is None or geometria.is_empty:
+            continue
+        minx, miny, maxx, maxy = geometria.bounds
+        columnas = np.flatnonzero((x >= minx) & (x <= maxx))
+        filas = np.flatnonzero((y >= miny) & (y <= maxy))
+        if len(columnas) == 0 or len(filas) == 0:
+            continue
+        ventana = np.ix_(filas, columnas)
+        X, Y = np.meshgrid(x[columnas], y[filas])
+        dentro = shapely.contains_xy(geometria, X, Y)
+        etiquetas[ventana] = np.where(dentro, valor, etiquetas[ventana])
+    return etiquetas
+
+def mascara_geometria(geometria, x, y):
+    """Máscara booleana de los píxeles de la grilla (x, y) cuyo centro cae dentro de la geometría"""
+    return rasterizar_geometrias([geometria], x, y, valores=[1], dtype=np.uint8).astype(bool)
+
+# ===== ESTADÍSTICAS ZONALES DEL TERRENO =====
+PERCENTILES_ZONALES = (10, 90)
+
+def estadisticas_zonales(etiquetas, valores, n_zonas, percentiles=PERCENTILES_ZONALES):
+    """Media, máximo y percentiles de una capa por zona (etiquetas 1..n_zonas; 0 = fuera).
+
+    Un solo ordenamiento por (zona, valor) sirve a todas las zonas: el costo
+    depende de la cantidad de píxeles, no de píxeles × zonas. Las zonas sin
+    píxeles quedan en NaN.
+    """
+    etiquetas = np.asarray(etiquetas).ravel()
+    valores = np.asarray(valores, dtype=float).ravel()
+    validos = (etiquetas > 0) & (etiquetas <= n_zonas) & np.isfinite(valores)
+    zona = etiquetas[validos].astype(np.intp)
+    valores = valores[validos]
+    
+    conteo = np.bincount(zona, minlength=n_zonas + 1)[1:]
+    suma = np.bincount(zona, weights=valores, minlength=n_zonas + 1)[1:]
+    con_datos = conteo > 0
+    
+    orden = np.lexsort((valores, zona))
+    ordenados = valores[orden]
+    inicio = np.concatenate([[0], np.cumsum(conteo)[:-1]])
+    ultimo = inicio + np.maximum(conteo - 1, 0)
+    
+    def en_zonas(posiciones):
+        resultado = np.full(n_zonas, np.nan)
+        resultado[con_datos] = ordenados[posiciones[con_datos]]
+        return resultado
+    
+    estadisticas = {
+        'media': np.where(con_datos, suma / np.maximum(conteo, 1), np.nan),
+        'max': en_zonas(ultimo)
+    }
+    for p in percentiles:
+        # Interpolación lineal entre rangos, como np.percentile
+        posicion = inicio + (conteo - 1).clip(min=0) * (p / 100.0)
+        bajo, alto = np.floor(posicion).astype(np.intp), np.ceil(posicion).astype(np.intp)
+        fraccion = posicion - bajo
+        estadisticas[f'p{p}'] = en_zonas(bajo) * (1 - fraccion) + en_zonas(alto) * fraccion
+    return estadisticas
+
+def aspecto_medio_zonal(etiquetas, aspecto, n_zonas):
+    """Orientación media por zona (media circular en grados, 0-360)"""
+    etiquetas = np.asarray(etiquetas).ravel()
+    aspecto = np.asarray(aspecto, dtype=float).ravel()
+    validos = (etiquetas > 0) & (etiquetas <= n_zonas) & np.isfinite(aspecto)
+    zona = etiquetas[validos].astype(np.intp)
+    radianes = np.radians(aspecto[validos])
+    seno = np.bincount(zona, weights=np.sin(radianes), minlength=n_zonas + 1)[1:]
+    coseno = np.bincount(zona, weights=np.cos(radianes), minlength=n_zonas + 1)[1:]
+    conteo = np.bincount(zona, minlength=n_zonas + 1)[1:]
+    return np.where(conteo > 0, np.degrees(np.arctan2(seno, coseno)) % 360, np.nan)
+
+def pasos_metricos(x, y):
+    """Paso con signo entre centros de píxel, en metros, hacia el este (x) y el norte (y) de una grilla en grados"""
+    x, y = ejes_grilla(x, y)
+    paso_x = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 0.0
+    paso_y = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 0.0
+    paso_x_m = paso_x * METROS_POR_GRADO * math.cos(math.radians(float(np.mean(y))))
+    paso_y_m = paso_y * METROS_POR_GRADO
+    return (paso_x_m if paso_x_m != 0 else 1.0), (paso_y_m if paso_y_m != 0 else 1.0)
+
+def analizar_terreno_por_zona(etiquetas, x, y, Z, pendientes, n_zonas):
+    """Columnas terreno_* por zona: elevación, pendiente y curvatura (media, máximo, percentiles) y orientación media"""
+    paso_x, paso_y = pasos_metricos(x, y)
+    # Derivadas respecto del este y del norte en metros (el signo del paso contempla filas norte-sur)
+    dz_norte, dz_este = np.gradient(Z, paso_y, paso_x)
+    # Orientación: acimut de la dirección de máxima bajada (0° = norte, 90° = este)
+    aspecto = np.degrees(np.arctan2(-dz_este, -dz_norte)) % 360
+    # Curvatura total (perfil + planar), que se reduce a -(dxx + dyy)
+    curvatura = -(np.gradient(dz_este, paso_x, axis=1) + np.gradient(dz_norte, paso_y, axis=0))
+    
+    columnas = {}
+    for nombre, capa in (('elevacion', Z), ('pendiente', pendientes), ('curvatura', curvatura)):
+        for estadistico, valores in estadisticas_zonales(etiquetas, capa, n_zonas).items():
+            columnas[f'terreno_{nombre}_{estadistico}'] = valores
+    columnas['terreno_aspecto_medio'] = aspecto_medio_zonal(etiquetas, aspecto, n_zonas)
+    return columnas
+
+def calcular_pendiente(X, Y, Z, resolucion):
+    """Calcula pendiente a partir del DEM"""
+    # Calcular gradientes
+    dy = np.gradient(Z, axis=0) / resolucion
+    dx = np.gradient(Z, axis=1) / resolucion
+    # Calcular pendiente en porcentaje
+    pendiente = np.sqrt(dx**2 + dy**2) * 100
+    pendiente = np.clip(pendiente, 0, 100)
+
+    return pendiente
+
+# ===== CONFIGURACIÓN VARIEDADES CULTIVOS (ACTUALIZADO CON NUEVOS CULTIVOS) =====
+VARIEDADES_CULTIVOS = {
+    'TRIGO': [
+        'ACA 303', 'ACA 315', 'Baguette Premium 11', 'Baguette Premium 13',
+        'Biointa 1005', 'Biointa 2004', 'Klein Don Enrique', 'Klein Guerrero',
+        'Buck Meteoro', 'Buck Poncho', 'SY 110', 'SY 200'
+    ],
+    'MAIZ': [
+        'DK 72-10', 'DK 73-20', 'Pioneer 30F53', 'Pioneer 30F35',
+        'Syngenta AG 6800', 'Syngenta AG 8088', 'Dow 2A610', 'Dow 2B710',
+        'Nidera 8710', 'Nidera 8800', 'Morgan 360', 'Morgan 390'
+    ],
+    'SORGO': [
+        'Advanta AS 5405', 'Advanta AS 5505', 'Pioneer 84G62', 'Pioneer 85G96',
+        'DEKALB 53-67', 'DEKALB 55-00', 'MACER S-10', 'MACER S-15',
+        'Sorgocer 105', 'Sorgocer 110', 'Río IV 100', 'Río IV 110'
+    ],
+    'SOJA': [
+        'DM 53i52', 'DM 58i62', 'Nidera 49X', 'Nidera 52X',
+        'Don Mario 49X', 'Don Mario 52X', 'SYNGENTA 4.9i', 'SYNGENTA 5.2i',
+        'Biosoys 4.9', 'Biosoys 5.2', 'ACA 49', 'ACA 52'
+    ],
+    'GIRASOL': [
+        'ACA 884', 'ACA 887', 'Nidera 7120', 'Nidera 7150',
+        'Syngenta 390', 'Syngenta 410', 'Pioneer 64A15', 'Pioneer 65A25',
+        'Advanta G 100', 'Advanta G 110', 'Biosun 400', 'Biosun 420'
+    ],
+    'MANI': [
+        'ASEM 400', 'ASEM 500', 'Granoleico', 'Guasu',
+        'Florman INTA', 'Elena', 'Colorado Irradiado', 'Overo Colorado',
+        'Runner 886', 'Runner 890', 'Tegua', 'Virginia 98R'
+    ],
+    # NUEVOS CULTIVOS AGREGADOS
+    'VID': [
+        'Malbec', 'Cabernet Sauvignon', 'Merlot', 'Syrah', 'Chardonnay',
+        'Torrontés', 'Bonarda', 'Tempranillo', 'Sangiovese', 'Pinot Noir',
+        'Chenin', 'Sauvignon Blanc', 'Viognier', 'Carménère', 'Petit Verdot'
+    ],
+    'OLIVO': [
+        'Arbequina', 'Picual', 'Manzanilla', 'Hojiblanca', 'Cornicabra',
+        'Empeltre', 'Frantoio', 'Leccino', 'Coratina', 'Picholine',
+        'Kalamata', 'Mission', 'Ascolano', 'Barnea', 'Arbosana'
+    ],
+    'ALMENDRO': [
+        'Non Pareil', 'Carmel', 'Butte', 'Padre', 'Mission',
+        'Fritz', 'Monterey', 'Price', 'Aldrich', 'Wood Colony',
+        'Peerless', 'Thompson', 'Livingston', 'Sonora', 'Winters'
+    ],
+    'BANANO': [
+        'Cavendish', 'Gros Michel', 'Plátano', 'Manzano', 'Rojo',
+        'Morado', 'Baby Banana', 'Blue Java', 'Goldfinger', 'Pisang Awak',
+        'Mysore', 'Saba', 'Lakatan', 'Señorita', 'Dwarf Cavendish'
+    ],
+    'CAFE': [
+        'Arabica', 'Robusta', 'Liberica', 'Excelsa', 'Typica',
+        'Bourbon', 'Caturra', 'Catuai', 'Mundo Novo', 'Maragogipe',
+        'Geisha', 'Pacamara', 'SL-28', 'SL-34', 'Kona'
+    ],
+    'CACAO': [
+        'Forastero', 'Criollo', 'Trinitario', 'Nacional', 'Amelonado',
+        'Contamana', 'Marañón', 'Porcelana', 'Chuao', 'Carenero',
+        'Ocumare', 'Cundeamor', 'ICS-95', 'UF-613', 'TSH-565'
+    ],
+    'PALMA_ACEITERA': [
+        'Tenera', 'Dura', 'Pisifera', 'DxP', 'Yangambi',
+        'AVROS', 'La Mé', 'Ekona', 'Calabar', 'NIFOR',
+        'MARDI', 'CIRAD', 'ASD Costa Rica', 'Dami', 'Socfindo'
+    ]
+}
+
+# ===== CONFIGURACIÓN PARÁMETROS CULTIVOS (ACTUALIZADO) =====
+PARAMETROS_CULTIVOS = {
+    'TRIGO': {
+        'NITROGENO': {'min': 100, 'max': 180},
+        'FOSFORO': {'min': 40, 'max': 80},
+        'POTASIO': {'min': 90, 'max': 150},
+        'MATERIA_ORGANICA_OPTIMA': 3.5,
+        'HUMEDAD_OPTIMA': 0.28,
+        'NDVI_OPTIMO': 0.75,
+        'NDRE_OPTIMO': 0.40,
+        'RENDIMIENTO_OPTIMO': 4500,
+        'COSTO_FERTILIZACION': 350,
+        'PRECIO_VENTA': 0.25,
+        'VARIEDADES': VARIEDADES_CULTIVOS['TRIGO'],
+        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
+    },
+    'MAIZ': {
+        'NITROGENO': {'min': 150, 'max': 250},
+        'FOSFORO': {'min': 50, 'max': 90},
+        'POTASIO': {'min': 120, 'max': 200},
+        'MATERIA_ORGANICA_OPTIMA': 3.8,
+        'HUMEDAD_OPTIMA': 0.32,
+        'NDVI_OPTIMO': 0.80,
+        'NDRE_OPTIMO': 0.45,
+        'RENDIMIENTO_OPTIMO': 8500,
+        'COSTO_FERTILIZACION': 550,
+        'PRECIO_VENTA': 0.20,
+        'VARIEDADES': VARIEDADES_CULTIVOS['MAIZ'],
+        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste', 'Cuyo']
+    },
+    'SORGO': {
+        'NITROGENO': {'min': 80, 'max': 140},
+        'FOSFORO': {'min': 35, 'max': 65},
+        'POTASIO': {'min': 100, 'max': 180},
+        'MATERIA_ORGANICA_OPTIMA': 3.0,
+        'HUMEDAD_OPTIMA': 0.25,
+        'NDVI_OPTIMO': 0.70,
+        'NDRE_OPTIMO': 0.35,
+        'RENDIMIENTO_OPTIMO': 5000,
+        'COSTO_FERTILIZACION': 300,
+        'PRECIO_VENTA': 0.18,
+        'VARIEDADES': VARIEDADES_CULTIVOS['SORGO'],
+        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
+    },
+    'SOJA': {
+        'NITROGENO': {'min': 20, 'max': 40},
+        'FOSFORO': {'min': 45, 'max': 85},
+        'POTASIO': {'min': 140, 'max': 220},
+        'MATERIA_ORGANICA_OPTIMA': 3.5,
+        'HUMEDAD_OPTIMA': 0.30,
+        'NDVI_OPTIMO': 0.78,
+        'NDRE_OPTIMO': 0.42,
+        'RENDIMIENTO_OPTIMO': 3200,
+        'COSTO_FERTILIZACION': 400,
+        'PRECIO_VENTA': 0.45,
+        'VARIEDADES': VARIEDADES_CULTIVOS['SOJA'],
+        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
+    },
+    'GIRASOL': {
+        'NITROGENO': {'min': 70, 'max': 120},
+        'FOSFORO': {'min': 40, 'max': 75},
+        'POTASIO': {'min': 110, 'max': 190},
+        'MATERIA_ORGANICA_OPTIMA': 3.2,
+        'HUMEDAD_OPTIMA': 0.26,
+        'NDVI_OPTIMO': 0.72,
+        'NDRE_OPTIMO': 0.38,
+        'RENDIMIENTO_OPTIMO': 2800,
+        'COSTO_FERTILIZACION': 320,
+        'PRECIO_VENTA': 0.35,
+        'VARIEDADES': VARIEDADES_CULTIVOS['GIRASOL'],
+        'ZONAS_ARGENTINA': ['Pampeana', 'Noroeste', 'Noreste']
+    },
+    'MANI': {
+        'NITROGENO': {'min': 15, 'max': 30},
+        'FOSFORO': {'min': 50, 'max': 90},
+        'POTASIO': {'min': 80, 'max': 140},
+        'MATERIA_ORGANICA_OPTIMA': 2.8,
+        'HUMEDAD_OPTIMA': 0.22,
+        'NDVI_OPTIMO': 0.68,
+        'NDRE_OPTIMO': 0.32,
+        'RENDIMIENTO_OPTIMO': 3800,
+        'COSTO_FERTILIZACION': 380,
+        'PRECIO_VENTA': 0.60,
+        'VARIEDADES': VARIEDADES_CULTIVOS['MANI'],
+        'ZONAS_ARGENTINA': ['Córdoba', 'San Luis', 'La Pampa']
+    },
+    # NUEVOS CULTIVOS AGREGADOS
+    'VID': {
+        'NITROGENO': {'min': 60, 'max': 120},
+        'FOSFORO': {'min': 30, 'max': 70},
+        'POTASIO': {'min': 150, 'max': 250},
+        'MATERIA_ORGANICA_OPTIMA': 2.5,
+        'HUMEDAD_OPTIMA': 0.35,
+        'NDVI_OPTIMO': 0.65,
+        'NDRE_OPTIMO': 0.35,
+        'RENDIMIENTO_OPTIMO': 15000,  # kg/ha de uva
+        'COSTO_FERTILIZACION': 800,
+        'PRECIO_VENTA': 0.80,  # USD/kg uva
+        'VARIEDADES': VARIEDADES_CULTIVOS['VID'],
+        'ZONAS_ARGENTINA': ['Mendoza', 'San Juan', 'La Rioja', 'Salta']
+    },
+    'OLIVO': {
+        'NITROGENO': {'min': 40, 'max': 100},
+        'FOSFORO': {'min': 20, 'max': 50},
+        'POTASIO': {'min': 100, 'max': 200},
+        'MATERIA_ORGANICA_OPTIMA': 2.0,
+        'HUMEDAD_OPTIMA': 0.25,
+        'NDVI_OPTIMO': 0.60,
+        'NDRE_OPTIMO': 0.30,
+        'RENDIMIENTO_OPTIMO': 8000,  # kg/ha de aceituna
+        'COSTO_FERTILIZACION': 600,
+        'PRECIO_VENTA': 1.20,  # USD/kg aceituna
+        'VARIEDADES': VARIEDADES_CULTIVOS['OLIVO'],
+        'ZONAS_ARGENTINA': ['La Rioja', 'Catamarca', 'San Juan', 'Mendoza']
+    },
+    'ALMENDRO': {
+        'NITROGENO': {'min': 80, 'max': 160},
+        'FOSFORO': {'min': 40, 'max': 80},
+        'POTASIO': {'min': 120, 'max': 200},
+        'MATERIA_ORGANICA_OPTIMA': 2.2,
+        'HUMEDAD_OPTIMA': 0.30,
+        'NDVI_OPTIMO': 0.62,
+        'NDRE_OPTIMO': 0.32,
+        'RENDIMIENTO_OPTIMO': 3000,  # kg/ha de almendra
+        'COSTO_FERTILIZACION': 700,
+        'PRECIO_VENTA': 4.50,  # USD/kg almendra
+        'VARIEDADES': VARIEDADES_CULTIVOS['ALMENDRO'],
+        'ZONAS_ARGENTINA': ['Río Negro', 'Neuquén', 'Mendoza', 'San Juan']
+    },
+    'BANANO': {
+        'NITROGENO': {'min': 200, 'max': 350},
+        'FOSFORO': {'min': 60, 'max': 120},
+        'POTASIO': {'min': 300, 'max': 500},
+        'MATERIA_ORGANICA_OPTIMA': 4.0,
+        'HUMEDAD_OPTIMA': 0.45,
+        'NDVI_OPTIMO': 0.78,
+        'NDRE_OPTIMO': 0.40,
+        'RENDIMIENTO_OPTIMO': 40000,  # kg/ha de banano
+        'COSTO_FERTILIZACION': 1200,
+        'PRECIO_VENTA': 0.30,  # USD/kg banano
+        'VARIEDADES': VARIEDADES_CULTIVOS['BANANO'],
+        'ZONAS_ARGENTINA': ['Formosa', 'Misiones', 'Corrientes']
+    },
+    'CAFE': {
+        'NITROGENO': {'min': 100, 'max': 200},
+        'FOSFORO': {'min': 40, 'max': 80},
+        'POTASIO': {'min': 150, 'max': 250},
+        'MATERIA_ORGANICA_OPTIMA': 3.5,
+        'HUMEDAD_OPTIMA': 0.40,
+        'NDVI_OPTIMO': 0.70,
+        'NDRE_OPTIMO': 0.38,
+        'RENDIMIENTO_OPTIMO': 2000,  # kg/ha de café verde
+        'COSTO_FERTILIZACION': 900,
+        'PRECIO_VENTA': 3.50,  # USD/kg café
+        'VARIEDADES': VARIEDADES_CULTIVOS['CAFE'],
+        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Jujuy']
+    },
+    'CACAO': {
+        'NITROGENO': {'min': 80, 'max': 150},
+        'FOSFORO': {'min': 30, 'max': 60},
+        'POTASIO': {'min': 120, 'max': 200},
+        'MATERIA_ORGANICA_OPTIMA': 4.0,
+        'HUMEDAD_OPTIMA': 0.50,
+        'NDVI_OPTIMO': 0.72,
+        'NDRE_OPTIMO': 0.38,
+        'RENDIMIENTO_OPTIMO': 1500,  # kg/ha de cacao seco
+        'COSTO_FERTILIZACION': 850,
+        'PRECIO_VENTA': 5.00,  # USD/kg cacao
+        'VARIEDADES': VARIEDADES_CULTIVOS['CACAO'],
+        'ZONAS_ARGENTINA': ['Misiones', 'Corrientes', 'Formosa']
+    },
+    'PALMA_ACEITERA': {
+        'NITROGENO': {'min': 150, 'max': 250},
+        'FOSFORO': {'min': 50, 'max': 100},
+        'POTASIO': {'min': 200, 'max': 350},
+        'MATERIA_ORGANICA_OPTIMA': 3.8,
+        'HUMEDAD_OPTIMA': 0.55,
+        'NDVI_OPTIMO': 0.75,
+        'NDRE_OPTIMO': 0.42,
+        'RENDIMIENTO_OPTIMO': 20000,  # kg/ha de racimos
+        'COSTO_FERTILIZACION': 1100,
+        'PRECIO_VENTA': 0.40,  # USD/kg aceite
+        'VARIEDADES': VARIEDADES_CULTIVOS['PALMA_ACEITERA'],
+        'ZONAS_ARGENTINA': ['Formosa', 'Chaco', 'Misiones']
+    }
+}
+
+# ===== CONFIGURACIÓN TEXTURA SUELO ÓPTIMA (ACTUALIZADO) =====
+TEXTURA_SUELO_OPTIMA = {
+    'TRIGO': {
+        'textura_optima': 'Franco arcilloso',
+        'arena_optima': 35,
+        'limo_optima': 40,
+        'arcilla_optima': 25,
+        'densidad_aparente_optima': 1.35,
+        'porosidad_optima': 0.48
+    },
+    'MAIZ': {
+        'textura_optima': 'Franco',
+        'arena_optima': 45,
+        'limo_optima': 35,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.30,
+        'porosidad_optima': 0.50
+    },
+    'SORGO': {
+        'textura_optima': 'Franco arenoso',
+        'arena_optima': 55,
+        'limo_optima': 30,
+        'arcilla_optima': 15,
+        'densidad_aparente_optima': 1.40,
+        'porosidad_optima': 0.45
+    },
+    'SOJA': {
+        'textura_optima': 'Franco',
+        'arena_optima': 40,
+        'limo_optima': 40,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.25,
+        'porosidad_optima': 0.52
+    },
+    'GIRASOL': {
+        'textura_optima': 'Franco arcilloso',
+        'arena_optima': 30,
+        'limo_optima': 45,
+        'arcilla_optima': 25,
+        'densidad_aparente_optima': 1.32,
+        'porosidad_optima': 0.49
+    },
+    'MANI': {
+        'textura_optima': 'Franco arenoso',
+        'arena_optima': 60,
+        'limo_optima': 25,
+        'arcilla_optima': 15,
+        'densidad_aparente_optima': 1.38,
+        'porosidad_optima': 0.46
+    },
+    # NUEVOS CULTIVOS AGREGADOS
+    'VID': {
+        'textura_optima': 'Franco arenoso',
+        'arena_optima': 50,
+        'limo_optima': 30,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.40,
+        'porosidad_optima': 0.50
+    },
+    'OLIVO': {
+        'textura_optima': 'Franco arcilloso',
+        'arena_optima': 40,
+        'limo_optima': 35,
+        'arcilla_optima': 25,
+        'densidad_aparente_optima': 1.35,
+        'porosidad_optima': 0.48
+    },
+    'ALMENDRO': {
+        'textura_optima': 'Franco',
+        'arena_optima': 45,
+        'limo_optima': 35,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.38,
+        'porosidad_optima': 0.47
+    },
+    'BANANO': {
+        'textura_optima': 'Franco arcilloso',
+        'arena_optima': 35,
+        'limo_optima': 40,
+        'arcilla_optima': 25,
+        'densidad_aparente_optima': 1.20,
+        'porosidad_optima': 0.55
+    },
+    'CAFE': {
+        'textura_optima': 'Franco',
+        'arena_optima': 40,
+        'limo_optima': 40,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.25,
+        'porosidad_optima': 0.52
+    },
+    'CACAO': {
+        'textura_optima': 'Franco arcilloso',
+        'arena_optima': 30,
+        'limo_optima': 45,
+        'arcilla_optima': 25,
+        'densidad_aparente_optima': 1.15,
+        'porosidad_optima': 0.56
+    },
+    'PALMA_ACEITERA': {
+        'textura_optima': 'Franco',
+        'arena_optima': 45,
+        'limo_optima': 35,
+        'arcilla_optima': 20,
+        'densidad_aparente_optima': 1.30,
+        'porosidad_optima': 0.51
+    }
+}
+
+# ===== FUNCIONES DE ANÁLISIS COMPLETOS =====
+def analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales, semilla=None):
+    """Análisis de fertilidad actual: un arreglo por índice (columnar), calculado para todas las zonas a la vez"""
+    n_poligonos = len(gdf_dividido)
+    rng = np.random.default_rng(semilla)
+    centroides = gdf_dividido.geometry.centroid
+    x = centroides.x.to_numpy()
+    y = centroides.y.to_numpy()
+    params = PARAMETROS_CULTIVOS[cultivo]
+    valor_base_satelital = datos_satelitales.get('valor_promedio', 0.6) if datos_satelitales else 0.6
+    
+    x_min, x_max = (x.min(), x.max()) if n_poligonos > 0 else (0.0, 0.0)
+    y_min, y_max = (y.min(), y.max()) if n_poligonos > 0 else (0.0, 0.0)
+    x_norm = (x - x_min) / (x_max - x_min) if x_max != x_min else np.full(n_poligonos, 0.5)
+    y_norm = (y - y_min) / (y_max - y_min) if y_max != y_min else np.full(n_poligonos, 0.5)
+    patron_espacial = x_norm * 0.6 + y_norm * 0.4
+    
+    # Ruido de las cinco variables en una sola extracción: columnas MO, humedad, NDVI, NDRE, NDWI
+    ruido = rng.normal(0.0, [0.2, 0.05, 0.06, 0.04, 0.08], size=(n_poligonos, 5))
+    
+    base_mo = params['MATERIA_ORGANICA_OPTIMA'] * 0.7
+    variabilidad_mo = patron_espacial * (params['MATERIA_ORGANICA_OPTIMA'] * 0.6)
+    materia_organica = np.clip(base_mo + variabilidad_mo + ruido[:, 0], 0.5, 8.0)
+    
+    base_humedad = params['HUMEDAD_OPTIMA'] * 0.8
+    variabilidad_humedad = patron_espacial * (params['HUMEDAD_OPTIMA'] * 0.4)
+    humedad_suelo = np.clip(base_humedad + variabilidad_humedad + ruido[:, 1], 0.1, 0.8)
+    
+    ndvi_base = valor_base_satelital * 0.8
+    ndvi_variacion = patron_espacial * (valor_base_satelital * 0.4)
+    ndvi = np.clip(ndvi_base + ndvi_variacion + ruido[:, 2], 0.1, 0.9)
+    
+    ndre_base = params['NDRE_OPTIMO'] * 0.7
+    ndre_variacion = patron_espacial * (params['NDRE_OPTIMO'] * 0.4)
+    ndre = np.clip(ndre_base + ndre_variacion + ruido[:, 3], 0.05, 0.7)
+    
+    ndwi = np.clip(0.2 + ruido[:, 4], 0, 1)
+    
+    npk_actual = (ndvi * 0.4) + (ndre * 0.3) + ((materia_organica / 8) * 0.2) + (humedad_suelo * 0.1)
+    npk_actual = np.clip(npk_actual, 0, 1)
+    
+    return {
+        'materia_organica': np.round(materia_organica, 2),
+        'humedad_suelo': np.round(humedad_suelo, 3),
+        'ndvi': np.round(ndvi, 3),
+        'ndre': np.round(ndre, 3),
+        'ndwi': np.round(ndwi, 3),
+        'npk_actual': np.round(npk_actual, 3)
+    }
+
+# ===== PRESCRIPCIÓN: DOSIS NPK, COSTOS Y PROYECCIONES (KERNEL COLUMNAR) =====
+PRECIOS_FERTILIZANTES = {'N': 1.2, 'P': 2.5, 'K': 1.8}  # USD/kg de N, P2O5 y K2O
+COLUMNAS_COSTOS = ('costo_nitrogeno', 'costo_fosforo', 'costo_potasio', 'costo_total')
+COLUMNAS_PROYECCIONES = ('rendimiento_sin_fert', 'rendimiento_con_fert', 'incremento_esperado')
+
+def calcular_prescripcion(indices, params, precios=PRECIOS_FERTILIZANTES):
+    """Dosis N/P/K, costos y rendimientos con y sin fertilización de todas las zonas en una pasada.
+
+    `indices` son los arreglos de `analizar_fertilidad_actual` y `params` la fila
+    de PARAMETROS_CULTIVOS. Los tres nutrientes se calculan como una matriz
+    (3, zonas) con los rangos del cultivo difundidos por fila.
+    """
+    ndvi = np.asarray(indices['ndvi'], dtype=float)
+    ndre = np.asarray(indices['ndre'], dtype=float)
+    humedad_suelo = np.asarray(indices['humedad_suelo'], dtype=float)
+    materia_organica = np.asarray(indices['materia_organica'], dtype=float)
+    npk_actual = np.asarray(indices['npk_actual'], dtype=float)
+    
+    factores = np.stack([
+        (1 - ndre) * 0.6 + (1 - ndvi) * 0.4,
+        (1 - (materia_organica / 8)) * 0.7 + (1 - humedad_suelo) * 0.3,
+        (1 - ndre) * 0.4 + (1 - humedad_suelo) * 0.4 + (1 - (materia_organica / 8)) * 0.2
+    ])
+    nutrientes = ('NITROGENO', 'FOSFORO', 'POTASIO')
+    minimos = np.array([[params[n]['min']] for n in nutrientes], dtype=float)
+    maximos = np.array([[params[n]['max']] for n in nutrientes], dtype=float)
+    dosis = np.round(np.clip(factores * (maximos - minimos) + minimos, minimos * 0.8, maximos * 1.2), 1)
+    
+    costos = dosis * np.array([[precios['N']], [precios['P']], [precios['K']]])
+    costo_total = costos[0] + costos[1] + costos[2] + params['COSTO_FERTILIZACION']
+    
+    rendimiento_base = params['RENDIMIENTO_OPTIMO'] * npk_actual * 0.7
+    incremento = (1 - npk_actual) * 0.4 + (1 - ndvi) * 0.2
+    
+    return {
+        'rec_N': dosis[0],
+        'rec_P': dosis[1],
+        'rec_K': dosis[2],
+        'costo_nitrogeno': np.round(costos[0], 2),
+        'costo_fosforo': np.round(costos[1], 2),
+        'costo_potasio': np.round(costos[2], 2),
+        'costo_total': np.round(costo_total, 2),
+        'rendimiento_sin_fert': np.round(rendimiento_base, 0),
+        'rendimiento_con_fert': np.round(rendimiento_base * (1 + incremento), 0),
+        'incremento_esperado': np.round(incremento * 100, 1)
+    }
+
+# ===== CLASIFICACIÓN TEXTURAL USDA (TABLA SOBRE EL TRIÁNGULO) =====
+# Índice 0 reservado para muestras inválidas; 1-12 son las clases USDA
+TEXTURAS_USDA = (
+    'NO_DETERMINADA',
+    'Arenoso',                  # Sand
+    'Arenoso franco',           # Loamy sand
+    'Franco arenoso',           # Sandy loam
+    'Franco',                   # Loam
+    'Franco limoso',            # Silt loam
+    'Limoso',                   # Silt
+    'Franco arcillo arenoso',   # Sandy clay loam
+    'Franco arcilloso',         # Clay loam
+    'Franco arcillo limoso',    # Silty clay loam
+    'Arcilloso arenoso',        # Sandy clay
+    'Arcilloso limoso',         # Silty clay
+    'Arcilloso'                 # Clay
+)
+
+TEXTURA_PASOS_POR_PUNTO = 10  # resolución de la tabla: 0.1 punto porcentual
+
+def reglas_textura_usda(arena, limo, arcilla):
+    """Código de clase USDA (1-12) según los límites del triángulo textural, sobre arreglos"""
+    condiciones = [
+        limo + 1.5 * arcilla < 15,
+        limo + 2 * arcilla < 30,
+        (arcilla >= 40) & (limo >= 40),
+        (arcilla >= 35) & (arena > 45),
+        arcilla >= 40,
+        (arcilla >= 27) & (arena <= 20),
+        (arcilla >= 27) & (arena <= 45),
+        (arcilla >= 20) & (limo < 28) & (arena > 45),
+        (limo >= 80) & (arcilla < 12),
+        limo >= 50,
+        (arcilla >= 7) & (limo >= 28) & (arena <= 52),
+    ]
+    codigos = [1, 2, 11, 10, 12, 9, 8, 7, 6, 5, 4]
+    return np.select(condiciones, codigos, default=3).astype(np.uint8)
+
+@lru_cache(maxsize=None)
+def tabla_texturas_usda():
+    """Tabla (arcilla, arena) -> clase precalculada sobre todo el triángulo textural"""
+    pasos = 100 * TEXTURA_PASOS_POR_PUNTO + 1
+    arcilla, arena = np.meshgrid(np.linspace(0, 100, pasos), np.linspace(0, 100, pasos), indexing='ij')
+    limo = 100 - arena - arcilla
+    tabla = reglas_textura_usda(arena, limo, arcilla)
+    tabla[limo < -1e-9] = 0
+    return tabla
+
+def clasificar_texturas(arena, limo, arcilla):
+    """Clase textural USDA de arreglos de arena/limo/arcilla (%): una búsqueda en la tabla por muestra"""
+    arena, limo, arcilla = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (arena, limo, arcilla)))
+    total = arena + limo + arcilla
+    validos = np.isfinite(total) & (total > 0)
+    escala = np.where(validos, 100 * TEXTURA_PASOS_POR_PUNTO / np.where(validos, total, 1), 0)
+    fila = np.rint(np.where(validos, arcilla, 0) * escala).astype(np.intp)
+    columna = np.rint(np.where(validos, arena, 0) * escala).astype(np.intp)
+    # El redondeo puede dejar arena + arcilla un paso por encima de 100
+    columna = np.minimum(columna, 100 * TEXTURA_PASOS_POR_PUNTO - fila)
+    codigos = np.where(validos, tabla_texturas_usda()[fila, columna], 0)
+    return np.asarray(TEXTURAS_USDA, dtype=object)[np.atleast_1d(codigos)].reshape(np.shape(codigos))
+
+def clasificar_textura_suelo(arena, limo, arcilla):
+    """Clase textural USDA de una muestra"""
+    return clasificar_texturas(arena, limo, arcilla).item()
+
+def analizar_textura_suelo(gdf_dividido, cultivo, semilla=None):
+    """Análisis de textura del suelo: composición y clase USDA de todas las zonas a la vez"""
+    gdf_dividido = a_epsg4326(gdf_dividido)
+    params_textura = TEXTURA_SUELO_OPTIMA[cultivo]
+    if 'area_ha' not in gdf_dividido.columns:
+        gdf_dividido['area_ha'] = areas_ha(gdf_dividido)
+    
+    rng = np.random.default_rng(semilla)
+    centroides = gdf_dividido.geometry.centroid
+    x = centroides.x.to_numpy()
+    y = centroides.y.to_numpy()
+    lat_norm = np.where(y != 0, (y + 90) / 180, 0.5)
+    lon_norm = np.where(x != 0, (x + 180) / 360, 0.5)
+    variabilidad_local = 0.15 + 0.7 * (lat_norm * lon_norm)
+    
+    arena_optima = params_textura['arena_optima']
+    limo_optima = params_textura['limo_optima']
+    arcilla_optima = params_textura['arcilla_optima']
+    
+    arena_val = np.clip(rng.normal(arena_optima * (0.8 + 0.4 * variabilidad_local), arena_optima * 0.15), 5, 95)
+    limo_val = np.clip(rng.normal(limo_optima * (0.7 + 0.6 * variabilidad_local), limo_optima * 0.2), 5, 95)
+    arcilla_val = np.clip(rng.normal(arcilla_optima * (0.75 + 0.5 * variabilidad_local), arcilla_optima * 0.15), 5, 95)
+    
+    total = arena_val + limo_val + arcilla_val
+    gdf_dividido['arena'] = (arena_val / total) * 100
+    gdf_dividido['limo'] = (limo_val / total) * 100
+    gdf_dividido['arcilla'] = (arcilla_val / total) * 100
+    gdf_dividido['textura_suelo'] = clasificar_texturas(
+        gdf_dividido['arena'].to_numpy(), gdf_dividido['limo'].to_numpy(), gdf_dividido['arcilla'].to_numpy()
+    )
+    return gdf_dividido
+
+# ===== ENSAMBLADO DE RESULTADOS POR ZONA =====
+def columnas_tipadas(prefijo, columnas, dtype=np.float64):
+    """Bloque {prefijo + nombre: arreglo} con un dtype común"""
+    return {f'{prefijo}{nombre}': np.asarray(valores, dtype=dtype) for nombre, valores in columnas.items()}
+
+def ensamblar_gdf_completo(gdf_base, bloques):
+    """Une los bloques de columnas de las etapas a las zonas en una sola operación"""
+    columnas = {}
+    for bloque in bloques:
+        columnas.update(bloque)
+    nuevas = pd.DataFrame(columnas, index=gdf_base.index)
+    gdf_completo = gpd.GeoDataFrame(
+        pd.concat([gdf_base.drop(columns=nuevas.columns, errors='ignore'), nuevas], axis=1),
+        geometry=gdf_base.geometry.name, crs=gdf_base.crs
+    )
+    # Identificadores y clases con enteros chicos
+    if 'id_zona' in gdf_completo.columns:
+        gdf_completo['id_zona'] = gdf_completo['id_zona'].astype(np.int32)
+    if 'textura_suelo' in gdf_completo.columns:
+        gdf_completo['textura_suelo'] = gdf_completo['textura_suelo'].astype('category')
+    return gdf_completo
+
+# ===== ETAPAS DE CÁLCULO DE UNA PARCELA =====
+def analizar_zonas(gdf, cultivo, n_divisiones, datos_satelitales, semilla, resolucion_dem=10.0,
+                   tamano_celda_m=None, zonificacion='grilla', dem=None):
+    """DEM, zonas, fertilidad, prescripción, textura y terreno por zona de una parcela.
+
+    `dem` es (X, Y, Z, bounds, fuente) de una fuente real ya descargada; sin él
+    se usa el DEM sintético. El terreno y la textura se siembran con la huella de
+    la parcela; la zonificación por clústeres y la fertilidad, con `semilla`.
+    Devuelve las salidas de cada etapa y los avisos para mostrar en la interfaz.
+    """
+    parcela = como_parcela(gdf)
+    avisos = []
+    
+    # DEM (antes de dividir: la zonificación por clústeres lo usa)
+    try:
+        if dem is None:
+            dem = (*generar_dem_sintetico(parcela, resolucion_dem, semilla=derivar_semilla(parcela.huella, 'dem')), 'Sintético')
+        X, Y, Z, bounds, fuente_dem = dem
+        dem = (X, Y, Z, bounds, calcular_pendiente(X, Y, Z, resolucion_dem), fuente_dem)
+    except Exception as e:
+        dem = None
+        avisos.append(f"⚠️ Error generando DEM y curvas de nivel: {e}")
+    
+    # Dividir parcela
+    gdf_dividido = None
+    if zonificacion == 'clusteres' and dem is not None:
+        try:
+            X, Y, Z, bounds, pendientes, _ = dem
+            gdf_dividido = zonificar_por_clusteres(parcela, X, Y, capas_zonificacion(X, Y, Z, pendientes), n_divisiones,
+                                                   semilla=derivar_semilla(semilla, 'clusteres'))
+        except Exception as e:
+            print(f"⚠️ Error en zonificación por clústeres: {e}")
+        if gdf_dividido is None:
+            avisos.append("⚠️ No se pudo zonificar por clústeres; se usa la grilla regular.")
+    if gdf_dividido is None:
+        gdf_dividido = dividir_parcela_en_zonas(parcela, n_divisiones, tamano_celda_m)
+    
+    # Calcular áreas (una sola pasada en el UTM de la parcela, reutilizada por todas las etapas)
+    gdf_dividido['area_ha'] = areas_ha(gdf_dividido, parcela.crs_utm)
+    
+    fertilidad_actual = analizar_fertilidad_actual(gdf_dividido, cultivo, datos_satelitales,
+                                                   semilla=derivar_semilla(semilla, 'fertilidad'))
+    prescripcion = calcular_prescripcion(fertilidad_actual, PARAMETROS_CULTIVOS[cultivo])
+    textura = analizar_textura_suelo(gdf_dividido, cultivo, semilla=derivar_semilla(parcela.huella, 'textura'))
+    
+    # Ráster de etiquetas de zona alineado con el DEM (1..n en el orden de gdf_dividido) y terreno por zona
+    etiquetas_zonas = None
+    terreno_zonas = {}
+    if dem is not None:
+        try:
+            X, Y, Z, bounds, pendientes, _ = dem
+            etiquetas_zonas = rasterizar_geometrias(gdf_dividido.geometry, X, Y)
+            terreno_zonas = analizar_terreno_por_zona(etiquetas_zonas, X, Y, Z, pendientes, len(gdf_dividido))
+            etiquetas_zonas = etiquetas_zonas.astype(np.int16 if len(gdf_dividido) < 2**15 else np.int32)
+        except Exception as e:
+            avisos.append(f"⚠️ Error en el análisis de terreno por zona: {e}")
+    
+    # Índices y capas de terreno van en float32; dosis, costos (USD) y rendimientos (kg) quedan en float64
+    gdf_completo = ensamblar_gdf_completo(textura, [
+        columnas_tipadas('fert_', fertilidad_actual, np.float32),
+        columnas_tipadas('rec_', {n: prescripcion[f'rec_{n}'] for n in ('N', 'P', 'K')}),
+        columnas_tipadas('costo_', {c: prescripcion[c] for c in COLUMNAS_COSTOS}),
+        columnas_tipadas('proy_', {c: prescripcion[c] for c in COLUMNAS_PROYECCIONES}),
+        columnas_tipadas('', terreno_zonas, np.float32)
+    ])
+    
+    return {
+        'dem': dem,
+        'gdf_dividido': gdf_dividido,
+        'fertilidad_actual': fertilidad_actual,
+        'prescripcion': prescripcion,
+        'textura': textura,
+        'etiquetas_zonas': etiquetas_zonas,
+        'gdf_completo': gdf_completo,
+        'avisos': avisos
+    }
+
+def analizar_lote(tarea):
+    """Tarea del pool por lotes: (nombre, gdf del lote, argumentos de analizar_zonas).
+
+    Devuelve solo las zonas con sus columnas; el DEM y las salidas intermedias
+    no vuelven al proceso de la sesión.
+    """
+    nombre, gdf_lote, parametros = tarea
+    try:
+        etapas = analizar_zonas(gdf_lote, **parametros)
+        return {'nombre_lote': nombre, 'exitoso': True, 'gdf_completo': etapas['gdf_completo'], 'avisos': etapas['avisos']}
+    except Exception as e:
+        return {'nombre_lote': nombre, 'exitoso': False, 'avisos': [f"❌ Error en el lote {nombre}: {str(e)}"]}
@@ -0,0 +1,26 @@
+"""Atribución del basemap de Esri World Imagery."""
+import os
+import sys
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+import geopandas as gpd  # noqa: E402
+from shapely.geometry import box  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+def test_basemap_dibuja_atribucion(monkeypatch):
+    monkeypatch.setattr(app, 'obtener_mosaico_basemap',
+                        lambda ext, offline=False: (np.zeros((4, 4, 3)), (ext[0], ext[2], ext[1], ext[3])))
+    gdf = gpd.GeoDataFrame(geometry=[box(-60.0, -33.0, -59.99, -32.99)], crs='EPSG:4326').to_crs(3857)
+
+    fig, ax = plt.subplots()
+    app.agregar_basemap(ax, gdf)
+
+    assert app.BASEMAP_ATRIBUCION in [t.get_text() for t in ax.texts]
+    plt.close(fig)
@@ -0,0 +1,36 @@
+"""Caché de parcelas ingeridas: el tope de memoria cuenta la Parcela con sus proyecciones."""
+import io
+import os
+import sys
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+class ArchivoSubido(io.BytesIO):
+    def __init__(self, contenido, name):
+        super().__init__(contenido)
+        self.name = name
+
+
+def test_parcela_cacheada_se_mide_con_sus_proyecciones(monkeypatch, tmp_path):
+    cache = app.CacheLRU(max_entradas=4, max_bytes=64 * 1024 * 1024)
+    monkeypatch.setattr(app, 'obtener_cache_parcelas', lambda: cache)
+    gdf = gpd.GeoDataFrame(geometry=[Point(-60.0, -33.0).buffer(0.05, 256)], crs='EPSG:4326')
+    ruta = tmp_path / 'parcela.gpkg'
+    gdf.to_file(ruta, driver='GPKG')
+    archivo = ArchivoSubido(ruta.read_bytes(), 'parcela.gpkg')
+
+    parcela = app.cargar_archivo_parcela(archivo)
+
+    assert parcela is not None
+    for propiedad in ('gdf_utm', 'gdf_3857', 'gdf_visualizacion'):
+        assert propiedad in vars(parcela)
+    tamano = cache._tamanos[next(iter(cache._tamanos))]
+    assert tamano == app.estimar_tamano_bytes(parcela)
+    assert tamano > 3 * app.estimar_tamano_bytes(parcela.gdf)
+    assert app.cargar_archivo_parcela(archivo) is parcela
@@ -0,0 +1,195 @@
+"""Rama GEE de obtener_datos_*_gee con un cliente ee simulado (sin red ni credenciales)."""
+import os
+import sys
+import threading
+import types
+from datetime import datetime
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import Polygon
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+class _Valor:
+    def __init__(self, valor):
+        self.valor = valor
+
+    def getInfo(self):
+        return self.valor
+
+
+class _Imagen:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def normalizedDifference(self, bandas):
+        return self
+
+    def expression(self, expresion, mapa):
+        return self
+
+    def select(self, banda):
+        return self
+
+    def rename(self, nombre):
+        return self
+
+    def reduceRegion(self, **kwargs):
+        return _Valor(self.stats)
+
+    def get(self, propiedad):
+        if propiedad == 'system:time_start':
+            return _Valor(datetime(2024, 1, 15).timestamp() * 1000)
+        return _Valor(12.5)
+
+
+class _Coleccion:
+    def __init__(self, imagen):
+        self.imagen = imagen
+
+    def filterBounds(self, geometria):
+        return self
+
+    def filterDate(self, inicio, fin):
+        return self
+
+    def filter(self, filtro):
+        return self
+
+    def sort(self, propiedad):
+        return self
+
+    def first(self):
+        return self.imagen
+
+
+class _Reductor:
+    def combine(self, **kwargs):
+        return self
+
+
+class EESimulado:
+    """Subconjunto de la API de ee usado por las funciones de descarga"""
+
+    def __init__(self, indice='NDVI'):
+        self.colecciones = []
+        self.imagen = _Imagen({f'{indice}_mean': 0.61, f'{indice}_min': 0.2,
+                               f'{indice}_max': 0.85, f'{indice}_stdDev': 0.07})
+        ee = self
+
+        class Geometry:
+            def __init__(self, geojson):
+                self.geojson = geojson
+
+            @staticmethod
+            def Rectangle(coords):
+                return Geometry(coords)
+
+        class Filter:
+            @staticmethod
+            def lt(propiedad, valor):
+                return (propiedad, valor)
+
+        class Reducer:
+            @staticmethod
+            def mean():
+                return _Reductor()
+
+            @staticmethod
+            def minMax():
+                return _Reductor()
+
+            @staticmethod
+            def stdDev():
+                return _Reductor()
+
+        def ImageCollection(dataset):
+            ee.colecciones.append(dataset)
+            return _Coleccion(ee.imagen)
+
+        self.Geometry = Geometry
+        self.Filter = Filter
+        self.Reducer = Reducer
+        self.ImageCollection = ImageCollection
+
+
+@pytest.fixture
+def gee_simulado(monkeypatch, tmp_path):
+    ee = EESimulado()
+    cache = app.CachePersistenteTTL(str(tmp_path / 'gee.sqlite'), ttl_segundos=3600)
+    monkeypatch.setattr(app, 'ee', ee, raising=False)
+    monkeypatch.setattr(app, 'GEE_AVAILABLE', True)
+    monkeypatch.setattr(app, 'obtener_cache_gee', lambda: cache)
+    monkeypatch.setitem(app.st.session_state, 'gee_authenticated', True)
+    return ee, cache
+
+
+@pytest.fixture
+def gdf_parcela():
+    poligono = Polygon([(-60.0, -33.0), (-59.99, -33.0), (-59.99, -33.01), (-60.0, -33.01)])
+    return gpd.GeoDataFrame({'id': [1]}, geometry=[poligono], crs='EPSG:4326')
+
+
+def test_sentinel2_gee_usa_el_gdf_recibido_y_cachea(gee_simulado, gdf_parcela):
+    ee, cache = gee_simulado
+    args = (gdf_parcela, datetime(2024, 1, 1), datetime(2024, 2, 1))
+
+    resultado = app.obtener_datos_sentinel2_gee(*args, indice='NDVI')
+
+    assert resultado is not None
+    assert resultado['valor_promedio'] == pytest.approx(0.61)
+    assert resultado['fuente'] == 'Sentinel-2 (Google Earth Engine)'
+    assert ee.colecciones == ['COPERNICUS/S2_SR_HARMONIZED']
+
+    assert app.obtener_datos_sentinel2_gee(*args, indice='NDVI') == resultado
+    assert ee.colecciones == ['COPERNICUS/S2_SR_HARMONIZED']
+    assert cache.estadisticas()['aciertos'] == 1
+
+
+def test_landsat_gee_usa_el_gdf_recibido(gee_simulado, gdf_parcela):
+    ee, _ = gee_simulado
+
+    resultado = app.obtener_datos_landsat_gee(gdf_parcela, datetime(2024, 1, 1), datetime(2024, 2, 1),
+                                              dataset='LANDSAT/LC09/C02/T1_L2', indice='NDVI')
+
+    assert resultado is not None
+    assert resultado['valor_max'] == pytest.approx(0.85)
+    assert ee.colecciones == ['LANDSAT/LC09/C02/T1_L2']
+
+
+def test_verificacion_colgada_no_bloquea_el_cliente(monkeypatch):
+    liberar = threading.Event()
+    en_curso = threading.Event()
+
+    def get_info():
+        en_curso.set()
+        assert liberar.wait(10)
+        return 1
+
+    ee = types.SimpleNamespace(Number=lambda valor: types.SimpleNamespace(getInfo=get_info),
+                               Initialize=lambda *args, **kwargs: None)
+    monkeypatch.setattr(app, 'ee', ee, raising=False)
+    monkeypatch.setattr(app, 'GEE_AVAILABLE', True)
+    cliente = app.ClienteGEE(intervalo_verificacion=0)
+    cliente.autenticado, cliente.inicializaciones = True, 1
+
+    verificacion = threading.Thread(target=cliente.asegurar)
+    verificacion.start()
+    try:
+        assert en_curso.wait(10)
+        # Otra sesión no espera a la verificación en curso ni lanza una segunda
+        resultado = []
+        otra = threading.Thread(target=lambda: resultado.append(cliente.asegurar()))
+        otra.start()
+        otra.join(2)
+        assert resultado == [True]
+    finally:
+        liberar.set()
+        verificacion.join(10)
+
+    assert cliente.estadisticas()['verificaciones'] == 1
+    assert cliente.estadisticas()['inicializaciones'] == 1
@@ -0,0 +1,74 @@
+"""Modo por lotes: las etapas de cálculo corren en procesos 'spawn' y coinciden con el análisis de un lote."""
+import os
+import sys
+from datetime import datetime
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+PARAMETROS = {
+    'cultivo': 'TRIGO', 'n_divisiones': 9, 'satelite': 'SENTINEL-2',
+    'fecha_inicio': datetime(2024, 1, 1), 'fecha_fin': datetime(2024, 2, 1),
+    'intervalo_curvas': 5.0, 'resolucion_dem': 10.0, 'tamano_celda_m': None,
+    'zonificacion': 'grilla', 'fuente_dem': None
+}
+
+
+@pytest.fixture
+def parcela_lotes(monkeypatch):
+    monkeypatch.setattr(app, 'modo_offline_basemap', True)
+    monkeypatch.setattr(app, 'obtener_datos_nasa_power', lambda *args, **kwargs: None)
+    gdf = gpd.GeoDataFrame(
+        {'nombre_lote': ['Norte', 'Sur']},
+        geometry=[box(-60.0, -33.0, -59.99, -32.99), box(-60.0, -33.02, -59.985, -33.01)],
+        crs='EPSG:4326'
+    )
+    return app.Parcela(gdf)
+
+
+def test_lotes_en_pool_coinciden_con_el_analisis_detallado(monkeypatch, parcela_lotes):
+    monkeypatch.setattr(app, 'LOTES_MAX_PROCESOS', 2)
+    enviados = []
+    pool_original = app.ProcessPoolExecutor
+
+    class PoolRegistrado(pool_original):
+        def submit(self, funcion, *args, **kwargs):
+            enviados.append(args[0][0])
+            return super().submit(funcion, *args, **kwargs)
+
+    monkeypatch.setattr(app, 'ProcessPoolExecutor', PoolRegistrado)
+    avances = []
+
+    resumenes = app.ejecutar_analisis_por_lotes(parcela_lotes, PARAMETROS, lambda hechos, total: avances.append(hechos))
+
+    assert sorted(enviados) == ['Norte', 'Sur']
+    assert avances == [1, 2]
+    assert list(resumenes) == ['Norte', 'Sur']
+    for nombre, resumen in resumenes.items():
+        assert resumen['exitoso']
+        assert 'dem_data' not in resumen
+        detalle = app.ejecutar_analisis_completo(resumen['gdf_lote'], **PARAMETROS)
+        assert detalle['exitoso']
+        assert resumen['area_total'] == pytest.approx(detalle['area_total'])
+        pd.testing.assert_frame_equal(
+            pd.DataFrame(resumen['gdf_completo'].drop(columns='geometry')),
+            pd.DataFrame(detalle['gdf_completo'].drop(columns='geometry'))
+        )
+
+    tabla = app.tabla_consolidada_lotes(resumenes)
+    assert list(tabla['Estado']) == ['OK', 'OK']
+
+
+def test_lotes_en_serie_sin_pool(monkeypatch, parcela_lotes):
+    monkeypatch.setattr(app, 'LOTES_MAX_PROCESOS', 1)
+
+    resumenes = app.ejecutar_analisis_por_lotes(parcela_lotes, PARAMETROS)
+
+    assert all(r['exitoso'] for r in resumenes.values())
+    assert set(resumenes['Sur']) >= {'gdf_lote', 'area_total', 'semilla', 'gdf_completo', 'huella'}
@@ -0,0 +1,54 @@
+"""Celdas del almacén NASA POWER: grilla meteorológica y grilla solar."""
+import math
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+def _descarga_falsa(consultas):
+    def descargar(lat, lon, inicio, fin):
+        consultas.append((lat, lon))
+        # El punto de consulta nunca cae sobre un borde de la grilla solar
+        assert lat != math.floor(lat) and lon != math.floor(lon)
+        fechas = pd.date_range(inicio, fin, freq='D')
+        return pd.DataFrame({
+            'fecha': fechas,
+            'radiacion_solar': float(math.floor(lat) * 1000 + math.floor(lon)),
+            'viento_2m': 2.0,
+            'temperatura': round(lat * 2) / 2,
+            'precipitacion': 0.0,
+        })
+    return descargar
+
+
+def test_misma_celda_meteorologica_distinta_celda_solar(tmp_path, monkeypatch):
+    consultas = []
+    monkeypatch.setattr(app, 'descargar_nasa_power', _descarga_falsa(consultas))
+    almacen = app.AlmacenNasaPower(str(tmp_path / 'power.sqlite'))
+    inicio, fin = datetime(2024, 1, 1), datetime(2024, 1, 10)
+
+    # Ambas parcelas caen en la celda MERRA-2 centrada en (-33.0, -60.0)
+    assert app.celda_nasa_power(-32.9, -59.8)[0].split('_s')[0] == app.celda_nasa_power(-33.1, -59.8)[0].split('_s')[0]
+
+    norte = almacen.obtener_serie(-32.9, -59.8, inicio, fin)
+    sur = almacen.obtener_serie(-33.1, -59.8, inicio, fin)
+
+    assert len(consultas) == 2
+    assert (norte['radiacion_solar'] == -33 * 1000 - 60).all()
+    assert (sur['radiacion_solar'] == -34 * 1000 - 60).all()
+    # La temperatura sigue siendo la de la misma celda meteorológica
+    assert (norte['temperatura'] == sur['temperatura']).all()
+
+
+def test_punto_de_consulta_dentro_de_ambas_celdas():
+    for lat, lon in [(-33.0, -60.0), (-32.76, -59.69), (-33.24, -60.31), (45.5, 7.3)]:
+        celda, lat_c, lon_c = app.celda_nasa_power(lat, lon)
+        assert app.celda_nasa_power(lat_c, lon_c)[0] == celda
+        assert math.floor(lat_c) == math.floor(lat) and lat_c != math.floor(lat_c)
+        assert math.floor(lon_c) == math.floor(lon) and lon_c != math.floor(lon_c)
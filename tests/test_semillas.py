@@ -0,0 +1,64 @@
+"""Siembra determinista del terreno sintético."""
+import os
+import sys
+
+from datetime import datetime
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+def test_terreno_montanoso_con_generator_es_reproducible():
+    x = np.linspace(-68.9, -68.89, 60)
+    y = np.linspace(-32.9, -32.89, 60)
+    X, Y = np.meshgrid(x, y)
+
+    Z1 = app.generar_terreno_montanoso(X, Y, -32.9, -68.9, semilla=7)
+    Z2 = app.generar_terreno_montanoso(X, Y, -32.9, -68.9, semilla=7)
+
+    assert Z1.shape == X.shape
+    assert np.array_equal(Z1, Z2)
+
+
+def test_ruido_fractal_acepta_generator():
+    ruido = app.generar_ruido_fractal((32, 48), 4, np.random.default_rng(3))
+    assert ruido.shape == (32, 48)
+    assert ruido.min() >= -1 and ruido.max() <= 1
+
+
+def _parcela():
+    return app.Parcela(gpd.GeoDataFrame(geometry=[box(-60.0, -33.0, -59.99, -32.99)], crs='EPSG:4326'))
+
+
+def test_misma_parcela_y_configuracion_dan_zonas_identicas():
+    parcela = _parcela()
+    semilla = app.derivar_semilla(parcela.huella, 'TRIGO', 9, 'SENTINEL-2')
+    datos = app.generar_datos_simulados(parcela.gdf, 'TRIGO', 'NDVI', app.derivar_semilla(semilla, 'satelite'),
+                                        datetime(2024, 2, 1))
+
+    primera = app.analizar_zonas(parcela, 'TRIGO', 9, datos, semilla)
+    segunda = app.analizar_zonas(_parcela(), 'TRIGO', 9, datos, semilla)
+
+    pd.testing.assert_frame_equal(primera['gdf_completo'], segunda['gdf_completo'])
+
+
+def test_analisis_completo_reproducible_y_semilla_depende_de_la_configuracion(monkeypatch):
+    monkeypatch.setattr(app, 'modo_offline_basemap', True)
+    monkeypatch.setattr(app, 'obtener_datos_nasa_power', lambda *args, **kwargs: None)
+    parametros = {'n_divisiones': 9, 'satelite': 'SENTINEL-2',
+                  'fecha_inicio': datetime(2024, 1, 1), 'fecha_fin': datetime(2024, 2, 1)}
+
+    primero = app.ejecutar_analisis_completo(_parcela(), 'TRIGO', **parametros)
+    segundo = app.ejecutar_analisis_completo(_parcela(), 'TRIGO', **parametros)
+    otro_cultivo = app.ejecutar_analisis_completo(_parcela(), 'MAIZ', **parametros)
+
+    assert primero['exitoso'] and segundo['exitoso'] and otro_cultivo['exitoso']
+    assert primero['semilla'] == segundo['semilla']
+    pd.testing.assert_frame_equal(primero['gdf_completo'], segundo['gdf_completo'])
+    assert otro_cultivo['semilla'] != primero['semilla']
@@ -0,0 +1,40 @@
+"""Almacén de teselas SRTM: una descarga lenta no bloquea las demás teselas."""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app  # noqa: E402
+
+
+def test_descarga_lenta_no_bloquea_otras_teselas(tmp_path, monkeypatch):
+    almacen = app.AlmacenTeselasSRTM(str(tmp_path))
+    open(almacen.ruta_tesela(-33, -61), 'wb').close()
+    liberar = threading.Event()
+    en_curso = threading.Event()
+    descargadas = []
+
+    def descargar(lat_sw, lon_sw, ruta):
+        if (lat_sw, lon_sw) == (-33, -60):
+            en_curso.set()
+            assert liberar.wait(10)
+        descargadas.append((lat_sw, lon_sw))
+        open(ruta, 'wb').close()
+
+    monkeypatch.setattr(almacen, '_descargar_tesela', descargar)
+    lenta = threading.Thread(target=almacen.asegurar_teselas, args=(-59.5, -32.5, -59.4, -32.4))
+    lenta.start()
+    try:
+        assert en_curso.wait(10)
+        # Mientras la tesela (-33, -60) se descarga, una tesela ya cacheada y otra nueva siguen disponibles
+        assert almacen.asegurar_teselas(-60.5, -32.5, -60.4, -32.4) == [almacen.ruta_tesela(-33, -61)]
+        assert almacen.asegurar_teselas(-58.5, -32.5, -58.4, -32.4) == [almacen.ruta_tesela(-33, -59)]
+        assert descargadas == [(-33, -59)]
+    finally:
+        liberar.set()
+        lenta.join(10)
+
+    assert sorted(descargadas) == [(-33, -60), (-33, -59)]
+    assert almacen.estadisticas()['descargas'] == 2
+    assert almacen.estadisticas()['aciertos'] == 1